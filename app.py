@@ -1,5 +1,6 @@
 import os
 import logging
+import multiprocessing
 from datetime import datetime
 
 from flask import Flask, render_template
@@ -8,8 +9,7 @@ from sqlalchemy.orm import DeclarativeBase
 from flask_login import LoginManager, current_user
 from flask_cors import CORS
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from logconfig import configure_logging, parse_levels
 
 # Create base class for SQLAlchemy models
 class Base(DeclarativeBase):
@@ -31,13 +31,128 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["UPLOAD_FOLDER"] = os.path.join(os.getcwd(), "static", "uploads")
 app.config["QR_CODE_FOLDER"] = os.path.join(os.getcwd(), "static", "qr_codes")
+app.config["FOLDER_CACHE_TTL"] = 10  # Seconds a process reuses a folder snapshot (see folder_cache.py)
+app.config["FOLDER_CACHE_SIZE"] = 10000  # Snapshots kept per process
+app.config["FOLDER_CACHE_REDIS_URL"] = os.environ.get("FOLDER_CACHE_REDIS_URL")  # Optional shared tier, e.g. redis://localhost:6379/0
+app.config["FOLDER_CACHE_SHARED_TTL"] = 300  # Seconds a snapshot lives in the shared tier
+app.config["SCAN_SESSION_SECONDS"] = 60  # Lifetime of a scan session token
+app.config["SHARE_TOKEN_TTL"] = 24 * 60 * 60  # Seconds a share link stays valid (see sharing.py)
+app.config["SHARE_DENYLIST_REFRESH"] = 30  # Seconds before other processes notice a revoked share link
+app.config["SHARE_MAX_AGE"] = 300  # Browser/proxy cache lifetime of a shared photo page
+app.config["SHARE_PAGE_CACHE_TTL"] = 60  # Seconds a process reuses a rendered shared photo page
+app.config["SHARE_PAGE_CACHE_SIZE"] = 1024  # Rendered pages kept per process
+app.config["QR_SIZES"] = (4, 10, 20)  # Pixels per QR module that may be requested
+app.config["QR_DEFAULT_SIZE"] = 10
+app.config["QR_CACHE_SIZE"] = 256  # Rendered QR codes kept in memory per process
+app.config["QR_MAX_AGE"] = 24 * 60 * 60  # Browser cache lifetime for QR codes
+app.config["QR_SWEEP_BATCH_SIZE"] = 500  # Files checked per database lookup by sweep-qr-codes
+app.config["QR_SWEEP_MIN_AGE"] = 60 * 60  # Seconds before an unreferenced QR file may be swept
+app.config["THUMBNAIL_FOLDER"] = os.path.join(os.getcwd(), "static", "thumbnails")
+app.config["THUMBNAIL_WIDTHS"] = (320, 640, 1280)  # Widths offered in srcset
+app.config["THUMBNAIL_FORMATS"] = ("webp", "jpeg")
+app.config["THUMBNAIL_QUALITY"] = 80
+app.config["THUMBNAIL_ON_UPLOAD"] = True  # Otherwise thumbnails are made on first request
+app.config["THUMBNAIL_MAX_AGE"] = 7 * 24 * 60 * 60  # Browser cache lifetime for thumbnails
+app.config["IMAGE_WORKERS"] = int(os.environ.get("IMAGE_WORKERS", "2"))  # Image processes per app process (see imagepool.py), 0 runs jobs inline
+app.config["IMAGE_QUEUE_SIZE"] = 64  # Image jobs queued or running at once per app process
+app.config["IMAGE_QUEUE_WAIT"] = 5  # Seconds to wait for a queue slot before giving up
+app.config["IMAGE_JOB_TIMEOUT"] = 60  # Seconds a request waits for an image job
+app.config["NORMALIZE_IMAGES"] = True  # Re-encode uploads on ingest (see normalize.py)
+app.config["NORMALIZE_MAX_EDGE"] = 2560  # Longest side in pixels after normalizing
+app.config["NORMALIZE_FORMAT"] = os.environ.get("NORMALIZE_FORMAT", "jpeg")  # "jpeg", "webp" or "avif"
+app.config["NORMALIZE_QUALITY"] = 85
+app.config["NORMALIZE_KEEP_ORIGINALS"] = False  # Also store the file as uploaded
+app.config["PHOTOS_PER_PAGE"] = 48  # Gallery page size
+app.config["PHOTOS_MAX_PER_PAGE"] = 200
+app.config["ADMIN_PAGE_SIZE"] = 25  # Rows per page in the admin user/folder tables
+app.config["ADMIN_STATS_TTL"] = 30  # Seconds the admin dashboard totals are cached
+app.config["ADMIN_STATS_DAYS"] = 14  # Days shown in the uploads-per-day chart
+app.config["CHUNK_FOLDER"] = os.path.join(os.getcwd(), "upload_chunks")  # Resumable upload chunks, not web-served
+app.config["RESUMABLE_CHUNK_SIZE"] = 1024 * 1024  # Bytes per resumable upload chunk
+app.config["RESUMABLE_UPLOAD_TTL"] = 24 * 60 * 60  # Seconds a resumable upload may take
+app.config["RESUMABLE_PURGE_BATCH_SIZE"] = 500  # Expired sessions deleted per transaction
 app.config["ALLOWED_EXTENSIONS"] = {"png", "jpg", "jpeg", "gif"}
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max upload size
+app.config["BATCH_MAX_CONTENT_LENGTH"] = 200 * 1024 * 1024  # Request size limit for /upload/batch
+app.config["BATCH_MAX_FILES"] = 50
+app.config["MAX_FILE_SIZE"] = 16 * 1024 * 1024  # Per-file limit enforced while streaming uploads
+app.config["MAX_FORM_MEMORY_SIZE"] = 64 * 1024  # Limit for non-file form fields
+app.config["UPLOAD_CHUNK_SIZE"] = 64 * 1024  # Bytes read from the request per write
+app.config["CATBOX_API_URL"] = os.environ.get("CATBOX_API_URL", "https://catbox.moe/user/api.php")
+app.config["CATBOX_TIMEOUT"] = 10  # Seconds to wait for catbox.moe
+app.config["CATBOX_FILES_URL"] = "https://files.catbox.moe"
+
+# S3-compatible storage backend (see storage.py); enabled when a bucket is set
+app.config["S3_ENDPOINT_URL"] = os.environ.get("S3_ENDPOINT_URL", "https://s3.amazonaws.com")
+app.config["S3_BUCKET"] = os.environ.get("S3_BUCKET")
+app.config["S3_ACCESS_KEY"] = os.environ.get("S3_ACCESS_KEY")
+app.config["S3_SECRET_KEY"] = os.environ.get("S3_SECRET_KEY")
+app.config["S3_REGION"] = os.environ.get("S3_REGION", "us-east-1")
+app.config["S3_PUBLIC_URL"] = os.environ.get("S3_PUBLIC_URL")  # Public base URL if the bucket is readable; otherwise URLs are presigned
+app.config["S3_PRESIGN_SECONDS"] = 3600
+app.config["S3_TIMEOUT"] = 30
+
+# Serving photo files (see media.py)
+app.config["MEDIA_IMMUTABLE_MAX_AGE"] = 365 * 24 * 60 * 60  # Browser cache lifetime for content-addressed files
+app.config["MEDIA_SENDFILE"] = os.environ.get("MEDIA_SENDFILE")  # "x-accel-redirect" (nginx) or "x-sendfile" (Apache) to let the proxy send files
+app.config["MEDIA_ROOT"] = os.path.join(os.getcwd(), "static")  # Directory nginx maps to MEDIA_ACCEL_PREFIX
+app.config["MEDIA_ACCEL_PREFIX"] = "/_media"  # nginx internal location serving MEDIA_ROOT
+
+# Background offload of cloud-storage photos to catbox.moe (see offload.py)
+app.config["OFFLOAD_WORKERS"] = int(os.environ.get("OFFLOAD_WORKERS", "1"))  # Worker threads per process, 0 disables
+app.config["OFFLOAD_MAX_ATTEMPTS"] = 5
+app.config["OFFLOAD_BACKOFF_SECONDS"] = 30  # Doubled after each failed attempt
+app.config["OFFLOAD_BACKOFF_MAX_SECONDS"] = 3600
+app.config["OFFLOAD_LEASE_SECONDS"] = 300  # A running job not finished by then is claimed again
+app.config["OFFLOAD_POLL_INTERVAL"] = 2  # Seconds between queue polls when idle
+
+# Removal of deleted photos' files (see deletion.py)
+app.config["FILE_REMOVAL_INTERVAL"] = int(os.environ.get("FILE_REMOVAL_INTERVAL", "5"))  # Seconds between runs, 0 disables
+app.config["FILE_REMOVAL_BATCH_SIZE"] = 500
+app.config["FILE_REMOVAL_MAX_ATTEMPTS"] = 5
+app.config["FILE_REMOVAL_BACKOFF_SECONDS"] = 60  # Doubled after each failed attempt
+app.config["BULK_DELETE_MAX_PHOTOS"] = 1000  # Photos per /photos/delete request
+
+# Deactivation of folders past their QR code expiry (see expiry.py)
+app.config["FOLDER_EXPIRY_INTERVAL"] = int(os.environ.get("FOLDER_EXPIRY_INTERVAL", "60"))  # Seconds between runs, 0 disables
+app.config["FOLDER_EXPIRY_BATCH_SIZE"] = 500
+app.config["FOLDER_EXPIRY_ARCHIVE_BACKEND"] = os.environ.get("FOLDER_EXPIRY_ARCHIVE_BACKEND")  # e.g. "s3" to move expired local folders there
+
+# Per-request query counting and /metrics (see querystats.py)
+app.config["QUERY_BUDGET"] = int(os.environ.get("QUERY_BUDGET", "20"))  # Queries a request may run before it is logged as over budget
+app.config["QUERY_BUDGETS"] = {  # Per-endpoint overrides of QUERY_BUDGET
+    "upload_batch": 400,  # A few statements per file, up to BATCH_MAX_FILES
+}
+app.config["QUERY_STATS_HEADERS"] = os.environ.get("QUERY_STATS_HEADERS", "1") == "1"  # Send X-DB-Query-Count, X-DB-Time-Ms and Server-Timing
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")  # Lets scrapers read /metrics with "Authorization: Bearer <token>"; otherwise only admins can
+
+# Logging (see logconfig.py)
+app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO")
+app.config["LOG_LEVELS"] = {  # Per-logger levels; LOG_LEVELS="offload=DEBUG,werkzeug=WARNING" adds to these
+    "sqlalchemy": "WARNING",
+    "urllib3": "WARNING",
+    "PIL": "INFO",
+    **parse_levels(os.environ.get("LOG_LEVELS")),
+}
+app.config["LOG_FORMAT"] = os.environ.get("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+app.config["LOG_SAMPLE_RATE"] = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))  # Share of requests whose high-volume info logs are kept
+app.config["LOG_QUEUE_SIZE"] = 10000  # Records waiting for the writer thread before new ones are dropped
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 
+# Image worker processes (see imagepool.py) are spawned and re-import the
+# main module, and with it this one; they only need the code, so the
+# logging, schema and background thread setup below is for the app process
+IS_APP_PROCESS = multiprocessing.current_process().name == "MainProcess"
+
+# Structured logging written by a background thread, with request ids
+if IS_APP_PROCESS:
+    configure_logging(app)
+
 # Ensure upload and QR code directories exist
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 os.makedirs(app.config["QR_CODE_FOLDER"], exist_ok=True)
+os.makedirs(app.config["THUMBNAIL_FOLDER"], exist_ok=True)
+os.makedirs(app.config["CHUNK_FOLDER"], exist_ok=True)
 
 # Initialize extensions with app
 db.init_app(app)
@@ -51,11 +166,38 @@ def inject_now():
 
 # Import models and routes
 with app.app_context():
-    from models import User, PhotoFolder, Photo  # noqa: F401
+    from models import User, PhotoFolder, Photo, OffloadJob, PhotoThumbnail, PhotoBlob, UploadSession, FileTombstone, RevokedShare  # noqa: F401
     import routes  # noqa: F401
+    import offload
+    import expiry
+    import deletion
+    import migrations
+    import counters
+    import blobstore  # noqa: F401
     
-    # Create database tables
-    db.create_all()
+    if IS_APP_PROCESS:
+        # Create database tables
+        db.create_all()
+        
+        # Add columns and indexes that create_all doesn't add to existing tables
+        try:
+            schema_changes = migrations.upgrade_schema()
+            
+            # Counter columns added to an existing database start at zero
+            if any(change.endswith(".photo_count") for change in schema_changes):
+                counters.reconcile_counters()
+        except Exception as e:
+            db.session.rollback()
+            logging.getLogger(__name__).error(f"Schema upgrade failed: {str(e)}")
+        
+        # Start the catbox.moe offload workers
+        offload.start_offload_workers()
+        
+        # Start deactivating folders as their QR codes expire
+        expiry.start_expiry_scheduler()
+        
+        # Start removing the files of deleted photos
+        deletion.start_file_removal_worker()
     
     # Register routes blueprint
     # Note: We're using direct imports, so we don't need to register a blueprint
@@ -0,0 +1,372 @@
+"""Load test for the upload, scan, gallery and admin endpoints.
+
+Runs the app in this process behind a threaded WSGI server, seeds a fresh
+database with synthetic users, folders and photos, then drives each
+endpoint at increasing concurrency and reports latency percentiles,
+throughput and SQL query counts (from the X-DB-Query-Count header, see
+querystats.py).
+
+    python benchmark.py                                   # SQLite in a temporary directory
+    python benchmark.py --database postgresql://localhost/photobooth_bench --reset
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json           # exit status 1 on regression
+
+Everything the app writes (database, uploads, thumbnails) goes to the
+working directory, a temporary one by default.
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+ENDPOINTS = ('scan', 'upload', 'gallery', 'admin')
+
+BENCH_PASSWORD = 'benchmark-password'
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', help="Database URL; a SQLite file in the working directory by default")
+    parser.add_argument('--reset', action='store_true',
+                        help="Drop and recreate all tables first (required for a database that has users)")
+    parser.add_argument('--workdir', help="Directory for uploads and the SQLite file; temporary by default")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help="Comma-separated subset of: " + ', '.join(ENDPOINTS))
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated client thread counts")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument('--warmup', type=int, default=10, help="Untimed requests before each run")
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--folders', type=int, default=4, help="Folders per user")
+    parser.add_argument('--photos', type=int, default=200, help="Photos per folder")
+    parser.add_argument('--image-size', default='1600x1200', help="Width x height of uploaded JPEGs")
+    parser.add_argument('--image-workers', type=int, help="IMAGE_WORKERS for the app; the app's default otherwise")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed, for reproducible data and request order")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Compare with a baseline written by --output")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed p95 latency increase and throughput drop before --compare fails (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+def configure_environment(args, workdir):
+    """Set the app's environment before it is imported."""
+    os.environ['DATABASE_URL'] = args.database or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    # Nothing leaves the machine, and background threads don't compete with the requests being measured
+    os.environ['OFFLOAD_WORKERS'] = '0'
+    os.environ['FOLDER_EXPIRY_INTERVAL'] = '0'
+    os.environ['FILE_REMOVAL_INTERVAL'] = '0'
+    os.environ['QUERY_STATS_HEADERS'] = '1'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('LOG_LEVELS', 'werkzeug=WARNING')
+    if args.image_workers is not None:
+        os.environ['IMAGE_WORKERS'] = str(args.image_workers)
+
+def seed(args):
+    """Create the synthetic users, folders and photos.
+
+    Photos are inserted as rows pointing at one shared file; the gallery and
+    admin pages only read rows and thumbnail URLs, and uploads are measured
+    separately.
+
+    Returns:
+        tuple: (users as (email, folder keys), admin email)
+    """
+    from werkzeug.security import generate_password_hash
+    from app import app, db
+    from models import User, PhotoFolder, Photo
+    from counters import reconcile_counters
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            db.create_all()
+        elif User.query.first() is not None:
+            sys.exit("The database already has users; pass --reset to drop and recreate its tables")
+
+        password_hash = generate_password_hash(BENCH_PASSWORD)
+        users = [
+            User(email=f"bench{index}@example.com", name=f"Bench User {index}", password_hash=password_hash, is_admin=index == 0)
+            for index in range(args.users)
+        ]
+        db.session.add_all(users)
+        db.session.flush()
+
+        folders = [
+            PhotoFolder(folder_name=f"Bench Folder {user.id}-{index}", folder_key=f"bench-{user.id}-{index}-{rng.getrandbits(64):016x}",
+                        is_local=True, storage_backend='local', user_id=user.id, qr_code_active=True)
+            for user in users for index in range(args.folders)
+        ]
+        db.session.add_all(folders)
+        db.session.flush()
+
+        for folder in folders:
+            db.session.execute(db.insert(Photo), [
+                {
+                    'file_name': f"{folder.folder_key}-{index}.jpg",
+                    'original_name': f"IMG_{index:05d}.jpg",
+                    'file_url': "/static/uploads/benchmark.jpg",
+                    'file_size': rng.randint(200_000, 4_000_000),
+                    'mime_type': 'image/jpeg',
+                    'is_local': True,
+                    'user_id': folder.user_id,
+                    'folder_id': folder.id,
+                    'uploaded_at': datetime(2024, 1, 1, 12, rng.randint(0, 59), rng.randint(0, 59)),
+                }
+                for index in range(args.photos)
+            ])
+        db.session.commit()
+        reconcile_counters()
+
+        result = [(user.email, [folder.folder_key for folder in folders if folder.user_id == user.id]) for user in users]
+        return result, users[0].email
+
+def make_jpeg(rng, size):
+    """A JPEG with random content, so uploads aren't deduplicated."""
+    from PIL import Image
+
+    width, height = size
+    image = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    patch = Image.frombytes('RGB', (64, 64), rng.randbytes(64 * 64 * 3))
+    for _ in range(8):
+        # Partly off the edge is fine; Pillow clips the paste
+        image.paste(patch, (rng.randrange(max(width - 64, 1)), rng.randrange(max(height - 64, 1))))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+class Client:
+    """One requests.Session per thread and user, logged in on first use."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._local = threading.local()
+
+    def session(self, email=None):
+        import requests
+
+        sessions = self._local.__dict__.setdefault('sessions', {})
+        session = sessions.get(email)
+        if session is None:
+            session = requests.Session()
+            if email is not None:
+                response = session.post(f"{self.base_url}/login", data={'email': email, 'password': BENCH_PASSWORD}, allow_redirects=False)
+                if response.status_code != 302:
+                    raise RuntimeError(f"Could not log in as {email}: {response.status_code}")
+            sessions[email] = session
+        return session
+
+def build_request(endpoint, client, users, admin_email, rng, image_size):
+    """Prepare one request; returns a callable performing it, so setup isn't timed."""
+    email, folder_keys = rng.choice(users)
+    folder_key = rng.choice(folder_keys)
+    base_url = client.base_url
+
+    if endpoint == 'scan':
+        return lambda: client.session().get(f"{base_url}/scan/{folder_key}")
+    if endpoint == 'upload':
+        data = make_jpeg(rng, image_size)
+        name = f"upload-{rng.getrandbits(32):08x}.jpg"
+        return lambda: client.session().post(
+            f"{base_url}/upload",
+            data={'folder_id': folder_key},
+            files={'file': (name, data, 'image/jpeg')}
+        )
+    if endpoint == 'gallery':
+        return lambda: client.session(email).get(f"{base_url}/folder/view/{folder_key}")
+    if endpoint == 'admin':
+        return lambda: client.session(admin_email).get(f"{base_url}/admin")
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def run_level(endpoint, concurrency, args, client, users, admin_email, rng, image_size):
+    """Send args.requests requests to an endpoint from `concurrency` threads."""
+    # Enough warmup for every thread to have logged in before the timed run
+    warmup_count = max(args.warmup, 2 * concurrency)
+    requests_to_send = [
+        build_request(endpoint, client, users, admin_email, rng, image_size)
+        for _ in range(warmup_count + args.requests)
+    ]
+    warmup, timed = requests_to_send[:warmup_count], requests_to_send[warmup_count:]
+
+    def send(perform):
+        started = time.perf_counter()
+        try:
+            response = perform()
+            ok = response.status_code < 400
+            queries = response.headers.get('X-DB-Query-Count')
+        except Exception:
+            ok, queries = False, None
+        return time.perf_counter() - started, ok, int(queries) if queries is not None else None
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, warmup))
+        started = time.perf_counter()
+        outcomes = list(pool.map(send, timed))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, ok, _ in outcomes if ok)
+    queries = [count for _, ok, count in outcomes if ok and count is not None]
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(outcomes),
+        'errors': sum(1 for _, ok, _ in outcomes if not ok),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'max': latencies[-1] if latencies else None,
+        },
+        'queries': {
+            'mean': sum(queries) / len(queries) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def print_results(results):
+    print(f"{'endpoint':10} {'conc':>4} {'ok':>5} {'err':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+    for result in results:
+        latency = result['latency_ms']
+        cells = [
+            f"{result['endpoint']:10}", f"{result['concurrency']:>4}",
+            f"{result['requests'] - result['errors']:>5}", f"{result['errors']:>4}",
+            f"{result['throughput_rps'] or 0:>8.1f}",
+        ] + [f"{latency[key]:>8.1f}" if latency[key] is not None else f"{'-':>8}" for key in ('p50', 'p95', 'p99')]
+        cells.append(f"{result['queries']['mean']:>8.1f}" if result['queries']['mean'] is not None else f"{'-':>8}")
+        print(' '.join(cells))
+
+def compare(results, baseline_path, tolerance):
+    """Print the change from a baseline; return False if anything regressed beyond `tolerance`."""
+    with open(baseline_path) as f:
+        baseline = {(result['endpoint'], result['concurrency']): result for result in json.load(f)['results']}
+
+    passed = True
+    print(f"\nCompared with {baseline_path} (tolerance {tolerance:.0%}):")
+    for result in results:
+        before = baseline.get((result['endpoint'], result['concurrency']))
+        if before is None:
+            continue
+        p95, p95_before = result['latency_ms']['p95'], before['latency_ms']['p95']
+        rps, rps_before = result['throughput_rps'], before['throughput_rps']
+        queries, queries_before = result['queries']['mean'], before['queries']['mean']
+
+        problems = []
+        if p95 and p95_before and p95 > p95_before * (1 + tolerance):
+            problems.append("p95 latency")
+        if rps and rps_before and rps < rps_before * (1 - tolerance):
+            problems.append("throughput")
+        # Occasional cache refreshes move the mean by a fraction of a query
+        if queries is not None and queries_before is not None and queries >= queries_before + 0.5:
+            problems.append("query count")
+        if result['errors'] > before['errors']:
+            problems.append("errors")
+        passed = passed and not problems
+
+        print(
+            f"  {result['endpoint']:10} x{result['concurrency']:<3} "
+            f"p95 {p95_before or 0:.1f} -> {p95 or 0:.1f} ms, "
+            f"{rps_before or 0:.1f} -> {rps or 0:.1f} req/s, "
+            f"queries {queries_before if queries_before is not None else '-'} -> {queries if queries is not None else '-'}"
+            + (f"  REGRESSED: {', '.join(problems)}" if problems else "")
+        )
+    return passed
+
+def main(argv=None):
+    args = parse_args(argv)
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+    image_size = tuple(int(part) for part in args.image_size.lower().split('x'))
+    # Relative to where the benchmark was started, not the working directory
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='photobooth-bench-'))
+    os.makedirs(workdir, exist_ok=True)
+    # The app keeps uploads, thumbnails and QR codes under the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    configure_environment(args, workdir)
+
+    from werkzeug.serving import make_server
+    from app import app, db
+
+    try:
+        users, admin_email = seed(args)
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], 'benchmark.jpg'), 'wb') as f:
+            f.write(make_jpeg(random.Random(args.seed), (640, 480)))
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+        client = Client(f"http://127.0.0.1:{server.server_port}")
+
+        rng = random.Random(args.seed)
+        results = []
+        for endpoint in endpoints:
+            for concurrency in levels:
+                print(f"{endpoint} x{concurrency}...", file=sys.stderr)
+                results.append(run_level(endpoint, concurrency, args, client, users, admin_email, rng, image_size))
+        server.shutdown()
+
+        with app.app_context():
+            dialect = db.engine.dialect.name
+
+        report = {
+            'meta': {
+                'created_at': datetime.utcnow().isoformat() + 'Z',
+                'commit': git_commit(),
+                'database': dialect,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'image_workers': app.config['IMAGE_WORKERS'],
+                'users': args.users,
+                'folders_per_user': args.folders,
+                'photos_per_folder': args.photos,
+                'requests': args.requests,
+                'image_size': args.image_size,
+                'seed': args.seed,
+            },
+            'results': results,
+        }
+
+        print_results(results)
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+        passed = compare(results, baseline, args.tolerance) if baseline else True
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return 0 if passed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import os
+import hashlib
+import logging
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import Photo, PhotoBlob
+from ingest import sniff_mime_type, SIGNATURE_LENGTH
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# File extension used for each stored MIME type
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/avif': 'avif',
+}
+
+def blob_relative_path(sha256, mime_type):
+    """Path of a blob relative to UPLOAD_FOLDER, fanned out by hash prefix."""
+    ext = EXTENSIONS.get(mime_type, 'bin')
+    return os.path.join('blobs', sha256[:2], f"{sha256}.{ext}")
+
+def blob_path(sha256, mime_type):
+    """Return the file path of a blob."""
+    return os.path.join(app.config['UPLOAD_FOLDER'], blob_relative_path(sha256, mime_type))
+
+def blob_url(blob):
+    """Return the URL a blob is served at."""
+    return f"/static/uploads/{blob_relative_path(blob.sha256, blob.mime_type).replace(os.sep, '/')}"
+
+def _acquire_existing(sha256):
+    """Add a reference to the blob with this hash, if there is one."""
+    updated = PhotoBlob.query.filter_by(sha256=sha256).update(
+        {PhotoBlob.ref_count: PhotoBlob.ref_count + 1}, synchronize_session=False
+    )
+    if not updated:
+        return None
+    return PhotoBlob.query.filter_by(sha256=sha256).one()
+
+def store_file(sha256, file_size, mime_type):
+    """Take a reference to the blob holding this content, creating its row if needed.
+
+    Only the blob row is touched, as part of the current transaction: the
+    file is moved into place by place_file once that has committed, so a
+    rolled-back upload never leaves a blob row without its file or removes
+    a file another photo uses.
+
+    Returns:
+        tuple: (PhotoBlob, bool whether the content was a duplicate)
+    """
+    blob = _acquire_existing(sha256)
+    if blob is not None:
+        return blob, True
+
+    blob = PhotoBlob(
+        sha256=sha256,
+        file_path=blob_path(sha256, mime_type),
+        file_size=file_size,
+        mime_type=mime_type,
+        ref_count=1
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(blob)
+    except IntegrityError:
+        # A concurrent upload of the same content created the blob first
+        blob = _acquire_existing(sha256)
+        return blob, True
+
+    return blob, False
+
+def place_file(file_path, destination):
+    """Move a file into the blob store after its blob row has committed.
+
+    A duplicate's file is dropped, unless the blob's file is missing: the
+    removal of an earlier blob with the same content may have deleted it
+    just before our row committed (see deletion.py), and any copy of the
+    content will do.
+    """
+    if os.path.exists(destination):
+        os.remove(file_path)
+        return
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.replace(file_path, destination)
+
+def store_upload(result):
+    """Take a blob reference for a file saved by ingest.stream_multipart_upload.
+
+    Sets the result's local_path and file_url to the blob's; the file stays
+    at result['temp_path'] until place_upload moves it.
+
+    Returns:
+        PhotoBlob: The blob, with a reference taken for the new photo
+    """
+    blob, duplicate = store_file(result['sha256'], result['file_size'], result['mime_type'])
+    result['local_path'] = blob.file_path
+    result['file_url'] = blob_url(blob)
+    result['deduplicated'] = duplicate
+    if duplicate:
+        logger.debug("Upload %s duplicates blob %s", result['original_name'], blob.id)
+    return blob
+
+def store_original(result):
+    """Take a blob reference for the file as uploaded, when normalize.py kept it.
+
+    Returns:
+        PhotoBlob or None: The original's blob, with a reference taken
+    """
+    original = result.get('original')
+    if original is None:
+        return None
+    blob, _ = store_file(original['sha256'], original['file_size'], original['mime_type'])
+    original['local_path'] = blob.file_path
+    return blob
+
+def place_upload(result):
+    """Move an upload's files into the blob store once its photo has committed."""
+    files = [result]
+    if result.get('original') is not None:
+        files.append(result['original'])
+    for stored in files:
+        try:
+            place_file(stored['temp_path'], stored['local_path'])
+        except OSError as e:
+            logger.error(f"Could not move {stored['temp_path']} to {stored['local_path']}: {str(e)}")
+
+def _hash_file(file_path):
+    """Return (sha256 hex digest, size, leading bytes) of a file."""
+    hasher = hashlib.sha256()
+    size = 0
+    head = b''
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(app.config['UPLOAD_CHUNK_SIZE']), b''):
+            if not head:
+                head = chunk[:SIGNATURE_LENGTH]
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size, head
+
+def migrate_uploads_to_blobs(batch_size=100):
+    """Move photos saved before the blob store into it.
+
+    Each photo's file is hashed and moved to (or, when the content is already
+    stored, replaced by) its blob, and the photo is pointed at the blob.
+
+    Returns:
+        dict: Counts of photos migrated, duplicates removed, files missing and bytes freed
+    """
+    stats = {'migrated': 0, 'duplicates': 0, 'missing': 0, 'bytes_freed': 0}
+    last_id = 0
+
+    while True:
+        photos = Photo.query.filter(
+            Photo.blob_id.is_(None), Photo.local_path.isnot(None), Photo.id > last_id
+        ).order_by(Photo.id).limit(batch_size).all()
+        if not photos:
+            break
+
+        moves = []
+        for photo in photos:
+            last_id = photo.id
+            if not os.path.exists(photo.local_path):
+                stats['missing'] += 1
+                continue
+
+            sha256, size, head = _hash_file(photo.local_path)
+            mime_type = photo.mime_type if photo.mime_type in EXTENSIONS else sniff_mime_type(head)
+            blob, duplicate = store_file(sha256, size, mime_type)
+            moves.append((photo.local_path, blob.file_path))
+
+            photo.blob_id = blob.id
+            photo.local_path = blob.file_path
+            if photo.is_local:
+                photo.file_url = blob_url(blob)
+
+            stats['migrated'] += 1
+            if duplicate:
+                stats['duplicates'] += 1
+                stats['bytes_freed'] += size
+
+        db.session.commit()
+        for file_path, destination in moves:
+            place_file(file_path, destination)
+
+    logger.info(f"Blob migration: {stats}")
+    return stats
+
+@app.cli.command("migrate-blobs")
+def migrate_blobs_command():
+    """Move existing uploads into the content-addressed blob store."""
+    print(migrate_uploads_to_blobs())
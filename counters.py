@@ -0,0 +1,73 @@
+import logging
+
+from sqlalchemy import func
+
+from app import app, db
+from models import User, PhotoFolder, Photo
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def adjust_photo_counters(folder_id, user_id, count, size):
+    """Add `count` photos and `size` bytes to a folder's and its owner's counters.
+
+    Uses in-place UPDATEs (column = column + delta) in the current transaction,
+    so concurrent uploads don't overwrite each other and the counters commit
+    or roll back together with the photo rows. Pass negative values on delete.
+    """
+    size = size or 0
+    if folder_id is not None:
+        PhotoFolder.query.filter_by(id=folder_id).update({
+            PhotoFolder.photo_count: PhotoFolder.photo_count + count,
+            PhotoFolder.total_bytes: PhotoFolder.total_bytes + size
+        }, synchronize_session=False)
+    if user_id is not None:
+        User.query.filter_by(id=user_id).update({
+            User.photo_count: User.photo_count + count,
+            User.total_bytes: User.total_bytes + size
+        }, synchronize_session=False)
+
+def record_photos_added(photos):
+    """Count new photos towards their folders and owners."""
+    totals = {}
+    for photo in photos:
+        count, size = totals.get((photo.folder_id, photo.user_id), (0, 0))
+        totals[(photo.folder_id, photo.user_id)] = (count + 1, size + (photo.file_size or 0))
+    for (folder_id, user_id), (count, size) in totals.items():
+        adjust_photo_counters(folder_id, user_id, count, size)
+
+def reconcile_counters():
+    """Recompute every folder and user counter from the photos table.
+
+    Used to backfill the counters and to repair any drift.
+
+    Returns:
+        int: Number of folders and users whose counters changed
+    """
+    changed = 0
+
+    for model, key in ((PhotoFolder, Photo.folder_id), (User, Photo.user_id)):
+        actual = {
+            owner_id: (count, size or 0)
+            for owner_id, count, size in db.session.query(
+                key, func.count(Photo.id), func.sum(Photo.file_size)
+            ).group_by(key)
+        }
+        for owner_id, photo_count, total_bytes in db.session.query(model.id, model.photo_count, model.total_bytes):
+            expected = actual.get(owner_id, (0, 0))
+            if (photo_count, total_bytes) != expected:
+                model.query.filter_by(id=owner_id).update({
+                    model.photo_count: expected[0],
+                    model.total_bytes: expected[1]
+                }, synchronize_session=False)
+                changed += 1
+
+    db.session.commit()
+    if changed:
+        logger.info(f"Reconciled photo counters on {changed} folders/users")
+    return changed
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters_command():
+    """Recompute folder and user photo counters."""
+    print(f"Fixed counters on {reconcile_counters()} folder(s)/user(s)")
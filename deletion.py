@@ -0,0 +1,276 @@
+import os
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, union
+
+from app import app, db
+from models import Photo, PhotoFolder, PhotoBlob, PhotoThumbnail, OffloadJob, FileTombstone
+from counters import adjust_photo_counters
+from thumbnails import thumbnail_dir
+from qrcodes import delete_folder_qr
+from storage import get_backend
+import resumable
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Worker thread started by start_file_removal_worker, and the event used to stop it
+_worker = None
+_stop_event = threading.Event()
+
+# Rows per IN (...) list, well under every database's parameter limit
+ID_CHUNK_SIZE = 500
+
+def bury(tombstones):
+    """Queue files for removal once the current transaction commits.
+
+    Args:
+        tombstones: dicts of FileTombstone columns ('kind', 'path', and
+            'backend' or 'sha256' where they apply)
+    """
+    if tombstones:
+        db.session.execute(db.insert(FileTombstone), tombstones)
+
+def _release_blobs(condition):
+    """Drop the blob references held by the photos matching `condition`.
+
+    Reference counts are decremented with one UPDATE ... FROM (grouped
+    counts) per blob column, whatever the number of photos. Call this before
+    deleting the photos; delete the returned blobs after them.
+
+    Returns:
+        list: (id, sha256, file path) of blobs whose last reference went
+    """
+    for column in (Photo.blob_id, Photo.original_blob_id):
+        references = db.select(
+            column.label('blob_id'), func.count(Photo.id).label('count')
+        ).where(condition, column.isnot(None)).group_by(column).subquery()
+        db.session.execute(
+            db.update(PhotoBlob)
+            .where(PhotoBlob.id == references.c.blob_id)
+            .values(ref_count=PhotoBlob.ref_count - references.c.count)
+            .execution_options(synchronize_session=False)
+        )
+
+    held = union(
+        db.select(Photo.blob_id).where(condition),
+        db.select(Photo.original_blob_id).where(condition)
+    )
+    return db.session.query(PhotoBlob.id, PhotoBlob.sha256, PhotoBlob.file_path).filter(
+        PhotoBlob.id.in_(held), PhotoBlob.ref_count <= 0
+    ).all()
+
+def delete_photos(condition):
+    """Delete the photos matching a SQL condition in a few set-based statements.
+
+    Thumbnail rows, offload jobs and the photos go in one DELETE each,
+    folder and owner counters are adjusted per folder, and blob references
+    are released in SQL. The files are not touched: thumbnails, legacy
+    files, released blobs and remote copies are queued as tombstones for
+    the removal worker. Changes are part of the current transaction; the
+    caller commits.
+
+    Args:
+        condition: e.g. Photo.id.in_(ids) or Photo.folder_id == folder_id
+
+    Returns:
+        int: Number of photos deleted
+    """
+    tombstones = []
+    for file_name, blob_id, local_path, storage_backend, storage_key in db.session.query(
+        Photo.file_name, Photo.blob_id, Photo.local_path, Photo.storage_backend, Photo.storage_key
+    ).filter(condition):
+        tombstones.append({'kind': FileTombstone.KIND_DIRECTORY, 'path': thumbnail_dir(os.path.splitext(file_name)[0])})
+        if blob_id is None and local_path:
+            tombstones.append({'kind': FileTombstone.KIND_FILE, 'path': local_path})
+        if storage_backend and storage_key:
+            tombstones.append({'kind': FileTombstone.KIND_REMOTE, 'path': storage_key, 'backend': storage_backend})
+    if not tombstones:
+        return 0
+
+    for folder_id, user_id, count, size in db.session.query(
+        Photo.folder_id, Photo.user_id, func.count(Photo.id), func.sum(Photo.file_size)
+    ).filter(condition).group_by(Photo.folder_id, Photo.user_id):
+        adjust_photo_counters(folder_id, user_id, -count, -(size or 0))
+
+    released = _release_blobs(condition)
+    tombstones.extend(
+        {'kind': FileTombstone.KIND_BLOB, 'path': file_path, 'sha256': sha256}
+        for _, sha256, file_path in released
+    )
+
+    photo_ids = db.select(Photo.id).where(condition)
+    PhotoThumbnail.query.filter(PhotoThumbnail.photo_id.in_(photo_ids)).delete(synchronize_session=False)
+    OffloadJob.query.filter(OffloadJob.photo_id.in_(photo_ids)).delete(synchronize_session=False)
+    deleted = Photo.query.filter(condition).delete(synchronize_session=False)
+
+    released_ids = [blob_id for blob_id, _, _ in released]
+    for start in range(0, len(released_ids), ID_CHUNK_SIZE):
+        PhotoBlob.query.filter(
+            PhotoBlob.id.in_(released_ids[start:start + ID_CHUNK_SIZE])
+        ).delete(synchronize_session=False)
+
+    bury(tombstones)
+    logger.info(f"Deleted {deleted} photo(s), queued {len(tombstones)} file(s) for removal")
+    return deleted
+
+def delete_folder(folder):
+    """Delete a folder with its photos and upload sessions (see delete_photos).
+
+    The caller commits, then invalidates the folder's snapshot.
+
+    Returns:
+        int: Number of photos deleted
+    """
+    deleted = delete_photos(Photo.folder_id == folder.id)
+
+    tombstones = [{'kind': FileTombstone.KIND_QR, 'path': folder.folder_key}]
+    tombstones.extend(
+        {'kind': FileTombstone.KIND_DIRECTORY, 'path': directory}
+        for directory in resumable.delete_folder_sessions(folder.id)
+    )
+    if folder.qr_code_url and folder.qr_code_url.startswith('/static/qr_codes/'):
+        # Saved before QR codes were cached by folder key
+        tombstones.append({
+            'kind': FileTombstone.KIND_FILE,
+            'path': os.path.join(app.config['QR_CODE_FOLDER'], os.path.basename(folder.qr_code_url))
+        })
+    bury(tombstones)
+
+    PhotoFolder.query.filter_by(id=folder.id).delete(synchronize_session=False)
+    return deleted
+
+def _blob_exists(sha256):
+    return db.session.query(PhotoBlob.id).filter_by(sha256=sha256).first() is not None
+
+def _remove_blob(tombstone):
+    """Remove a released blob's file, unless the same content has been stored again.
+
+    A new upload of the content may commit its blob row between the check
+    and the removal. Uploads move their file into place only after
+    committing, re-creating it if it is missing (blobstore.place_file), so
+    the file is moved aside first and the blob table checked again: if a
+    row has appeared, the file is put back.
+    """
+    if _blob_exists(tombstone.sha256):
+        return
+    aside = f"{tombstone.path}.removing"
+    try:
+        os.replace(tombstone.path, aside)
+    except FileNotFoundError:
+        # Already removed, or moved aside by an earlier attempt
+        if not os.path.exists(aside):
+            return
+
+    if _blob_exists(tombstone.sha256):
+        os.replace(aside, tombstone.path)
+    else:
+        try:
+            os.remove(aside)
+        except FileNotFoundError:
+            # Another process removed it first
+            pass
+
+def _remove(tombstone):
+    """Remove what a tombstone points at; missing files count as removed."""
+    if tombstone.kind == FileTombstone.KIND_FILE:
+        if os.path.exists(tombstone.path):
+            os.remove(tombstone.path)
+    elif tombstone.kind == FileTombstone.KIND_DIRECTORY:
+        if os.path.isdir(tombstone.path):
+            shutil.rmtree(tombstone.path)
+    elif tombstone.kind == FileTombstone.KIND_BLOB:
+        _remove_blob(tombstone)
+    elif tombstone.kind == FileTombstone.KIND_REMOTE:
+        get_backend(tombstone.backend).delete(tombstone.path)
+    elif tombstone.kind == FileTombstone.KIND_QR:
+        delete_folder_qr(tombstone.path)
+    else:
+        raise ValueError(f"Unknown tombstone kind: {tombstone.kind}")
+
+def remove_deleted_files(batch_size=None):
+    """Remove the files queued by delete_photos and delete_folder.
+
+    Failures are retried with exponential backoff and given up (and logged)
+    after FILE_REMOVAL_MAX_ATTEMPTS. Removal is idempotent, so several
+    processes can run this at once.
+
+    Returns:
+        int: Number of tombstones cleared
+    """
+    batch_size = batch_size or app.config['FILE_REMOVAL_BATCH_SIZE']
+    cleared = 0
+
+    while True:
+        now = datetime.utcnow()
+        due = FileTombstone.query.filter(
+            FileTombstone.next_attempt_at <= now
+        ).order_by(FileTombstone.id).limit(batch_size).all()
+        if not due:
+            break
+
+        done = []
+        for tombstone in due:
+            try:
+                _remove(tombstone)
+                done.append(tombstone.id)
+            except Exception as e:
+                tombstone.attempts += 1
+                tombstone.last_error = str(e)
+                if tombstone.attempts >= app.config['FILE_REMOVAL_MAX_ATTEMPTS']:
+                    logger.error(f"Giving up removing {tombstone.kind} {tombstone.path}: {str(e)}")
+                    done.append(tombstone.id)
+                else:
+                    delay = app.config['FILE_REMOVAL_BACKOFF_SECONDS'] * (2 ** (tombstone.attempts - 1))
+                    tombstone.next_attempt_at = now + timedelta(seconds=delay)
+
+        if done:
+            FileTombstone.query.filter(FileTombstone.id.in_(done)).delete(synchronize_session=False)
+        db.session.commit()
+        cleared += len(done)
+
+        if len(due) < batch_size:
+            break
+
+    if cleared:
+        logger.info(f"Removed files of {cleared} deleted item(s)")
+    return cleared
+
+def _worker_loop():
+    """Body of the worker thread: clear due tombstones every FILE_REMOVAL_INTERVAL seconds."""
+    interval = app.config['FILE_REMOVAL_INTERVAL']
+    while not _stop_event.wait(interval):
+        with app.app_context():
+            try:
+                remove_deleted_files()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"File removal error: {str(e)}")
+            finally:
+                db.session.remove()
+
+def start_file_removal_worker():
+    """Start the background thread that removes the files of deleted photos."""
+    global _worker
+    if not app.config['FILE_REMOVAL_INTERVAL'] or _worker is not None:
+        return
+    _stop_event.clear()
+    _worker = threading.Thread(target=_worker_loop, name="file-removal", daemon=True)
+    _worker.start()
+    logger.info(f"Started file removal worker (every {app.config['FILE_REMOVAL_INTERVAL']}s)")
+
+def stop_file_removal_worker(timeout=5):
+    """Signal the worker thread to stop and wait for it."""
+    global _worker
+    _stop_event.set()
+    if _worker is not None:
+        _worker.join(timeout)
+        _worker = None
+
+@app.cli.command("remove-deleted-files")
+def remove_deleted_files_command():
+    """Remove the files of deleted photos and folders now."""
+    print(f"Cleared {remove_deleted_files()} tombstone(s)")
@@ -0,0 +1,136 @@
+import logging
+import threading
+from datetime import datetime
+
+from app import app, db
+from models import PhotoFolder, Photo, OffloadJob
+from folder_cache import invalidate_folder_snapshot
+from resumable import purge_expired_sessions
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Scheduler thread started by start_expiry_scheduler, and the event used to stop it
+_scheduler = None
+_stop_event = threading.Event()
+
+def expire_folders(batch_size=None):
+    """Deactivate every active folder whose QR code has passed its expiry time.
+
+    Due folders are found through the (qr_code_active, qr_code_expires_at)
+    index and switched off with one UPDATE per batch. The UPDATE is
+    conditional on the folder still being active, so several processes can
+    run this at once. If FOLDER_EXPIRY_ARCHIVE_BACKEND is set, the photos of
+    expired local folders are queued for transfer to that backend.
+
+    Returns:
+        int: Number of folders deactivated
+    """
+    batch_size = batch_size or app.config['FOLDER_EXPIRY_BATCH_SIZE']
+    expired = 0
+
+    while True:
+        now = datetime.utcnow()
+        due = db.session.query(PhotoFolder.id, PhotoFolder.folder_key).filter_by(
+            qr_code_active=True
+        ).filter(
+            PhotoFolder.qr_code_expires_at <= now
+        ).order_by(PhotoFolder.qr_code_expires_at).limit(batch_size).all()
+        if not due:
+            break
+
+        folder_ids = [folder_id for folder_id, _ in due]
+        expired += PhotoFolder.query.filter(
+            PhotoFolder.id.in_(folder_ids)
+        ).filter_by(qr_code_active=True).update({PhotoFolder.qr_code_active: False}, synchronize_session=False)
+
+        if app.config['FOLDER_EXPIRY_ARCHIVE_BACKEND']:
+            archive_folders(folder_ids, app.config['FOLDER_EXPIRY_ARCHIVE_BACKEND'])
+
+        db.session.commit()
+
+        for _, folder_key in due:
+            invalidate_folder_snapshot(folder_key)
+
+        if len(due) < batch_size:
+            break
+
+    if expired:
+        logger.info(f"Deactivated {expired} expired folder(s)")
+    return expired
+
+def archive_folders(folder_ids, backend_name):
+    """Move the photos of local folders to another storage backend.
+
+    The folders are switched to the backend and their local photos are
+    queued for the offload workers. Changes are part of the current
+    transaction; the caller commits.
+
+    Returns:
+        int: Number of photos queued
+    """
+    local_ids = [
+        folder_id for (folder_id,) in db.session.query(PhotoFolder.id).filter(
+            PhotoFolder.id.in_(folder_ids)
+        ).filter_by(is_local=True)
+    ]
+    if not local_ids:
+        return 0
+
+    PhotoFolder.query.filter(PhotoFolder.id.in_(local_ids)).update({
+        PhotoFolder.is_local: False,
+        PhotoFolder.storage_backend: backend_name
+    }, synchronize_session=False)
+
+    now = datetime.utcnow()
+    jobs = [
+        OffloadJob(photo_id=photo_id, status=OffloadJob.STATUS_PENDING, next_attempt_at=now)
+        for (photo_id,) in db.session.query(Photo.id).filter(
+            Photo.folder_id.in_(local_ids)
+        ).filter_by(is_local=True)
+    ]
+    db.session.add_all(jobs)
+    logger.info(f"Archiving {len(jobs)} photo(s) from {len(local_ids)} expired folder(s) to {backend_name}")
+    return len(jobs)
+
+def _scheduler_loop():
+    """Body of the scheduler thread: every FOLDER_EXPIRY_INTERVAL seconds, expire
+    due folders and purge expired resumable upload sessions."""
+    interval = app.config['FOLDER_EXPIRY_INTERVAL']
+    while not _stop_event.wait(interval):
+        with app.app_context():
+            try:
+                expire_folders()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Folder expiry error: {str(e)}")
+            try:
+                purge_expired_sessions()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Upload session purge error: {str(e)}")
+            finally:
+                db.session.remove()
+
+def start_expiry_scheduler():
+    """Start the background thread that deactivates expired folders and purges expired uploads."""
+    global _scheduler
+    if not app.config['FOLDER_EXPIRY_INTERVAL'] or _scheduler is not None:
+        return
+    _stop_event.clear()
+    _scheduler = threading.Thread(target=_scheduler_loop, name="folder-expiry", daemon=True)
+    _scheduler.start()
+    logger.info(f"Started folder expiry scheduler (every {app.config['FOLDER_EXPIRY_INTERVAL']}s)")
+
+def stop_expiry_scheduler(timeout=5):
+    """Signal the scheduler thread to stop and wait for it."""
+    global _scheduler
+    _stop_event.set()
+    if _scheduler is not None:
+        _scheduler.join(timeout)
+        _scheduler = None
+
+@app.cli.command("expire-folders")
+def expire_folders_command():
+    """Deactivate folders whose QR code has expired."""
+    print(f"Deactivated {expire_folders()} expired folder(s)")
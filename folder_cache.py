@@ -0,0 +1,144 @@
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from collections import namedtuple, OrderedDict
+
+from itsdangerous import URLSafeSerializer
+
+from app import app, db
+from models import PhotoFolder
+from shared_cache import RedisCache, SharedCacheError
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class FolderSnapshot(namedtuple('FolderSnapshot', [
+    'id', 'folder_key', 'folder_name', 'user_id', 'is_local', 'storage_backend',
+    'qr_code_active', 'qr_code_expires_at'
+])):
+    """Read-only copy of the folder fields the scan and upload pages need."""
+
+    __slots__ = ()
+
+    def is_qr_code_expired(self):
+        """Same rules as PhotoFolder.is_qr_code_expired."""
+        if not self.qr_code_active:
+            return True
+        return self.is_past_expiry()
+
+    def is_past_expiry(self):
+        """Same rules as PhotoFolder.is_past_expiry."""
+        if self.qr_code_expires_at is None:
+            return False
+        return datetime.utcnow() > self.qr_code_expires_at
+
+# Per-process LRU of snapshots: folder_key -> (expires_at, snapshot or None)
+_snapshots = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+# Shared tier, built on first use when FOLDER_CACHE_REDIS_URL is set
+_shared = None
+
+def _shared_cache():
+    global _shared
+    if _shared is None and app.config['FOLDER_CACHE_REDIS_URL']:
+        _shared = RedisCache(app.config['FOLDER_CACHE_REDIS_URL'])
+    return _shared
+
+def _shared_key(folder_key):
+    return f"folder:v1:{folder_key}"
+
+def _encode(snapshot):
+    if snapshot is None:
+        return 'null'
+    data = snapshot._asdict()
+    if data['qr_code_expires_at'] is not None:
+        data['qr_code_expires_at'] = data['qr_code_expires_at'].isoformat()
+    return json.dumps(data)
+
+def _decode(value):
+    data = json.loads(value)
+    if data is None:
+        return None
+    if data['qr_code_expires_at'] is not None:
+        data['qr_code_expires_at'] = datetime.fromisoformat(data['qr_code_expires_at'])
+    return FolderSnapshot(**data)
+
+def _remember(folder_key, snapshot):
+    with _snapshots_lock:
+        _snapshots[folder_key] = (time.monotonic() + app.config['FOLDER_CACHE_TTL'], snapshot)
+        _snapshots.move_to_end(folder_key)
+        while len(_snapshots) > app.config['FOLDER_CACHE_SIZE']:
+            _snapshots.popitem(last=False)
+
+def _load_snapshot(folder_key):
+    """Read a snapshot from the database, without touching the ORM identity map."""
+    row = db.session.execute(
+        db.select(
+            PhotoFolder.id, PhotoFolder.folder_key, PhotoFolder.folder_name, PhotoFolder.user_id,
+            PhotoFolder.is_local, PhotoFolder.storage_backend, PhotoFolder.qr_code_active,
+            PhotoFolder.qr_code_expires_at
+        ).where(PhotoFolder.folder_key == folder_key)
+    ).first()
+    return FolderSnapshot(*row) if row is not None else None
+
+def get_folder_snapshot(folder_key):
+    """Return a snapshot of a folder, or None if there is no such folder.
+
+    Looks in the per-process LRU (FOLDER_CACHE_TTL), then the shared cache
+    if one is configured (FOLDER_CACHE_SHARED_TTL), then the database.
+    Unknown keys are cached too, so bad links don't each cost a query.
+    Nothing is written to the database.
+    """
+    with _snapshots_lock:
+        cached = _snapshots.get(folder_key)
+        if cached is not None and time.monotonic() < cached[0]:
+            _snapshots.move_to_end(folder_key)
+            return cached[1]
+
+    shared = _shared_cache()
+    if shared is not None:
+        try:
+            value = shared.get(_shared_key(folder_key))
+            if value is not None:
+                snapshot = _decode(value)
+                _remember(folder_key, snapshot)
+                return snapshot
+        except SharedCacheError:
+            pass
+
+    snapshot = _load_snapshot(folder_key)
+    _remember(folder_key, snapshot)
+    if shared is not None:
+        try:
+            shared.set(_shared_key(folder_key), _encode(snapshot), app.config['FOLDER_CACHE_SHARED_TTL'])
+        except SharedCacheError:
+            pass
+    return snapshot
+
+def invalidate_folder_snapshot(folder_key):
+    """Forget a folder's snapshot after the folder changed.
+
+    Other processes drop their own copy within FOLDER_CACHE_TTL seconds.
+    """
+    with _snapshots_lock:
+        _snapshots.pop(folder_key, None)
+
+    shared = _shared_cache()
+    if shared is not None:
+        try:
+            shared.delete(_shared_key(folder_key))
+        except SharedCacheError:
+            logger.error(f"Could not invalidate shared snapshot of folder {folder_key}")
+
+def scan_session_token(folder_key):
+    """Return the token of the folder's current scan session.
+
+    Sessions last SCAN_SESSION_SECONDS. The token is signed from the folder
+    key and the current time window, so it rotates on its own without
+    storing anything.
+    """
+    window = int(time.time()) // app.config['SCAN_SESSION_SECONDS']
+    return URLSafeSerializer(app.secret_key, salt='scan-session').dumps([folder_key, window])
@@ -0,0 +1,127 @@
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app import app
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ImageQueueFull(Exception):
+    """Raised when IMAGE_QUEUE_SIZE jobs are already waiting for the image workers."""
+
+# Worker pool, created on first use so processes that never handle images don't start one
+_executor = None
+_executor_lock = threading.Lock()
+
+# Free places in the queue; taken on submit and given back when the job finishes
+_slots = None
+
+def _get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(app.config['IMAGE_QUEUE_SIZE'])
+        if _executor is None and app.config['IMAGE_WORKERS'] > 0:
+            # Spawned rather than forked: request threads, database connections
+            # and locks of this process are not carried into the workers
+            _executor = ProcessPoolExecutor(
+                max_workers=app.config['IMAGE_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info(f"Started {app.config['IMAGE_WORKERS']} image worker process(es)")
+        return _executor
+
+def _discard_executor(executor):
+    """Forget a pool whose worker died, so the next job starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def submit(fn, *args):
+    """Queue an image job for the worker processes.
+
+    `fn` must be a module-level function of imaging.py (or another module
+    that doesn't import the app), and its arguments and result must be
+    picklable. With IMAGE_WORKERS set to 0 the job runs right away in the
+    calling thread.
+
+    Returns:
+        concurrent.futures.Future: The job's result
+
+    Raises:
+        ImageQueueFull: IMAGE_QUEUE_SIZE jobs are already queued or running
+    """
+    executor = _get_executor()
+    if executor is None:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    slots = _slots
+    if not slots.acquire(timeout=app.config['IMAGE_QUEUE_WAIT']):
+        raise ImageQueueFull(f"{app.config['IMAGE_QUEUE_SIZE']} image jobs already queued")
+
+    try:
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        slots.release()
+        logger.error("Image worker pool broke, starting a new one")
+        _discard_executor(executor)
+        return submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+
+    def finished(future):
+        slots.release()
+        if isinstance(future.exception(), BrokenProcessPool):
+            logger.error("An image worker process died, starting a new pool")
+            _discard_executor(executor)
+
+    future.add_done_callback(finished)
+    return future
+
+def run(fn, *args, timeout=None):
+    """Run an image job in the worker processes and wait for its result.
+
+    The timeout bounds the wait, not the job: a job that hasn't started is
+    cancelled, but one already running can't be interrupted and keeps its
+    worker (and queue slot) until it finishes. Jobs are bounded by
+    MAX_FILE_SIZE and Pillow's decompression bomb check, so they do finish.
+
+    Args:
+        fn: See submit
+        timeout: Seconds to wait, IMAGE_JOB_TIMEOUT by default
+
+    Returns:
+        The return value of fn(*args)
+
+    Raises:
+        ImageQueueFull: The queue is full
+        concurrent.futures.TimeoutError: The job didn't finish in time
+        Exception: Whatever fn raised
+    """
+    timeout = app.config['IMAGE_JOB_TIMEOUT'] if timeout is None else timeout
+    future = submit(fn, *args)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        # Nobody will use the result; don't let it take a worker if it hasn't yet
+        future.cancel()
+        raise
+
+def shutdown(wait=True):
+    """Stop the worker processes, e.g. at the end of a CLI command or in tests."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,178 @@
+"""CPU-heavy image work, run in the image worker processes (see imagepool.py).
+
+Nothing here imports the Flask app: the functions take plain arguments and
+return plain values, so worker processes start quickly and never touch the
+database.
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+from PIL import Image, ImageOps, features
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Pillow format name, MIME type and file extension for each normalized output format
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'avif': ('AVIF', 'image/avif', 'avif'),
+    'png': ('PNG', 'image/png', 'png'),
+}
+
+# EXIF tag holding the camera orientation
+ORIENTATION_TAG = 0x0112
+
+# Image.info entries holding metadata (camera details, GPS position, edit history)
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'photoshop', 'comment')
+
+def _output_format(img, fmt):
+    """Pick the format to re-encode an image in."""
+    if fmt == 'avif' and not features.check('avif'):
+        logger.warning("Pillow was built without AVIF support, using JPEG")
+        fmt = 'jpeg'
+
+    # JPEG has no alpha channel; keep transparent images as PNG
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+    if fmt == 'jpeg' and has_alpha:
+        fmt = 'png'
+    return fmt
+
+def _encode(img, fmt, quality):
+    """Encode an image without its metadata, keeping only the colour profile."""
+    pil_format = OUTPUT_FORMATS[fmt][0]
+    options = {}
+    icc_profile = img.info.get('icc_profile')
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+
+    if fmt == 'jpeg':
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        options.update(quality=quality, optimize=True, progressive=True)
+    elif fmt in ('webp', 'avif'):
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB')
+        options['quality'] = quality
+    else:
+        options['optimize'] = True
+
+    buffer = BytesIO()
+    img.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+def normalize_image(source_path, dest_stem, max_edge, fmt, quality):
+    """Rotate, shrink and re-encode an image file (see normalize.py).
+
+    Args:
+        source_path: The uploaded file
+        dest_stem: Path of the output file, without extension
+        max_edge: Longest side in pixels
+        fmt: 'jpeg', 'webp' or 'avif'
+        quality: Encoder quality
+
+    Returns:
+        dict: 'local_path', 'extension', 'mime_type', 'file_size' and 'sha256'
+            of the new file, or None if the source is better kept as it is
+    """
+    with Image.open(source_path) as img:
+        # Re-encoding would keep only the first frame
+        if getattr(img, 'is_animated', False):
+            return None
+
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        has_metadata = any(key in img.info for key in METADATA_KEYS)
+        upright = ImageOps.exif_transpose(img)
+
+        resized = max(upright.size) > max_edge
+        if resized:
+            upright.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        fmt = _output_format(upright, fmt)
+        data = _encode(upright, fmt, quality)
+
+    with open(source_path, 'rb') as f:
+        f.seek(0, 2)
+        source_size = f.tell()
+    if orientation == 1 and not resized and not has_metadata and len(data) >= source_size:
+        return None
+
+    _, mime_type, extension = OUTPUT_FORMATS[fmt]
+    file_path = f"{dest_stem}.{extension}"
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
+    return {
+        'local_path': file_path,
+        'extension': extension,
+        'mime_type': mime_type,
+        'file_size': len(data),
+        'sha256': hashlib.sha256(data).hexdigest()
+    }
+
+def render_thumbnails(source_path, targets, quality):
+    """Write resized copies of an image.
+
+    The source is decoded once and resized for every width; thumbnails are
+    never upscaled past the original's size.
+
+    Args:
+        source_path: The image to resize
+        targets: List of (width, format key, Pillow format, output path)
+        quality: Encoder quality
+
+    Returns:
+        list: (width, format key, output path, file size) for each target
+    """
+    written = []
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        for width in sorted({target[0] for target in targets}, reverse=True):
+            resized = img.copy()
+            resized.thumbnail((width, width * 4), Image.LANCZOS)
+
+            for target_width, fmt, pil_format, file_path in targets:
+                if target_width != width:
+                    continue
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, quality=quality)
+                with open(file_path, 'wb') as f:
+                    f.write(buffer.getvalue())
+                written.append((width, fmt, file_path, buffer.tell()))
+
+    return written
+
+def draw_qr(data, size, fmt):
+    """Draw a QR code.
+
+    Args:
+        data: The text to encode
+        size: Pixels per QR module
+        fmt: 'png' or 'svg'
+
+    Returns:
+        bytes: The encoded image
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=size,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    if fmt == 'svg':
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+
+    buffer = BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,242 @@
+import os
+import uuid
+import hashlib
+import logging
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from app import app
+from utils import allowed_file
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Leading bytes of each image type we accept
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+# Bytes needed to recognize any of the signatures above
+SIGNATURE_LENGTH = 8
+
+class UploadRejected(Exception):
+    """Raised while streaming an upload that can't be accepted."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def sniff_mime_type(head):
+    """Return the image MIME type for the first bytes of a file, or None."""
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return None
+
+class FileWriter:
+    """Writes one file part to a temporary file in UPLOAD_FOLDER, hashing it on the way."""
+
+    def __init__(self, filename):
+        self.original_name = filename
+        self.file_name = f"{uuid.uuid4()}_{secure_filename(filename)}"
+        self.temp_path = os.path.join(app.config['UPLOAD_FOLDER'], self.file_name)
+        self.size = 0
+        self.mime_type = None
+        self.hasher = hashlib.sha256()
+        self.head = b''
+        self.handle = open(self.temp_path, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > app.config['MAX_FILE_SIZE']:
+            raise UploadRejected(f"File is larger than {app.config['MAX_FILE_SIZE'] // (1024 * 1024)}MB", 413)
+
+        # Check the content type as soon as enough bytes have arrived
+        if self.mime_type is None:
+            self.head += data[:SIGNATURE_LENGTH]
+            if len(self.head) >= SIGNATURE_LENGTH:
+                self._check_type()
+
+        self.hasher.update(data)
+        self.handle.write(data)
+
+    def _check_type(self):
+        self.mime_type = sniff_mime_type(self.head)
+        if self.mime_type is None:
+            raise UploadRejected("File is not a supported image type")
+
+    def finish(self):
+        if self.mime_type is None:
+            self._check_type()
+        self.handle.close()
+        return {
+            'success': True,
+            'file_url': f"/static/uploads/{self.file_name}",
+            'temp_path': self.temp_path,
+            'file_name': self.file_name,
+            'original_name': self.original_name,
+            'file_size': self.size,
+            'mime_type': self.mime_type,
+            'sha256': self.hasher.hexdigest()
+        }
+
+    def discard(self):
+        self.handle.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+def stream_multipart_upload(req, file_field='file', max_files=1, before_file=None, on_reject=None):
+    """Parse a multipart upload, streaming file parts straight to disk.
+
+    Unlike request.files, nothing is spooled by Werkzeug: each file part is
+    written in chunks to its own file in UPLOAD_FOLDER (the result's
+    temp_path, moved into the blob store once the photo is saved) while its
+    size and SHA-256 are computed, so memory use per upload stays at about
+    one chunk. Bad extensions, non-image content and oversize files are
+    rejected as soon as they are seen, without reading the rest of the body.
+
+    Args:
+        req: The Flask request
+        file_field: Name of the form field carrying files
+        max_files: Maximum number of files accepted
+        before_file: Optional callback given the form fields received so far
+            when the first file part starts; it may raise UploadRejected
+        on_reject: Optional callback given (file name, message) for a file
+            that can't be accepted. With it, that file is skipped and parsing
+            continues; without it, the whole upload is rejected.
+
+    Returns:
+        tuple: (dict of form fields, list of saved file results)
+
+    Raises:
+        UploadRejected: The upload was refused; files written so far are removed
+    """
+    mimetype, options = parse_options_header(req.headers.get('Content-Type', ''))
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadRejected("Expected a multipart/form-data upload")
+
+    chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+    max_field_size = app.config['MAX_FORM_MEMORY_SIZE']
+    # The decoder's limit applies to its buffer, which may still hold a
+    # partial boundary when the next chunk arrives; field values are
+    # limited separately below
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=max_field_size + chunk_size)
+
+    fields = {}
+    saved = []
+    current = None
+    field_value = []
+    field_size = 0
+    writer = None
+    skipping = False  # Reading past the data of a rejected file
+
+    def reject_file(filename, error):
+        nonlocal writer, skipping
+        if on_reject is None:
+            raise error
+        if writer is not None:
+            writer.discard()
+            writer = None
+        skipping = True
+        on_reject(filename, error.message)
+
+    try:
+        while True:
+            chunk = req.stream.read(chunk_size)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    current = event
+                    field_value = []
+                    field_size = 0
+                elif isinstance(event, File):
+                    current = event
+                    skipping = False
+                    if event.name != file_field:
+                        raise UploadRejected(f"Unexpected file field: {event.name}")
+                    if before_file is not None:
+                        before_file(fields)
+                        before_file = None
+                    try:
+                        if not event.filename:
+                            raise UploadRejected("No file selected")
+                        if not allowed_file(event.filename):
+                            raise UploadRejected("File type not allowed")
+                        if len(saved) >= max_files:
+                            raise UploadRejected(f"At most {max_files} file(s) per request")
+                        writer = FileWriter(event.filename)
+                    except UploadRejected as e:
+                        reject_file(event.filename, e)
+                elif isinstance(event, Data) and isinstance(current, File):
+                    if not skipping:
+                        try:
+                            writer.write(event.data)
+                            if not event.more_data:
+                                saved.append(writer.finish())
+                                writer = None
+                        except UploadRejected as e:
+                            reject_file(current.filename, e)
+                elif isinstance(event, Data):
+                    field_size += len(event.data)
+                    if field_size > max_field_size:
+                        raise UploadRejected(f"Form field {current.name} is too large", 413)
+                    field_value.append(event.data)
+                    if not event.more_data:
+                        fields[current.name] = b"".join(field_value).decode("utf-8", "replace")
+
+                event = decoder.next_event()
+
+            if isinstance(event, Epilogue) or not chunk:
+                break
+
+        if writer is not None:
+            raise UploadRejected("Upload was interrupted")
+    except RequestEntityTooLarge:
+        _discard(writer, saved)
+        raise UploadRejected("Upload is too large", 413)
+    except UploadRejected:
+        _discard(writer, saved)
+        raise
+    except ValueError as e:
+        # Malformed multipart body
+        _discard(writer, saved)
+        raise UploadRejected(f"Malformed upload: {str(e)}")
+    except Exception:
+        _discard(writer, saved)
+        raise
+
+    return fields, saved
+
+def discard_saved_files(saved):
+    """Remove files written by stream_multipart_upload that won't be kept.
+
+    Only the files under their temporary names are removed; blob files are
+    shared between photos and only the blob store deletes them.
+    """
+    for result in saved:
+        paths = [result['temp_path']]
+        if result.get('original') is not None:
+            paths.append(result['original']['temp_path'])
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _discard(writer, saved):
+    """Remove the files written for a rejected upload."""
+    if writer is not None:
+        writer.discard()
+    discard_saved_files(saved)
@@ -0,0 +1,175 @@
+import re
+import sys
+import copy
+import json
+import uuid
+import zlib
+import queue
+import atexit
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request, has_request_context
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+# Pass as `extra` on high-volume info logs to keep only LOG_SAMPLE_RATE of them
+SAMPLED = {'sampled': True}
+
+# Request ids accepted from the X-Request-ID header; anything else is replaced
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'
+
+# Listener writing queued records, started by configure_logging
+_listener = None
+
+class RequestIdFilter(logging.Filter):
+    """Tag records with the id of the request that logged them, if any."""
+
+    def filter(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep `rate` of the records logged with extra=SAMPLED, at info level or below.
+
+    Requests are sampled as a whole, so a kept request keeps all of its
+    sampled records. Kept records carry sample_rate for scaling counts.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or record.levelno > logging.INFO or self.rate >= 1:
+            return True
+        if record.request_id:
+            keep = zlib.crc32(record.request_id.encode()) % 10000 < self.rate * 10000
+        else:
+            keep = random.random() < self.rate
+        if keep:
+            record.sample_rate = self.rate
+        return keep
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key != 'sampled':
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class BoundedQueueHandler(QueueHandler):
+    """Hands records to the listener thread; drops them rather than block when it falls behind."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the message with its arguments and render the traceback here,
+        # in the logging thread, as the arguments may change or stop being
+        # valid once it moves on. Records dropped by the filters never get
+        # this far. Formatting as JSON or text, with the extra fields, and
+        # writing are left to the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING', 'request_id': None,
+                    'msg': f"Dropped {self.dropped} log record(s): the log queue was full"
+                }))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def parse_levels(value):
+    """Parse "module=LEVEL,other=LEVEL" into a dict."""
+    levels = {}
+    for item in (value or '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def _stop_listener():
+    # Writes out whatever is still queued
+    if _listener is not None:
+        _listener.stop()
+
+def configure_logging(app):
+    """Send all logging through a queue to a background writer thread.
+
+    The calling thread filters records and, for those kept, merges the
+    message arguments and enqueues them; formatting and writing to stderr
+    happen in the listener thread. Also gives every request an id
+    (X-Request-ID, taken from the client or proxy if valid) that is added
+    to its log records and echoed in the response.
+    """
+    global _listener
+    config = app.config
+
+    log_queue = queue.Queue(config['LOG_QUEUE_SIZE'])
+    queue_handler = BoundedQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(config['LOG_SAMPLE_RATE']))
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if config['LOG_FORMAT'] == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config['LOG_LEVEL'].upper())
+    for name, level in config['LOG_LEVELS'].items():
+        logging.getLogger(name).setLevel(level)
+
+    if _listener is None:
+        atexit.register(_stop_listener)
+    else:
+        _listener.stop()
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get('X-Request-ID', '')
+        g.request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+
+    @app.after_request
+    def add_request_id_header(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
@@ -0,0 +1,80 @@
+import os
+import logging
+
+from flask import request, send_file
+
+from app import app
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# MEDIA_SENDFILE values and the header each one sends
+SENDFILE_HEADERS = {
+    'x-accel-redirect': 'X-Accel-Redirect',  # nginx
+    'x-sendfile': 'X-Sendfile',  # Apache mod_xsendfile, lighttpd
+}
+
+def _proxy_path(file_path):
+    """Return what to put in the sendfile header, or None if the proxy can't serve the file."""
+    mode = app.config['MEDIA_SENDFILE']
+    if mode == 'x-sendfile':
+        return os.path.abspath(file_path)
+
+    # nginx only serves internal locations, mapped from MEDIA_ROOT
+    root = os.path.abspath(app.config['MEDIA_ROOT'])
+    file_path = os.path.abspath(file_path)
+    if os.path.commonpath([root, file_path]) != root:
+        return None
+    relative = os.path.relpath(file_path, root).replace(os.sep, '/')
+    return f"{app.config['MEDIA_ACCEL_PREFIX'].rstrip('/')}/{relative}"
+
+def send_media(file_path, mimetype=None, etag=None, immutable=False, max_age=None, download_name=None):
+    """Send a photo, thumbnail or other media file.
+
+    Answers If-None-Match/If-Modified-Since with 304 and Range/If-Range with
+    206. With MEDIA_SENDFILE set, the headers are built here but the bytes
+    are sent by the front proxy (X-Accel-Redirect for nginx, X-Sendfile
+    for Apache), which also handles ranges, so the worker never reads the file.
+
+    Args:
+        file_path: The file to send
+        mimetype: Content type; guessed from the file name by default
+        etag: Strong ETag, e.g. the content hash of a content-addressed
+            file; by default one is derived from the file's mtime and size
+        immutable: The URL always names the same content, so it can be
+            cached for MEDIA_IMMUTABLE_MAX_AGE without revalidating
+        max_age: Browser cache lifetime in seconds, if not immutable
+        download_name: Send as an attachment with this file name
+
+    Raises:
+        NotFound: The file doesn't exist
+    """
+    if immutable:
+        max_age = app.config['MEDIA_IMMUTABLE_MAX_AGE']
+
+    sendfile_header = SENDFILE_HEADERS.get(app.config['MEDIA_SENDFILE'])
+    proxy_path = _proxy_path(file_path) if sendfile_header else None
+
+    response = send_file(
+        file_path,
+        mimetype=mimetype,
+        as_attachment=download_name is not None,
+        download_name=download_name,
+        etag=etag or True,
+        max_age=max_age,
+        # Ranges are left to the proxy when it sends the file
+        conditional=proxy_path is None
+    )
+
+    if proxy_path is not None:
+        # Keep the headers (Content-Length stays the file size) but not the body
+        response.close()
+        response.response = []
+        response.make_conditional(request)
+        if response.status_code == 200:
+            response.headers[sendfile_header] = proxy_path
+            response.accept_ranges = 'bytes'
+
+    if immutable:
+        response.cache_control.immutable = True
+    return response
@@ -0,0 +1,99 @@
+import logging
+
+from sqlalchemy import inspect, text
+
+from app import app, db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def upgrade_schema():
+    """Bring existing tables in line with the models.
+
+    `db.create_all()` only creates missing tables, so columns and indexes
+    added to existing models are created here. New columns must be nullable
+    or have a server default.
+
+    Returns:
+        list: Descriptions of the changes made
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            if column.server_default is not None:
+                ddl += f' DEFAULT {column.server_default.arg}'
+            with db.engine.begin() as conn:
+                conn.execute(text(ddl))
+            changes.append(f"added column {table.name}.{column.name}")
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            index.create(db.engine)
+            changes.append(f"created index {index.name}")
+
+    changes.extend(backfill_photo_sort_keys())
+    changes.extend(backfill_upload_session_states())
+
+    for change in changes:
+        logger.info(f"Schema upgrade: {change}")
+    return changes
+
+def backfill_photo_sort_keys():
+    """Fill in NULL photo names and sizes so keyset pagination sees every row.
+
+    Returns:
+        list: Descriptions of the changes made
+    """
+    from models import Photo
+
+    changes = []
+    named = Photo.query.filter(Photo.original_name.is_(None)).update(
+        {'original_name': Photo.file_name}, synchronize_session=False
+    )
+    sized = Photo.query.filter(Photo.file_size.is_(None)).update(
+        {'file_size': 0}, synchronize_session=False
+    )
+    db.session.commit()
+
+    if named:
+        changes.append(f"backfilled original_name on {named} photos")
+    if sized:
+        changes.append(f"backfilled file_size on {sized} photos")
+    return changes
+
+def backfill_upload_session_states():
+    """Mark upload sessions finalized before the state column existed as complete.
+
+    Returns:
+        list: Descriptions of the changes made
+    """
+    from models import UploadSession
+
+    completed = UploadSession.query.filter(
+        UploadSession.completed_at.isnot(None),
+        UploadSession.state != UploadSession.STATE_COMPLETE
+    ).update({'state': UploadSession.STATE_COMPLETE}, synchronize_session=False)
+    db.session.commit()
+
+    if completed:
+        return [f"marked {completed} finished upload sessions complete"]
+    return []
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Create columns and indexes missing from existing tables."""
+    changes = upgrade_schema()
+    print("\n".join(changes) or "Schema is up to date")
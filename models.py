@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
+import os
 import uuid
+import mimetypes
 
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -26,10 +28,12 @@ class User(UserMixin, db.Model):
     use_local_storage = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime, default=datetime.utcnow)
+    photo_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Maintained by counters.py
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # Maintained by counters.py
     
-    # Relationships
-    folders = db.relationship("PhotoFolder", back_populates="user", cascade="all, delete-orphan")
-    photos = db.relationship("Photo", back_populates="user", cascade="all, delete-orphan")
+    # Relationships; none load lazily, so queries declare theirs with joinedload/selectinload
+    folders = db.relationship("PhotoFolder", back_populates="user", cascade="all, delete-orphan", lazy="raise")
+    photos = db.relationship("Photo", back_populates="user", cascade="all, delete-orphan", lazy="raise")
     
     def set_password(self, password):
         """Set the password hash for the user."""
@@ -43,24 +47,31 @@ class User(UserMixin, db.Model):
 class PhotoFolder(db.Model):
     """Represents a folder for organizing photos."""
     __tablename__ = 'photo_folders'
+    __table_args__ = (
+        # Lets expiry.py find active folders past their expiry without a scan
+        db.Index('ix_photo_folders_active_expires_at', 'qr_code_active', 'qr_code_expires_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     folder_name = db.Column(db.String(255), nullable=False)
     folder_key = db.Column(db.String(100), nullable=False, unique=True)  # UUID or other unique identifier
     is_local = db.Column(db.Boolean, default=True)  # Whether photos are stored locally or on catbox.moe
+    storage_backend = db.Column(db.String(20), nullable=True)  # 'local', 'catbox' or 's3'; see storage.py
     qr_code_url = db.Column(db.String(512), nullable=True)
     qr_code_generated_at = db.Column(db.DateTime, nullable=True)  # Timestamp when QR code was generated
     qr_code_expires_at = db.Column(db.DateTime, nullable=True)  # Timestamp when QR code expires
     qr_code_active = db.Column(db.Boolean, default=True)  # Whether the QR code is active
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    photo_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Maintained by counters.py
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')  # Maintained by counters.py
     
     # Relationships
-    user = db.relationship("User", back_populates="folders")
-    photos = db.relationship("Photo", back_populates="folder", cascade="all, delete-orphan")
+    user = db.relationship("User", back_populates="folders", lazy="raise")
+    photos = db.relationship("Photo", back_populates="folder", cascade="all, delete-orphan", lazy="raise")
     
     @classmethod
-    def create_folder(cls, name, user_id, is_local=True, expiration_hours=None):
+    def create_folder(cls, name, user_id, is_local=True, expiration_hours=None, storage_backend=None):
         """Create a new folder with a unique key.
         
         Args:
@@ -68,11 +79,14 @@ class PhotoFolder(db.Model):
             user_id: The user ID who owns the folder
             is_local: Whether to use local storage (True) or cloud storage (False)
             expiration_hours: Number of hours the QR code will be valid (None means no expiration)
+            storage_backend: Backend the photos are moved to ('local', 'catbox' or 's3');
+                defaults to 'local' or 'catbox' according to is_local
         """
         folder = cls(
             folder_name=name,
             folder_key=str(uuid.uuid4()),
             is_local=is_local,
+            storage_backend=storage_backend or ('local' if is_local else 'catbox'),
             user_id=user_id,
             qr_code_active=True
         )
@@ -97,6 +111,18 @@ class PhotoFolder(db.Model):
         if not self.qr_code_active:
             return True
             
+        return self.is_past_expiry()
+        
+    def is_past_expiry(self):
+        """Check if the QR code's time limit has passed.
+        
+        Unlike is_qr_code_expired this ignores qr_code_active, which the
+        expiry scheduler also clears, so it tells expiry from manual
+        deactivation.
+        
+        Returns:
+            bool: True if an expiration time is set and has passed
+        """
         # If no expiration time set, it doesn't expire
         if self.qr_code_expires_at is None:
             return False
@@ -109,13 +135,37 @@ class PhotoFolder(db.Model):
         
         This makes the QR code invalid for uploads, but the folder remains accessible.
         """
+        from folder_cache import invalidate_folder_snapshot
+        
         self.qr_code_active = False
         db.session.commit()
+        invalidate_folder_snapshot(self.folder_key)
+
+
+def photo_download_name(original_name, file_name):
+    """Name to offer a photo's file under.
+
+    This is the name it was uploaded as, unless normalization stored it in
+    another format (e.g. a PNG re-encoded as JPEG); then the extension is
+    swapped for the stored file's.
+    """
+    name = original_name or file_name
+    stem, _ = os.path.splitext(name)
+    stored_extension = os.path.splitext(file_name)[1]
+    if stored_extension and mimetypes.guess_type(name)[0] != mimetypes.guess_type(file_name)[0]:
+        return f"{stem}{stored_extension}"
+    return name
 
 
 class Photo(db.Model):
     """Represents a photo uploaded to the application."""
     __tablename__ = 'photos'
+    __table_args__ = (
+        # One index per gallery sort order (see pagination.py); the id is the tie-breaker
+        db.Index('ix_photos_folder_uploaded_at', 'folder_id', 'uploaded_at', 'id'),
+        db.Index('ix_photos_folder_original_name', 'folder_id', 'original_name', 'id'),
+        db.Index('ix_photos_folder_file_size', 'folder_id', 'file_size', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     file_name = db.Column(db.String(255), nullable=False)
@@ -126,10 +176,158 @@ class Photo(db.Model):
     is_local = db.Column(db.Boolean, default=True)  # Whether this is a local file or catbox.moe file
     local_path = db.Column(db.String(512), nullable=True)  # Path to local file if using local storage
     delete_hash = db.Column(db.String(100), nullable=True)  # For catbox.moe deletion (if applicable)
+    blob_id = db.Column(db.Integer, db.ForeignKey('photo_blobs.id'), nullable=True, index=True)  # Stored content, shared by duplicates
+    original_blob_id = db.Column(db.Integer, db.ForeignKey('photo_blobs.id'), nullable=True, index=True)  # File as uploaded, if kept (see normalize.py)
+    storage_backend = db.Column(db.String(20), nullable=True)  # Backend holding the remote copy, if any
+    storage_key = db.Column(db.String(512), nullable=True)  # Key of the remote copy in that backend
+    crc32 = db.Column(db.BigInteger, nullable=True)  # CRC-32 of the content, filled in by folder ZIP exports (see zipexport.py)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     folder_id = db.Column(db.Integer, db.ForeignKey('photo_folders.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    user = db.relationship("User", back_populates="photos")
-    folder = db.relationship("PhotoFolder", back_populates="photos")
\ No newline at end of file
+    user = db.relationship("User", back_populates="photos", lazy="raise")
+    folder = db.relationship("PhotoFolder", back_populates="photos", lazy="raise")
+    offload_jobs = db.relationship("OffloadJob", back_populates="photo", cascade="all, delete-orphan", lazy="raise")
+    thumbnails = db.relationship("PhotoThumbnail", back_populates="photo", cascade="all, delete-orphan", lazy="raise")
+    blob = db.relationship("PhotoBlob", foreign_keys=[blob_id], lazy="raise")
+    original_blob = db.relationship("PhotoBlob", foreign_keys=[original_blob_id], lazy="raise")
+    
+    @property
+    def download_name(self):
+        """File name for downloads, with the extension of the stored format."""
+        return photo_download_name(self.original_name, self.file_name)
+
+
+class OffloadJob(db.Model):
+    """A queued transfer of a locally saved photo to catbox.moe.
+    
+    Jobs live in the database so they survive restarts; the workers in
+    offload.py claim them, retry with exponential backoff and update the
+    photo once the file is hosted remotely.
+    """
+    __tablename__ = 'offload_jobs'
+    
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    photo_id = db.Column(db.Integer, db.ForeignKey('photos.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)  # Not retried before this time
+    locked_at = db.Column(db.DateTime, nullable=True)  # When a worker claimed the job
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    # Relationships
+    photo = db.relationship("Photo", back_populates="offload_jobs", lazy="raise")
+
+
+class PhotoThumbnail(db.Model):
+    """A resized copy of a photo used in gallery views (see thumbnails.py)."""
+    __tablename__ = 'photo_thumbnails'
+    __table_args__ = (
+        db.UniqueConstraint('photo_id', 'width', 'format', name='uq_photo_thumbnails_photo_width_format'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    photo_id = db.Column(db.Integer, db.ForeignKey('photos.id'), nullable=False, index=True)
+    width = db.Column(db.Integer, nullable=False)  # Nominal width the thumbnail was made for
+    format = db.Column(db.String(10), nullable=False)  # "webp" or "jpeg"
+    file_path = db.Column(db.String(512), nullable=False)
+    file_size = db.Column(db.Integer, nullable=True)  # Size in bytes
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    photo = db.relationship("Photo", back_populates="thumbnails", lazy="raise")
+
+
+
+class PhotoBlob(db.Model):
+    """Stored photo content, keyed by its SHA-256 (see blobstore.py).
+    
+    Identical uploads share one blob; ref_count is the number of photos
+    pointing at it, and the file is removed when it drops to zero.
+    """
+    __tablename__ = 'photo_blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    file_path = db.Column(db.String(512), nullable=False)
+    file_size = db.Column(db.Integer, nullable=False)  # Size in bytes
+    mime_type = db.Column(db.String(100), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class UploadSession(db.Model):
+    """A resumable upload in progress (see resumable.py).
+    
+    The chunks themselves are files on disk; this row records what the
+    client announced at init time and, once finalized, the resulting photo.
+    """
+    __tablename__ = 'upload_sessions'
+    
+    STATE_OPEN = 'open'  # Receiving chunks
+    STATE_FINALIZING = 'finalizing'  # Claimed by a finalize request that is assembling the photo
+    STATE_COMPLETE = 'complete'
+    
+    id = db.Column(db.String(36), primary_key=True)  # UUID handed to the client
+    folder_id = db.Column(db.Integer, db.ForeignKey('photo_folders.id', ondelete='CASCADE'), nullable=False, index=True)
+    original_name = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.Integer, nullable=False)  # Size in bytes announced by the client
+    chunk_size = db.Column(db.Integer, nullable=False)
+    photo_id = db.Column(db.Integer, db.ForeignKey('photos.id', ondelete='SET NULL'), nullable=True)  # Set once finalized
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    state = db.Column(db.String(20), nullable=False, default=STATE_OPEN, server_default=db.text("'open'"))
+    
+    # Relationships
+    folder = db.relationship("PhotoFolder", lazy="raise")
+
+
+class FileTombstone(db.Model):
+    """A file left behind by a deleted photo or folder, waiting to be removed (see deletion.py).
+    
+    Deleting rows is one SQL statement; removing their files can take much
+    longer, so the files are queued here in the same transaction and a
+    background worker removes them.
+    """
+    __tablename__ = 'file_tombstones'
+    
+    KIND_FILE = 'file'  # A local file
+    KIND_DIRECTORY = 'directory'  # A local directory, e.g. a photo's thumbnails
+    KIND_BLOB = 'blob'  # A released blob's file, kept if the content was stored again
+    KIND_REMOTE = 'remote'  # An object in a storage backend
+    KIND_QR = 'qr'  # The cached QR codes of a folder key
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    path = db.Column(db.String(512), nullable=False)  # File path, object key or folder key
+    backend = db.Column(db.String(20), nullable=True)  # Storage backend of a remote object
+    sha256 = db.Column(db.String(64), nullable=True)  # Content hash of a blob
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class RevokedShare(db.Model):
+    """A share link revoked before it expired (see sharing.py).
+    
+    Share tokens are verified without a database lookup, so revoking one
+    means listing it here. Rows are only needed until the token would have
+    expired anyway, which keeps the list small enough to hold in memory.
+    """
+    __tablename__ = 'revoked_shares'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token_digest = db.Column(db.String(32), unique=True, nullable=False)  # Signature of the token, hex
+    photo_id = db.Column(db.Integer, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # When the token expires
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
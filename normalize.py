@@ -0,0 +1,105 @@
+import os
+import logging
+
+from app import app
+from imaging import normalize_image
+from imagepool import submit, ImageQueueFull
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def normalize_uploads(results):
+    """Re-encode uploaded images for storage and display.
+
+    Each image is rotated upright according to its EXIF orientation, shrunk
+    so its long edge is at most NORMALIZE_MAX_EDGE pixels and re-encoded in
+    NORMALIZE_FORMAT at NORMALIZE_QUALITY, dropping EXIF/XMP metadata.
+    Animated GIFs are left alone, and so are images with no metadata that
+    need no rotation or resizing and would not get smaller.
+
+    All the jobs are queued for the image workers before waiting on any, so
+    a batch upload uses every worker. A file whose job can't be queued, fails
+    or takes longer than IMAGE_JOB_TIMEOUT is stored as uploaded; the file a
+    late job writes is removed when it finishes.
+
+    Each result dict from ingest.py is updated in place to describe the new
+    file (path, name, size, MIME type and hash). With NORMALIZE_KEEP_ORIGINALS
+    the uploaded file is kept and described under result['original'];
+    otherwise it is deleted.
+
+    Returns:
+        list: The updated results
+    """
+    # Animated images are recognized, and kept as they are, by normalize_image
+    if not app.config['NORMALIZE_IMAGES']:
+        return results
+
+    jobs = []
+    for result in results:
+        stem = os.path.splitext(result['file_name'])[0]
+        try:
+            # Decoding and encoding run in the image worker processes
+            future = submit(
+                normalize_image,
+                result['temp_path'],
+                os.path.join(app.config['UPLOAD_FOLDER'], f"{stem}.normalized"),
+                app.config['NORMALIZE_MAX_EDGE'],
+                app.config['NORMALIZE_FORMAT'],
+                app.config['NORMALIZE_QUALITY']
+            )
+        except ImageQueueFull as e:
+            # Each further submit would wait IMAGE_QUEUE_WAIT for nothing
+            logger.warning(f"Could not normalize {len(results) - len(jobs)} upload(s): {str(e)}")
+            break
+        except Exception as e:
+            logger.warning(f"Could not normalize {result['original_name']}: {str(e)}")
+            continue
+        jobs.append((result, stem, future))
+
+    for result, stem, future in jobs:
+        try:
+            normalized = future.result(timeout=app.config['IMAGE_JOB_TIMEOUT'])
+        except Exception as e:
+            # Pillow can't decode it, or the workers are too busy; store the file as uploaded
+            if not future.cancel():
+                # Already running: nobody will use its output, so remove it when the job ends
+                future.add_done_callback(_remove_abandoned_output)
+            logger.warning(f"Could not normalize {result['original_name']}: {str(e)}")
+            continue
+        if normalized is not None:
+            _apply(result, stem, normalized)
+
+    return results
+
+def _remove_abandoned_output(future):
+    """Delete the file written by a normalize job the request stopped waiting for."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    normalized = future.result()
+    if normalized is None:
+        return
+    try:
+        os.remove(normalized['local_path'])
+    except OSError as e:
+        logger.warning(f"Could not remove abandoned file {normalized['local_path']}: {str(e)}")
+
+def _apply(result, stem, normalized):
+    """Point a result at its normalized file, keeping or deleting the upload."""
+    if app.config['NORMALIZE_KEEP_ORIGINALS']:
+        result['original'] = {
+            'temp_path': result['temp_path'],
+            'file_size': result['file_size'],
+            'mime_type': result['mime_type'],
+            'sha256': result['sha256']
+        }
+    else:
+        os.remove(result['temp_path'])
+
+    logger.debug("Normalized %s: %d -> %d bytes", result['original_name'], result['file_size'], normalized['file_size'])
+    result.update({
+        'temp_path': normalized['local_path'],
+        'file_name': f"{stem}.{normalized['extension']}",
+        'file_size': normalized['file_size'],
+        'mime_type': normalized['mime_type'],
+        'sha256': normalized['sha256']
+    })
@@ -0,0 +1,280 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import app, db
+from models import Photo, PhotoBlob, OffloadJob, FileTombstone
+from storage import get_backend, folder_backend_name, remote_object_key, StorageError
+from deletion import bury
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Worker threads started by start_offload_workers, and the event used to stop them
+_workers = []
+_stop_event = threading.Event()
+
+def enqueue_offload(photo):
+    """Queue a photo for transfer to its folder's storage backend.
+
+    The job is added to the current session; the caller commits it together
+    with the photo so that a photo never exists without its job.
+    """
+    job = OffloadJob(photo=photo, status=OffloadJob.STATUS_PENDING, next_attempt_at=datetime.utcnow())
+    db.session.add(job)
+    return job
+
+def get_backoff(attempts):
+    """Return the delay before retrying a job that has failed `attempts` times."""
+    base = app.config['OFFLOAD_BACKOFF_SECONDS']
+    cap = app.config['OFFLOAD_BACKOFF_MAX_SECONDS']
+    return timedelta(seconds=min(cap, base * (2 ** max(attempts - 1, 0))))
+
+def claim_next_job():
+    """Claim the next due job for this worker.
+
+    Running jobs whose lease has run out (their worker died) are claimed
+    again. The claim is a conditional UPDATE on (status, attempts), so two
+    workers racing for the same job cannot both win it.
+
+    Returns:
+        OffloadJob or None if nothing is due
+    """
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=app.config['OFFLOAD_LEASE_SECONDS'])
+
+    candidates = OffloadJob.query.filter(
+        or_(
+            (OffloadJob.status == OffloadJob.STATUS_PENDING) & (OffloadJob.next_attempt_at <= now),
+            (OffloadJob.status == OffloadJob.STATUS_RUNNING) & (OffloadJob.locked_at < lease_expired)
+        )
+    ).order_by(OffloadJob.next_attempt_at.asc()).limit(5).all()
+
+    for job in candidates:
+        claimed = OffloadJob.query.filter_by(
+            id=job.id, status=job.status, attempts=job.attempts
+        ).update({
+            'status': OffloadJob.STATUS_RUNNING,
+            'attempts': job.attempts + 1,
+            'locked_at': now
+        }, synchronize_session=False)
+        db.session.commit()
+
+        if claimed:
+            db.session.refresh(job)
+            return job
+
+    return None
+
+def release_local_copy(photo):
+    """Drop a photo's local file once its remote copy is confirmed.
+
+    The photo gives up its reference to its blob; if that was the last one,
+    the blob row goes and its file is queued for removal (see deletion.py).
+    The file as uploaded (original_blob) is kept. Changes are part of the
+    current transaction; the caller commits.
+    """
+    blob_id, local_path = photo.blob_id, photo.local_path
+    photo.blob_id = None
+    photo.local_path = None
+
+    if blob_id is None:
+        # Saved before the blob store; the file is the photo's own
+        if local_path:
+            bury([{'kind': FileTombstone.KIND_FILE, 'path': local_path}])
+        return
+
+    PhotoBlob.query.filter_by(id=blob_id).update(
+        {PhotoBlob.ref_count: PhotoBlob.ref_count - 1}, synchronize_session=False
+    )
+    released = db.session.query(PhotoBlob.sha256, PhotoBlob.file_path).filter(
+        PhotoBlob.id == blob_id, PhotoBlob.ref_count <= 0
+    ).first()
+    if released is not None:
+        PhotoBlob.query.filter_by(id=blob_id).delete(synchronize_session=False)
+        bury([{'kind': FileTombstone.KIND_BLOB, 'path': released.file_path, 'sha256': released.sha256}])
+
+def process_job(job):
+    """Send the photo of a claimed job to its folder's backend and record the outcome.
+
+    Returns:
+        bool: True if the photo is now hosted remotely
+    """
+    photo = db.session.get(Photo, job.photo_id, options=[joinedload(Photo.folder)])
+
+    if photo is None:
+        # The photo was deleted while the job was queued
+        job.status = OffloadJob.STATUS_DONE
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+        return False
+
+    backend_name = folder_backend_name(photo.folder)
+    if not photo.is_local or backend_name == 'local':
+        # Already offloaded (e.g. a duplicate job), or nowhere to send it
+        job.status = OffloadJob.STATUS_DONE
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+        return True
+
+    if not photo.local_path or not os.path.exists(photo.local_path):
+        logger.error(f"Offload job {job.id}: local file missing for photo {photo.id}")
+        job.status = OffloadJob.STATUS_FAILED
+        job.last_error = "Local file missing"
+        job.locked_at = None
+        db.session.commit()
+        return False
+
+    try:
+        backend = get_backend(backend_name)
+        stored = backend.put(remote_object_key(photo), photo.local_path, photo.mime_type)
+        error = None
+    except StorageError as e:
+        error = str(e)
+
+    if error is None:
+        job_id, photo_id = job.id, photo.id
+        try:
+            photo.storage_backend = backend_name
+            photo.storage_key = stored['key']
+            # Private buckets are reached through a route that presigns on demand
+            photo.file_url = stored['url'] if backend.public else f"/photo/file/{photo.id}/{os.path.splitext(photo.file_name)[0]}"
+            photo.is_local = False
+            release_local_copy(photo)
+            job.status = OffloadJob.STATUS_DONE
+            job.last_error = None
+            job.locked_at = None
+            job.completed_at = datetime.utcnow()
+            db.session.commit()
+        except StaleDataError:
+            # The photo, and this job with it, was deleted during the upload;
+            # nothing refers to the remote copy
+            db.session.rollback()
+            bury([{'kind': FileTombstone.KIND_REMOTE, 'path': stored['key'], 'backend': backend_name}])
+            db.session.commit()
+            logger.info(f"Offload job {job_id}: photo {photo_id} was deleted while it was offloaded")
+            return False
+        logger.info(f"Offload job {job.id}: photo {photo.id} moved to {photo.file_url}")
+        return True
+
+    job.last_error = error
+    job.locked_at = None
+    if job.attempts >= app.config['OFFLOAD_MAX_ATTEMPTS']:
+        job.status = OffloadJob.STATUS_FAILED
+        logger.error(f"Offload job {job.id}: giving up after {job.attempts} attempts: {job.last_error}")
+    else:
+        job.status = OffloadJob.STATUS_PENDING
+        job.next_attempt_at = datetime.utcnow() + get_backoff(job.attempts)
+        logger.warning(f"Offload job {job.id}: attempt {job.attempts} failed, retrying at {job.next_attempt_at}")
+    db.session.commit()
+    return False
+
+def run_pending(limit=None):
+    """Process due jobs until none are left (or `limit` jobs were handled).
+
+    Returns:
+        int: Number of jobs processed
+    """
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        try:
+            process_job(job)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Offload job {job.id} crashed: {str(e)}")
+        processed += 1
+    return processed
+
+def retry_failed_jobs():
+    """Put every failed job back in the queue with a fresh attempt budget.
+
+    Returns:
+        int: Number of jobs requeued
+    """
+    count = OffloadJob.query.filter_by(status=OffloadJob.STATUS_FAILED).update({
+        'status': OffloadJob.STATUS_PENDING,
+        'attempts': 0,
+        'next_attempt_at': datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+def get_queue_stats():
+    """Summarize the offload queue for monitoring.
+
+    Returns:
+        dict: Job counts per status, queue depth and the age of the oldest pending job
+    """
+    counts = dict(
+        db.session.query(OffloadJob.status, func.count(OffloadJob.id))
+        .group_by(OffloadJob.status)
+        .all()
+    )
+    oldest = db.session.query(func.min(OffloadJob.created_at)).filter(
+        OffloadJob.status.in_([OffloadJob.STATUS_PENDING, OffloadJob.STATUS_RUNNING])
+    ).scalar()
+
+    pending = counts.get(OffloadJob.STATUS_PENDING, 0)
+    running = counts.get(OffloadJob.STATUS_RUNNING, 0)
+    return {
+        'depth': pending + running,
+        'pending': pending,
+        'running': running,
+        'done': counts.get(OffloadJob.STATUS_DONE, 0),
+        'failed': counts.get(OffloadJob.STATUS_FAILED, 0),
+        'oldest_pending_seconds': int((datetime.utcnow() - oldest).total_seconds()) if oldest else 0,
+        'workers': sum(1 for worker in _workers if worker.is_alive())
+    }
+
+def _worker_loop():
+    """Body of a worker thread: drain the queue, then sleep until the next poll."""
+    poll_interval = app.config['OFFLOAD_POLL_INTERVAL']
+    while not _stop_event.is_set():
+        with app.app_context():
+            try:
+                processed = run_pending(limit=20)
+            except Exception as e:
+                logger.error(f"Offload worker error: {str(e)}")
+                processed = 0
+            finally:
+                db.session.remove()
+        if not processed:
+            _stop_event.wait(poll_interval)
+
+def start_offload_workers(count=None):
+    """Start background threads that drain the offload queue."""
+    count = app.config['OFFLOAD_WORKERS'] if count is None else count
+    _stop_event.clear()
+    for i in range(count):
+        worker = threading.Thread(target=_worker_loop, name=f"offload-worker-{i}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+    if count:
+        logger.info(f"Started {count} offload worker(s)")
+
+def stop_offload_workers(timeout=5):
+    """Signal the worker threads to stop and wait for them."""
+    _stop_event.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
+
+@app.cli.command("offload-run")
+def offload_run_command():
+    """Process all due offload jobs once and exit."""
+    processed = run_pending()
+    print(f"Processed {processed} offload job(s)")
+    print(get_queue_stats())
+
+@app.cli.command("offload-retry")
+def offload_retry_command():
+    """Requeue failed offload jobs."""
+    print(f"Requeued {retry_failed_jobs()} failed offload job(s)")
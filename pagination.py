@@ -0,0 +1,124 @@
+import json
+import base64
+import logging
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from app import app
+from models import Photo
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Sort mode -> (column, descending). Each is backed by a (folder_id, column, id)
+# index on photos, with the id as tie-breaker so the order is total.
+SORT_ORDERS = {
+    'newest': (Photo.uploaded_at, True),
+    'oldest': (Photo.uploaded_at, False),
+    'name': (Photo.original_name, False),
+    'size': (Photo.file_size, True),
+}
+
+DEFAULT_SORT = 'newest'
+
+class InvalidCursor(ValueError):
+    """A page cursor that can't be decoded or was made for another sort order."""
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _decode_value(column, value):
+    """Convert a cursor value back to its column's type.
+
+    Raises:
+        ValueError: The value doesn't fit the column, e.g. text for sort=size
+    """
+    python_type = column.type.python_type
+    if python_type is datetime:
+        if not isinstance(value, str):
+            raise ValueError(f"Expected a timestamp, got {value!r}")
+        return datetime.fromisoformat(value)
+    # bool is an int to isinstance, but never a valid sort value
+    if isinstance(value, bool) or not isinstance(value, python_type):
+        raise ValueError(f"Expected {python_type.__name__}, got {value!r}")
+    return value
+
+def encode_cursor(photo, sort):
+    """Encode the position just after `photo` in the given sort order."""
+    column, _ = SORT_ORDERS[sort]
+    payload = [sort, _encode_value(getattr(photo, column.key)), photo.id]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort):
+    """Decode a cursor made by encode_cursor.
+
+    Returns:
+        tuple or None: (sort value, photo id), or None if the cursor is invalid
+            or belongs to a different sort order
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, photo_id = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if cursor_sort != sort or value is None:
+            return None
+        if isinstance(photo_id, bool) or not isinstance(photo_id, int):
+            raise ValueError(f"Expected a photo id, got {photo_id!r}")
+        column, _ = SORT_ORDERS[sort]
+        return _decode_value(column, value), photo_id
+    except Exception as e:
+        logger.warning(f"Invalid photo cursor: {str(e)}")
+        return None
+
+def get_photo_page(folder_id, sort=DEFAULT_SORT, cursor=None, limit=None):
+    """Fetch one page of a folder's photos using keyset pagination.
+
+    Instead of OFFSET, the query continues from the (value, id) of the last
+    photo on the previous page, so every page costs one index range scan no
+    matter how deep into the folder it is.
+
+    Args:
+        folder_id: The folder to list
+        sort: One of SORT_ORDERS (unknown values fall back to newest)
+        cursor: The next_cursor returned for the previous page, if any
+        limit: Page size (defaults to PHOTOS_PER_PAGE)
+
+    Returns:
+        tuple: (list of photos, cursor for the next page or None)
+
+    Raises:
+        InvalidCursor: `cursor` is not a cursor for this sort order; starting
+            over from the first page would repeat photos the client already has
+    """
+    if sort not in SORT_ORDERS:
+        sort = DEFAULT_SORT
+    limit = max(1, min(limit or app.config['PHOTOS_PER_PAGE'], app.config['PHOTOS_MAX_PER_PAGE']))
+    column, descending = SORT_ORDERS[sort]
+
+    query = Photo.query.filter(Photo.folder_id == folder_id)
+
+    if cursor:
+        position = decode_cursor(cursor, sort)
+        if position is None:
+            raise InvalidCursor("Invalid page cursor")
+        value, last_id = position
+        if descending:
+            query = query.filter(or_(column < value, and_(column == value, Photo.id < last_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, Photo.id > last_id)))
+
+    if descending:
+        query = query.order_by(column.desc(), Photo.id.desc())
+    else:
+        query = query.order_by(column.asc(), Photo.id.asc())
+
+    # Fetch one extra row to know whether another page follows
+    photos = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(photos) > limit:
+        photos = photos[:limit]
+        next_cursor = encode_cursor(photos[-1], sort)
+
+    return photos, next_cursor
@@ -0,0 +1,196 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from app import app, db
+from models import PhotoFolder
+from imaging import draw_qr
+from imagepool import run
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Output formats: extension -> MIME type
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+# Bump to invalidate every cached QR code after changing how they are drawn
+RENDER_VERSION = 1
+
+# Rendered QR codes by digest, least recently used first
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def qr_digest(data, size, fmt):
+    """Return the digest identifying a rendering; also used as its ETag.
+
+    The same data, box size and format always produce the same image, so the
+    digest can be computed (and matched against If-None-Match) without
+    rendering anything.
+    """
+    return hashlib.sha256(f"{RENDER_VERSION}|{size}|{fmt}|{data}".encode()).hexdigest()
+
+def render_qr(data, size, fmt):
+    """Draw a QR code in the image worker processes (see imaging.draw_qr).
+
+    Returns:
+        bytes: The encoded image
+    """
+    return run(draw_qr, data, size, fmt)
+
+def qr_cache_path(name, digest, fmt):
+    """Return the on-disk cache file of a rendering."""
+    return os.path.join(app.config['QR_CODE_FOLDER'], f"{name}-{digest[:16]}.{fmt}")
+
+def _remember(digest, content):
+    with _cache_lock:
+        _cache[digest] = content
+        _cache.move_to_end(digest)
+        while len(_cache) > app.config['QR_CACHE_SIZE']:
+            _cache.popitem(last=False)
+
+def get_qr(data, size, fmt, name):
+    """Return a QR code image, rendering it only if no cache has it.
+
+    Renderings are kept in a per-process LRU and in QR_CODE_FOLDER, so a
+    given code is drawn once and then read back (or served from memory).
+
+    Args:
+        data: The text to encode
+        size: Pixels per QR module
+        fmt: 'png' or 'svg'
+        name: Prefix of the cache file (e.g. the folder key)
+
+    Returns:
+        tuple: (image bytes, digest)
+    """
+    digest = qr_digest(data, size, fmt)
+
+    with _cache_lock:
+        content = _cache.get(digest)
+        if content is not None:
+            _cache.move_to_end(digest)
+            return content, digest
+
+    file_path = qr_cache_path(name, digest, fmt)
+    try:
+        with open(file_path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        content = render_qr(data, size, fmt)
+        # Write under a temporary name so readers never see a partial file
+        temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, file_path)
+        except OSError as e:
+            logger.error(f"Error caching QR code {file_path}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    _remember(digest, content)
+    return content, digest
+
+def delete_folder_qr(folder_key, qr_code_url=None):
+    """Remove the QR code files of a deleted folder.
+
+    Args:
+        folder_key: The folder's key, which names its cached renderings
+        qr_code_url: The folder's qr_code_url, for QR codes saved before the cache
+    """
+    legacy_name = None
+    if qr_code_url and qr_code_url.startswith('/static/qr_codes/'):
+        legacy_name = os.path.basename(qr_code_url)
+
+    with os.scandir(app.config['QR_CODE_FOLDER']) as entries:
+        for entry in entries:
+            if folder_key in _folder_key_candidates(entry.name) or entry.name == legacy_name:
+                _remove(entry.path)
+
+def _folder_key_candidates(file_name):
+    """Folder keys a QR file name could belong to.
+
+    Cached renderings are named "<folder_key>-<digest>.<fmt>"; files from
+    before the cache are "<folder_key>.png" or "<uuid>.png".
+    """
+    stem = file_name.split('.', 1)[0]
+    return {stem, stem.rsplit('-', 1)[0]}
+
+def _remove(file_path):
+    """Delete a file and return its size, or 0 if it couldn't be removed."""
+    try:
+        size = os.path.getsize(file_path)
+        os.remove(file_path)
+        return size
+    except OSError as e:
+        logger.error(f"Error removing QR code {file_path}: {str(e)}")
+        return 0
+
+def sweep_qr_codes(batch_size=None, min_age=None):
+    """Delete QR code files that no folder uses any more.
+
+    A file is kept if its name belongs to an existing folder's key or it is
+    some folder's qr_code_url. The directory is scanned in batches so each
+    database lookup stays small, and files younger than `min_age` seconds
+    are left alone in case their folder is still being created.
+
+    Returns:
+        dict: Files scanned and removed, and bytes reclaimed
+    """
+    batch_size = batch_size or app.config['QR_SWEEP_BATCH_SIZE']
+    min_age = app.config['QR_SWEEP_MIN_AGE'] if min_age is None else min_age
+    cutoff = time.time() - min_age
+    stats = {'scanned': 0, 'removed': 0, 'bytes_reclaimed': 0}
+
+    def sweep_batch(batch):
+        candidates = set()
+        for entry in batch:
+            candidates |= _folder_key_candidates(entry.name)
+        known_keys = {
+            key for (key,) in db.session.query(PhotoFolder.folder_key)
+            .filter(PhotoFolder.folder_key.in_(candidates))
+        }
+        urls = [f"/static/qr_codes/{entry.name}" for entry in batch]
+        known_urls = {
+            url for (url,) in db.session.query(PhotoFolder.qr_code_url)
+            .filter(PhotoFolder.qr_code_url.in_(urls))
+        }
+
+        for entry in batch:
+            if _folder_key_candidates(entry.name) & known_keys:
+                continue
+            if f"/static/qr_codes/{entry.name}" in known_urls:
+                continue
+            size = _remove(entry.path)
+            if size or not os.path.exists(entry.path):
+                stats['removed'] += 1
+                stats['bytes_reclaimed'] += size
+
+    batch = []
+    with os.scandir(app.config['QR_CODE_FOLDER']) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.stat().st_mtime > cutoff:
+                continue
+            stats['scanned'] += 1
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                sweep_batch(batch)
+                batch = []
+    if batch:
+        sweep_batch(batch)
+
+    if stats['removed']:
+        logger.info(f"QR sweep removed {stats['removed']} file(s), reclaimed {stats['bytes_reclaimed']} bytes")
+    return stats
+
+@app.cli.command("sweep-qr-codes")
+def sweep_qr_codes_command():
+    """Delete QR code files no folder references."""
+    print(sweep_qr_codes())
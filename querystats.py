@@ -0,0 +1,173 @@
+import time
+import types
+import logging
+import threading
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+from app import app, db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the queries-per-request histogram buckets
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Longest statement text kept as "slowest"; parameters are never recorded
+STATEMENT_PREVIEW = 200
+
+# Per-endpoint totals since the process started, guarded by _lock
+_totals = {}
+_lock = threading.Lock()
+
+def _new_totals():
+    return {
+        'requests': 0,
+        'request_seconds': 0.0,
+        'queries': 0,
+        'db_seconds': 0.0,
+        'over_budget': 0,
+        'buckets': [0] * len(QUERY_BUCKETS),
+    }
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    # Background workers run queries outside any request; those aren't counted
+    if not has_request_context() or 'db_queries' not in g:
+        return
+    g.db_queries += 1
+    g.db_seconds += elapsed
+    if elapsed > g.db_slowest[0]:
+        g.db_slowest = (elapsed, statement[:STATEMENT_PREVIEW])
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+def query_budget(endpoint):
+    """Queries a request to `endpoint` may issue before it is flagged."""
+    return app.config['QUERY_BUDGETS'].get(endpoint, app.config['QUERY_BUDGET'])
+
+@app.before_request
+def start_query_stats():
+    g.request_started = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    g.db_slowest = (0.0, None)
+
+@app.after_request
+def add_query_stats(response):
+    """Report the request's database work so far in the response headers.
+
+    Bodies streamed from a generator (e.g. ZIP downloads) can still query
+    while they are sent, so those requests are recorded once the body is
+    done rather than at teardown.
+    """
+    if 'db_queries' not in g:
+        return response
+    if app.config['QUERY_STATS_HEADERS']:
+        response.headers['X-DB-Query-Count'] = str(g.db_queries)
+        response.headers['X-DB-Time-Ms'] = f"{g.db_seconds * 1000:.1f}"
+        response.headers.add('Server-Timing', f'db;dur={g.db_seconds * 1000:.1f};desc="{g.db_queries} queries"')
+
+    if isinstance(response.response, types.GeneratorType):
+        g.db_record_when_sent = True
+        response.response = _record_when_sent(
+            response.response, g._get_current_object(), request.endpoint or 'unmatched', _label()
+        )
+    return response
+
+@app.teardown_request
+def record_query_stats(exception=None):
+    if 'db_queries' in g and not g.get('db_record_when_sent'):
+        _record(g, request.endpoint or 'unmatched', _label())
+
+def _label():
+    return f"{request.method} {request.path} ({request.endpoint or 'unmatched'})"
+
+def _record_when_sent(body, stats, endpoint, label):
+    try:
+        yield from body
+    finally:
+        _record(stats, endpoint, label)
+
+def _record(stats, endpoint, label):
+    """Add a finished request to the per-endpoint totals and flag it if over budget."""
+    elapsed = time.perf_counter() - stats.request_started
+    queries, db_seconds = stats.db_queries, stats.db_seconds
+    budget = query_budget(endpoint)
+
+    with _lock:
+        totals = _totals.setdefault(endpoint, _new_totals())
+        totals['requests'] += 1
+        totals['request_seconds'] += elapsed
+        totals['queries'] += queries
+        totals['db_seconds'] += db_seconds
+        totals['over_budget'] += queries > budget
+        for index, bound in enumerate(QUERY_BUCKETS):
+            if queries <= bound:
+                totals['buckets'][index] += 1
+
+    fields = {
+        'endpoint': endpoint,
+        'db_queries': queries,
+        'db_time_ms': round(db_seconds * 1000, 1),
+        'duration_ms': round(elapsed * 1000, 1),
+        # Set here too, for bodies that finish after the request context is gone
+        'request_id': stats.get('request_id'),
+    }
+    if queries > budget:
+        slowest_seconds, slowest = stats.db_slowest
+        logger.warning(
+            f"{label} ran {queries} queries, over its budget of {budget}; "
+            f"{db_seconds * 1000:.1f} ms in the database, slowest {slowest_seconds * 1000:.1f} ms: {slowest}",
+            extra=dict(fields, slowest_statement=slowest, slowest_ms=round(slowest_seconds * 1000, 1))
+        )
+    else:
+        logger.debug("%s: %d queries, %.1f ms in the database, %.1f ms total", label, queries, db_seconds * 1000, elapsed * 1000, extra=fields)
+
+def render_metrics():
+    """Return the per-endpoint totals of this process in the Prometheus text format."""
+    with _lock:
+        snapshot = {endpoint: dict(totals, buckets=list(totals['buckets'])) for endpoint, totals in _totals.items()}
+
+    lines = []
+    def family(name, kind, help_text, values):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(values)
+
+    def each(key, name):
+        return [f'{name}{{endpoint="{endpoint}"}} {totals[key]}' for endpoint, totals in sorted(snapshot.items())]
+
+    family('photobooth_requests_total', 'counter', 'Requests handled, by endpoint',
+           each('requests', 'photobooth_requests_total'))
+    family('photobooth_request_seconds_total', 'counter', 'Time spent handling requests, by endpoint',
+           each('request_seconds', 'photobooth_request_seconds_total'))
+    family('photobooth_db_seconds_total', 'counter', 'Time spent in database queries, by endpoint',
+           each('db_seconds', 'photobooth_db_seconds_total'))
+    family('photobooth_query_budget_exceeded_total', 'counter', 'Requests that ran more queries than their budget, by endpoint',
+           each('over_budget', 'photobooth_query_budget_exceeded_total'))
+
+    histogram = []
+    for endpoint, totals in sorted(snapshot.items()):
+        for bound, count in zip(QUERY_BUCKETS, totals['buckets']):
+            histogram.append(f'photobooth_db_queries_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+        histogram.append(f'photobooth_db_queries_bucket{{endpoint="{endpoint}",le="+Inf"}} {totals["requests"]}')
+        histogram.append(f'photobooth_db_queries_sum{{endpoint="{endpoint}"}} {totals["queries"]}')
+        histogram.append(f'photobooth_db_queries_count{{endpoint="{endpoint}"}} {totals["requests"]}')
+    family('photobooth_db_queries', 'histogram', 'Database queries per request, by endpoint', histogram)
+
+    return "\n".join(lines) + "\n"
+
+# Flask-SQLAlchemy creates the engine when the app is initialized; this
+# module is imported inside the app context
+event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+event.listen(db.engine, 'handle_error', _handle_error)
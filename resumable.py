@@ -0,0 +1,257 @@
+import os
+import math
+import uuid
+import logging
+from datetime import datetime, timedelta
+
+from app import app, db
+from models import UploadSession, FileTombstone
+from utils import allowed_file
+from ingest import FileWriter, UploadRejected
+import deletion
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def chunk_dir(upload_id):
+    """Return the directory holding the chunks of an upload session."""
+    return os.path.join(app.config['CHUNK_FOLDER'], upload_id)
+
+def chunk_path(upload_id, index):
+    """Return the file path of one chunk."""
+    return os.path.join(chunk_dir(upload_id), str(index))
+
+def chunk_count(session):
+    """Number of chunks the file is split into."""
+    return max(1, math.ceil(session.total_size / session.chunk_size))
+
+def expected_chunk_length(session, index):
+    """Length in bytes of chunk `index`; only the last one may be short."""
+    if index < chunk_count(session) - 1:
+        return session.chunk_size
+    return session.total_size - session.chunk_size * (chunk_count(session) - 1)
+
+def start_session(folder, filename, total_size):
+    """Create a resumable upload session for a folder.
+
+    The caller has already checked that the folder accepts uploads.
+
+    Returns:
+        UploadSession: The committed session
+
+    Raises:
+        UploadRejected: The file name or size is not acceptable
+    """
+    if not filename:
+        raise UploadRejected("No file selected")
+    if not allowed_file(filename):
+        raise UploadRejected("File type not allowed")
+    if not isinstance(total_size, int) or total_size <= 0:
+        raise UploadRejected("File size is required")
+    if total_size > app.config['MAX_FILE_SIZE']:
+        raise UploadRejected(f"File is larger than {app.config['MAX_FILE_SIZE'] // (1024 * 1024)}MB", 413)
+
+    session = UploadSession(
+        id=str(uuid.uuid4()),
+        folder_id=folder.id,
+        original_name=filename,
+        total_size=total_size,
+        chunk_size=app.config['RESUMABLE_CHUNK_SIZE'],
+        expires_at=datetime.utcnow() + timedelta(seconds=app.config['RESUMABLE_UPLOAD_TTL'])
+    )
+    db.session.add(session)
+    db.session.commit()
+
+    os.makedirs(chunk_dir(session.id), exist_ok=True)
+    logger.info(f"Started resumable upload {session.id} for folder {folder.id} ({total_size} bytes)")
+    return session
+
+def get_session(upload_id):
+    """Look up an upload session that can still receive chunks.
+
+    Raises:
+        UploadRejected: Unknown (404) or expired (410) session
+    """
+    session = db.session.get(UploadSession, upload_id)
+    if session is None:
+        raise UploadRejected("Upload not found", 404)
+    if session.completed_at is None and session.expires_at < datetime.utcnow():
+        raise UploadRejected("Upload has expired, please start again", 410)
+    return session
+
+def write_chunk(session, index, stream):
+    """Store one chunk read from a request body.
+
+    Re-sending a chunk replaces it, so clients can retry freely.
+
+    Raises:
+        UploadRejected: Bad index, wrong length, or the session is finished
+    """
+    if session.completed_at is not None:
+        raise UploadRejected("Upload is already complete", 409)
+    if session.state == UploadSession.STATE_FINALIZING:
+        raise UploadRejected("Upload is being finalized", 409)
+    if index < 0 or index >= chunk_count(session):
+        raise UploadRejected(f"Chunk index must be between 0 and {chunk_count(session) - 1}")
+
+    expected = expected_chunk_length(session, index)
+    read_size = app.config['UPLOAD_CHUNK_SIZE']
+    final_path = chunk_path(session.id, index)
+    temp_path = f"{final_path}.{uuid.uuid4().hex}.part"
+    written = 0
+
+    os.makedirs(chunk_dir(session.id), exist_ok=True)
+    try:
+        with open(temp_path, 'wb') as f:
+            while True:
+                data = stream.read(read_size)
+                if not data:
+                    break
+                written += len(data)
+                if written > expected:
+                    raise UploadRejected(f"Chunk {index} must be {expected} bytes")
+                f.write(data)
+
+        if written != expected:
+            raise UploadRejected(f"Chunk {index} is incomplete ({written} of {expected} bytes)")
+
+        os.replace(temp_path, final_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def received_chunks(session):
+    """Return the sorted indexes of the chunks stored so far."""
+    try:
+        names = os.listdir(chunk_dir(session.id))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+def get_offset(session):
+    """Bytes received without gaps from the start of the file.
+
+    A client resuming after a dropped connection continues from here.
+    """
+    contiguous = 0
+    for index in received_chunks(session):
+        if index != contiguous:
+            break
+        contiguous += 1
+    return min(session.total_size, contiguous * session.chunk_size)
+
+def assemble(session):
+    """Join the chunks into one uploaded file.
+
+    The chunks are streamed through the same writer as /upload, so the
+    result is checked, sized and hashed the same way.
+
+    Returns:
+        dict: A saved file result, as from ingest.stream_multipart_upload
+
+    Raises:
+        UploadRejected: Chunks are missing or the content is not an image
+    """
+    missing = sorted(set(range(chunk_count(session))) - set(received_chunks(session)))
+    if missing:
+        raise UploadRejected(f"Missing chunks: {', '.join(str(index) for index in missing[:20])}", 409)
+
+    read_size = app.config['UPLOAD_CHUNK_SIZE']
+    writer = FileWriter(session.original_name)
+    try:
+        for index in range(chunk_count(session)):
+            with open(chunk_path(session.id, index), 'rb') as f:
+                for data in iter(lambda: f.read(read_size), b''):
+                    writer.write(data)
+        return writer.finish()
+    except Exception:
+        writer.discard()
+        raise
+
+def claim_session(session):
+    """Take an open session for finalizing.
+
+    The state is switched with a conditional UPDATE, so when two finalize
+    requests race only one of them assembles the photo.
+
+    Returns:
+        bool: True if this request claimed the session
+    """
+    claimed = UploadSession.query.filter_by(
+        id=session.id, state=UploadSession.STATE_OPEN
+    ).update({'state': UploadSession.STATE_FINALIZING}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+def release_session(session):
+    """Reopen a claimed session after finalizing failed, so it can be retried."""
+    db.session.rollback()
+    UploadSession.query.filter_by(
+        id=session.id, state=UploadSession.STATE_FINALIZING
+    ).update({'state': UploadSession.STATE_OPEN}, synchronize_session=False)
+    db.session.commit()
+
+def complete_session(session, photo):
+    """Mark a session finished and queue its chunks for removal (see deletion.py)."""
+    session.photo_id = photo.id
+    session.completed_at = datetime.utcnow()
+    session.state = UploadSession.STATE_COMPLETE
+    deletion.bury([{'kind': FileTombstone.KIND_DIRECTORY, 'path': chunk_dir(session.id)}])
+    db.session.commit()
+
+def delete_folder_sessions(folder_id):
+    """Delete a folder's upload sessions (the caller commits).
+
+    The chunks are left for the caller to remove once the deletion has
+    committed (deletion.py queues them as tombstones).
+
+    Returns:
+        list: Chunk directories of the deleted sessions
+    """
+    sessions = UploadSession.query.filter_by(folder_id=folder_id)
+    directories = [chunk_dir(upload_id) for (upload_id,) in sessions.with_entities(UploadSession.id)]
+    sessions.delete(synchronize_session=False)
+    return directories
+
+def purge_expired_sessions(batch_size=None):
+    """Delete expired upload sessions, finished or not.
+
+    Their chunk directories are queued as tombstones in the same transaction
+    for the file removal worker (see deletion.py). The expiry scheduler runs
+    this every FOLDER_EXPIRY_INTERVAL seconds (see expiry.py).
+
+    Returns:
+        int: Number of sessions removed
+    """
+    batch_size = batch_size or app.config['RESUMABLE_PURGE_BATCH_SIZE']
+    purged = 0
+
+    while True:
+        upload_ids = [
+            upload_id for (upload_id,) in db.session.query(UploadSession.id).filter(
+                UploadSession.expires_at < datetime.utcnow()
+            ).order_by(UploadSession.expires_at).limit(batch_size)
+        ]
+        if not upload_ids:
+            break
+
+        deletion.bury([
+            {'kind': FileTombstone.KIND_DIRECTORY, 'path': chunk_dir(upload_id)}
+            for upload_id in upload_ids
+        ])
+        UploadSession.query.filter(UploadSession.id.in_(upload_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        purged += len(upload_ids)
+
+        if len(upload_ids) < batch_size:
+            break
+
+    if purged:
+        logger.info(f"Purged {purged} expired upload sessions")
+    return purged
+
+@app.cli.command("purge-uploads")
+def purge_uploads_command():
+    """Delete expired resumable upload sessions."""
+    print(f"Purged {purge_expired_sessions()} upload session(s)")
@@ -1,21 +1,51 @@
 import os
-import uuid
+import hmac
 import json
 import logging
 from functools import wraps
 from datetime import datetime
 
 from werkzeug.utils import secure_filename
-from flask import render_template, redirect, url_for, flash, request, jsonify, send_file, abort
+from werkzeug.datastructures import ContentRange
+from flask import render_template, redirect, url_for, flash, request, jsonify, abort, stream_with_context
 from flask_login import login_user, logout_user, current_user, login_required
+from sqlalchemy.orm import joinedload, selectinload
 
 from app import app, db
 from models import User, PhotoFolder, Photo
-from utils import allowed_file, save_local_file, upload_to_catbox, generate_qr_url, generate_share_token, decode_share_token
+from sharing import (
+    generate_share_token, decode_share_token, revoke_share_token, share_max_age,
+    get_shared_page, remember_shared_page
+)
+from ingest import stream_multipart_upload, discard_saved_files, UploadRejected
+from offload import enqueue_offload, get_queue_stats, retry_failed_jobs
+from pagination import get_photo_page, InvalidCursor, SORT_ORDERS, DEFAULT_SORT
+from stats import get_dashboard_summary
+from counters import record_photos_added
+from normalize import normalize_uploads
+from blobstore import store_upload, store_original, place_upload
+import resumable
+import deletion
+from thumbnails import queue_thumbnails, get_thumbnail_path, thumbnail_path, is_valid_size
+from folder_cache import get_folder_snapshot, invalidate_folder_snapshot, scan_session_token
+from qrcodes import get_qr, qr_digest, QR_FORMATS
+from imagepool import ImageQueueFull
+from zipexport import FolderZip
+from media import send_media
+from querystats import render_metrics
+from logconfig import SAMPLED
+from storage import get_backend, available_backends
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Storage type choices on the folder form -> storage backend names
+FOLDER_STORAGE_TYPES = {
+    "local": "local",
+    "cloud": "catbox",
+    "s3": "s3"
+}
+
 # Admin decorator
 def admin_required(f):
     """Decorator for routes that require admin access."""
@@ -155,7 +185,7 @@ def folders():
 @login_required
 def view_folder(folder_key):
     """View photos in a specific folder."""
-    folder = PhotoFolder.query.filter_by(folder_key=folder_key).first_or_404()
+    folder = PhotoFolder.query.options(joinedload(PhotoFolder.user)).filter_by(folder_key=folder_key).first_or_404()
     
     # Check if the current user has permission to view this folder
     if folder.user_id != current_user.id and not current_user.is_admin:
@@ -163,23 +193,61 @@ def view_folder(folder_key):
         return redirect(url_for("folders"))
     
     # Get sort parameter
-    sort = request.args.get("sort", "newest")
+    sort = request.args.get("sort", DEFAULT_SORT)
+    if sort not in SORT_ORDERS:
+        sort = DEFAULT_SORT
+    
+    # Only the first page is rendered; the rest is loaded by infinite scroll
+    photos, next_cursor = get_photo_page(folder.id, sort)
+    
+    return render_template(
+        "view_folder.html",
+        folder=folder,
+        photos=photos,
+        sort=sort,
+        next_cursor=next_cursor
+    )
+
+@app.route("/folder/view/<folder_key>/photos")
+@login_required
+def folder_photos(folder_key):
+    """Return a page of a folder's photos as JSON for infinite scroll."""
+    folder = PhotoFolder.query.filter_by(folder_key=folder_key).first_or_404()
     
-    # Query photos with sorting
-    photos_query = Photo.query.filter_by(folder_id=folder.id)
+    # Check if the current user has permission to view this folder
+    if folder.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({"success": False, "message": "You don't have permission to view this folder."}), 403
     
-    if sort == "newest":
-        photos_query = photos_query.order_by(Photo.uploaded_at.desc())
-    elif sort == "oldest":
-        photos_query = photos_query.order_by(Photo.uploaded_at.asc())
-    elif sort == "name":
-        photos_query = photos_query.order_by(Photo.original_name.asc())
-    elif sort == "size":
-        photos_query = photos_query.order_by(Photo.file_size.desc())
+    sort = request.args.get("sort", DEFAULT_SORT)
+    if sort not in SORT_ORDERS:
+        sort = DEFAULT_SORT
+    cursor = request.args.get("cursor")
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"success": False, "message": "limit must be at least 1."}), 400
     
-    photos = photos_query.all()
+    try:
+        photos, next_cursor = get_photo_page(folder.id, sort, cursor=cursor, limit=limit)
+    except InvalidCursor as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     
-    return render_template("view_folder.html", folder=folder, photos=photos, sort=sort)
+    return jsonify({
+        "success": True,
+        "sort": sort,
+        "photos": [
+            {
+                "id": photo.id,
+                "original_name": photo.original_name,
+                "file_url": photo.file_url,
+                "file_size": photo.file_size,
+                "uploaded_at": photo.uploaded_at.isoformat() if photo.uploaded_at else None
+            }
+            for photo in photos
+        ],
+        "html": render_template("_photo_card.html", photos=photos),
+        "next_cursor": next_cursor,
+        "next_url": url_for("folder_photos", folder_key=folder.folder_key, sort=sort, cursor=next_cursor) if next_cursor else None
+    })
 
 @app.route("/generate", methods=["GET", "POST"])
 @login_required
@@ -208,14 +276,20 @@ def generate():
             
             logger.info(f"Creating new folder: {folder_name}, storage type: {storage_type}, expiration: {expiration_hours} hours")
             
-            is_local = (storage_type == "local")
+            # "cloud" is catbox.moe; "s3" is only offered when a bucket is configured
+            storage_backend = FOLDER_STORAGE_TYPES.get(storage_type, "local")
+            if storage_backend not in available_backends():
+                flash("That storage type is not available.", "danger")
+                return redirect(url_for("generate"))
+            is_local = (storage_backend == "local")
             
             # Create a new folder
             folder = PhotoFolder.create_folder(
                 name=folder_name,
                 user_id=current_user.id,
                 is_local=is_local,
-                expiration_hours=expiration_hours
+                expiration_hours=expiration_hours,
+                storage_backend=storage_backend
             )
             
             logger.info(f"Folder created with ID: {folder.id}, key: {folder.folder_key}")
@@ -224,7 +298,13 @@ def generate():
             scan_url = url_for("scan", folder_key=folder.folder_key, _external=True)
             logger.info(f"Generating QR code for URL: {scan_url}")
             
-            qr_url = generate_qr_url(scan_url)
+            # Render it now so the first view is served from the cache
+            try:
+                get_qr(scan_url, app.config["QR_DEFAULT_SIZE"], "png", folder.folder_key)
+                qr_url = url_for("folder_qr", folder_key=folder.folder_key, fmt="png")
+            except Exception as e:
+                logger.error(f"Error generating QR code: {str(e)}")
+                qr_url = None
             
             if qr_url:
                 logger.info(f"QR code generated successfully: {qr_url}")
@@ -233,18 +313,6 @@ def generate():
                 folder.qr_code_generated_at = datetime.utcnow()
                 db.session.commit()
                 
-                # Copy QR code to make it accessible by folder key for stability
-                try:
-                    qr_source_path = os.path.join(app.root_path, 'static', qr_url.lstrip('/static/'))
-                    qr_dest_name = f"{folder.folder_key}.png"
-                    qr_dest_path = os.path.join(app.config['QR_CODE_FOLDER'], qr_dest_name)
-                    
-                    import shutil
-                    shutil.copy2(qr_source_path, qr_dest_path)
-                    logger.info(f"QR code copied to: {qr_dest_path}")
-                except Exception as e:
-                    logger.error(f"Error copying QR code for folder stability: {str(e)}")
-                
                 return render_template("generate.html", folder=folder, qr_data=scan_url)
             else:
                 # QR code generation failed
@@ -258,16 +326,57 @@ def generate():
         flash("There was a problem creating your folder. Please try again.", "danger")
         return redirect(url_for("folders"))
 
+@app.route("/folder/qr/<folder_key>.<fmt>")
+def folder_qr(folder_key, fmt):
+    """Serve the QR code of a folder's scan page.
+    
+    The code only depends on the scan URL, so it is rendered once and then
+    served from cache; clients revalidate with the ETag.
+    """
+    size = request.args.get("size", app.config["QR_DEFAULT_SIZE"], type=int)
+    if fmt not in QR_FORMATS or size not in app.config["QR_SIZES"]:
+        abort(404)
+    
+    # The ETag only depends on the URL, so revalidation needs no lookup; a
+    # full response checks the folder exists, through its cached snapshot
+    scan_url = url_for("scan", folder_key=folder_key, _external=True)
+    etag = qr_digest(scan_url, size, fmt)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        if get_folder_snapshot(folder_key) is None:
+            abort(404)
+        try:
+            content, etag = get_qr(scan_url, size, fmt, folder_key)
+        except ImageQueueFull:
+            abort(503)
+        response = app.response_class(content, mimetype=QR_FORMATS[fmt])
+    
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["QR_MAX_AGE"]
+    return response
+
 @app.route("/scan/<folder_key>")
 def scan(folder_key):
-    """Upload page for scanning QR code."""
+    """Upload page for scanning QR code.
+    
+    This is the busiest page at events, so it reads a cached snapshot of the
+    folder and never writes to the database.
+    """
     try:
-        folder = PhotoFolder.query.filter_by(folder_key=folder_key).first_or_404()
+        folder = get_folder_snapshot(folder_key)
+        if folder is None:
+            abort(404)
         
-        # Check if QR code is active or expired
-        if not folder.qr_code_active:
-            logger.info(f"QR code manually deactivated for folder: {folder.folder_name}")
-            reason = "The QR code has been manually deactivated by the owner."
+        # Check if the QR code has permanently expired (time-limited expiry);
+        # first, as the expiry scheduler also clears qr_code_active
+        if folder.is_past_expiry():
+            logger.info("QR code permanently expired for folder: %s", folder.folder_name)
+            reason = "The QR code has expired."
+            if folder.qr_code_expires_at:
+                reason += f" It expired on {folder.qr_code_expires_at.strftime('%Y-%m-%d %H:%M UTC')}."
+            
             return render_template(
                 "qr_expired.html",
                 folder=folder,
@@ -276,13 +385,10 @@ def scan(folder_key):
                 is_authenticated=current_user.is_authenticated
             )
         
-        # Check if the QR code has permanently expired (time-limited expiry)
-        if folder.is_qr_code_expired():
-            logger.info(f"QR code permanently expired for folder: {folder.folder_name}")
-            reason = "The QR code has expired."
-            if folder.qr_code_expires_at:
-                reason += f" It expired on {folder.qr_code_expires_at.strftime('%Y-%m-%d %H:%M UTC')}."
-            
+        # Check if QR code is active
+        if not folder.qr_code_active:
+            logger.info("QR code manually deactivated for folder: %s", folder.folder_name)
+            reason = "The QR code has been manually deactivated by the owner."
             return render_template(
                 "qr_expired.html",
                 folder=folder,
@@ -291,42 +397,10 @@ def scan(folder_key):
                 is_authenticated=current_user.is_authenticated
             )
         
-        # Generate a token for the upload
-        token = str(uuid.uuid4())
+        # Token of the current scan session; it rotates every SCAN_SESSION_SECONDS
+        token = scan_session_token(folder.folder_key)
         
-        # Check for temporary QR code expiry (60 seconds for scan session)
-        qr_expired = False
-        if folder.qr_code_generated_at:
-            now = datetime.utcnow()
-            expiry_time = folder.qr_code_generated_at
-            time_difference = (now - expiry_time).total_seconds()
-            qr_expired = time_difference > 60  # 60 seconds expiry time for scan session
-            
-            if qr_expired:
-                logger.info(f"QR code scan session expired for folder: {folder.folder_name}. Regenerating...")
-                # Regenerate QR code
-                scan_url = url_for("scan", folder_key=folder.folder_key, _external=True)
-                qr_url = generate_qr_url(scan_url)
-                
-                if qr_url:
-                    folder.qr_code_url = qr_url
-                    folder.qr_code_generated_at = datetime.utcnow()
-                    # Don't reset the qr_code_expires_at field here - that's a separate time limit
-                    db.session.commit()
-                    
-                    # Copy QR code for stability
-                    try:
-                        qr_source_path = os.path.join(app.root_path, 'static', qr_url.lstrip('/static/'))
-                        qr_dest_name = f"{folder.folder_key}.png"
-                        qr_dest_path = os.path.join(app.config['QR_CODE_FOLDER'], qr_dest_name)
-                        
-                        import shutil
-                        shutil.copy2(qr_source_path, qr_dest_path)
-                        logger.info(f"Regenerated QR code copied to: {qr_dest_path}")
-                    except Exception as e:
-                        logger.error(f"Error copying regenerated QR code: {str(e)}")
-        
-        logger.info(f"Rendering scan page for folder: {folder.folder_name} (key: {folder_key})")
+        logger.debug("Rendering scan page for folder: %s (key: %s)", folder.folder_name, folder_key)
         
         # If expiration time is set, add it to the template context
         expires_at = None
@@ -339,7 +413,6 @@ def scan(folder_key):
             folder_name=folder.folder_name,
             use_local_storage=folder.is_local,
             token=token,
-            qr_refreshed=qr_expired,  # Pass to template if QR was just refreshed
             expires_at=expires_at  # Pass expiration time to template
         )
     except Exception as e:
@@ -352,120 +425,401 @@ def scan(folder_key):
 @admin_required
 def admin():
     """Admin dashboard."""
-    users = User.query.order_by(User.created_at.desc()).all()
-    folders = PhotoFolder.query.order_by(PhotoFolder.created_at.desc()).all()
-    photos = Photo.query.order_by(Photo.uploaded_at.desc()).limit(50).all()
+    per_page = app.config["ADMIN_PAGE_SIZE"]
+    users_page = request.args.get("users_page", 1, type=int)
+    folders_page = request.args.get("folders_page", 1, type=int)
+    
+    # Totals come from cached SQL aggregates; the tables are paginated
+    summary = get_dashboard_summary()
+    users = User.query.order_by(User.created_at.desc(), User.id.desc()).paginate(
+        page=users_page, per_page=per_page, error_out=False
+    )
+    folders = PhotoFolder.query.options(joinedload(PhotoFolder.user)).order_by(
+        PhotoFolder.created_at.desc(), PhotoFolder.id.desc()
+    ).paginate(page=folders_page, per_page=per_page, error_out=False)
+    photos = Photo.query.options(
+        joinedload(Photo.folder), joinedload(Photo.user)
+    ).order_by(Photo.uploaded_at.desc()).limit(50).all()
     
     return render_template(
         "admin.html", 
+        summary=summary,
         users=users, 
         folders=folders, 
         photos=photos
     )
 
+@app.route("/admin/offload")
+@login_required
+@admin_required
+def admin_offload_status():
+    """Report the catbox.moe offload queue depth and job counts."""
+    return jsonify(get_queue_stats())
+
+@app.route("/admin/offload/retry", methods=["POST"])
+@login_required
+@admin_required
+def admin_offload_retry():
+    """Requeue failed catbox.moe offload jobs."""
+    requeued = retry_failed_jobs()
+    return jsonify({"success": True, "requeued": requeued, "queue": get_queue_stats()})
+
+@app.route("/metrics")
+def metrics():
+    """Request and database query totals of this process, for Prometheus.
+
+    Only admins and scrapers sending "Authorization: Bearer <METRICS_TOKEN>"
+    may read them; without METRICS_TOKEN only admins can.
+    """
+    token = app.config["METRICS_TOKEN"]
+    authorized = bool(token) and hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()
+    )
+    if not authorized and not (current_user.is_authenticated and current_user.is_admin):
+        abort(401)
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+def get_upload_folder(folder_key):
+    """Look up the folder an upload is for and check it accepts uploads.
+    
+    Returns:
+        FolderSnapshot: The folder's cached snapshot (see folder_cache.py)
+    
+    Raises:
+        UploadRejected: The folder is missing, deactivated or expired
+    """
+    if not folder_key:
+        logger.warning("No folder specified")
+        raise UploadRejected("No folder specified")
+    
+    # Get the folder; a cached snapshot, as uploads to one folder come in bursts
+    folder = get_folder_snapshot(folder_key)
+    if not folder:
+        logger.warning(f"Folder not found: {folder_key}")
+        raise UploadRejected("Folder not found", 404)
+        
+    # Check if the QR code has exceeded its time limit; first, as the expiry
+    # scheduler also clears qr_code_active
+    if folder.is_past_expiry():
+        logger.warning(f"Attempt to upload to folder with expired QR code: {folder_key}")
+        raise UploadRejected("This QR code has expired and can no longer be used for uploads", 403)
+        
+    # Check if QR code is active
+    if not folder.qr_code_active:
+        logger.warning(f"Attempt to upload to folder with deactivated QR code: {folder_key}")
+        raise UploadRejected("This QR code has been deactivated and can no longer be used for uploads", 403)
+    
+    return folder
+
+def save_photos(folder, results):
+    """Store uploaded files and create their Photo rows in one transaction.
+    
+    The rows are inserted together and the folder and owner counters are
+    updated once for the whole batch.
+    
+    Args:
+        folder: The folder the photos were uploaded to
+        results: Saved file results from ingest.py
+    
+    Returns:
+        list: The committed photos, in the order of `results`
+    
+    Raises:
+        UploadRejected: The folder was deleted since its snapshot was cached
+    """
+    # Upright, size-capped and re-encoded, all files at once in the image
+    # workers; see normalize.py
+    normalize_uploads(results)
+    
+    # `folder` may be a snapshot up to FOLDER_CACHE_TTL old, and another
+    # process may have deleted the folder since. Check it in this
+    # transaction, with a share lock where the database has one, so it can't
+    # be deleted before the photos are committed.
+    if db.session.execute(
+        db.select(PhotoFolder.id).where(PhotoFolder.id == folder.id).with_for_update(read=True)
+    ).first() is None:
+        raise UploadRejected("Folder not found", 404)
+    
+    photos = []
+    for result in results:
+        # Identical content is stored once; see blobstore.py
+        blob = store_upload(result)
+        original_blob = store_original(result)
+        
+        photos.append(Photo(
+            file_name=result["file_name"],
+            original_name=result["original_name"],
+            file_url=result["file_url"],
+            file_size=result["file_size"],
+            mime_type=result["mime_type"],
+            is_local=True,  # Until the offload worker has moved it to catbox.moe
+            local_path=result["local_path"],
+            blob=blob,
+            original_blob=original_blob,
+            user_id=folder.user_id,
+            folder_id=folder.id
+        ))
+    
+    db.session.add_all(photos)
+    db.session.flush()
+    record_photos_added(photos)
+    
+    # Cloud folders are offloaded to catbox.moe in the background so the
+    # request doesn't wait on the remote API
+    if not folder.is_local:
+        for photo in photos:
+            enqueue_offload(photo)
+    
+    photo_ids = [photo.id for photo in photos]
+    folder_id = folder.id
+    db.session.commit()
+    
+    # The files only go into the blob store once their rows are committed
+    for result in results:
+        place_upload(result)
+    
+    # Committing expired the rows; reload them together rather than one query each
+    Photo.query.filter(Photo.id.in_(photo_ids)).all()
+    
+    # Lazy arguments: most of these records are dropped by sampling before they are formatted
+    logger.info("Created %d photo record(s) in folder %s: %s", len(photos), folder_id, photo_ids, extra=SAMPLED)
+    
+    # Start the gallery thumbnails in the image workers; anything they miss
+    # is generated on first request
+    if app.config["THUMBNAIL_ON_UPLOAD"]:
+        queue_thumbnails(photos)
+    
+    return photos
+
+def save_photo(folder, result):
+    """Store one uploaded file and create its Photo row (see save_photos)."""
+    return save_photos(folder, [result])[0]
+
 @app.route("/upload", methods=["POST"])
 def upload():
-    """Handle file uploads."""
+    """Handle file uploads.
+    
+    The body is streamed straight to disk (see ingest.py). Clients should send
+    the folder_id field before the file so a bad folder is rejected before
+    any file data is read.
+    """
     try:
-        logger.info("Upload request received")
+        logger.debug("Upload request received")
         
-        if "file" not in request.files:
-            logger.warning("No file part in request")
-            return jsonify({"success": False, "error": "No file part"}), 400
-            
-        file = request.files["file"]
-        folder_id = request.form.get("folder_id")
+        checked = {}
+        saved = []
         
-        logger.info(f"Upload request for folder: {folder_id}, file: {file.filename if file else 'None'}")
+        def check_folder(fields):
+            checked["folder"] = get_upload_folder(fields.get("folder_id") or request.args.get("folder_id"))
         
-        if not file or file.filename == "":
-            logger.warning("No file selected")
-            return jsonify({"success": False, "error": "No file selected"}), 400
-            
-        if not allowed_file(file.filename):
-            logger.warning(f"File type not allowed: {file.filename}")
-            return jsonify({"success": False, "error": "File type not allowed"}), 400
+        try:
+            fields, saved = stream_multipart_upload(request, before_file=check_folder)
             
-        if not folder_id:
-            logger.warning("No folder specified")
-            return jsonify({"success": False, "error": "No folder specified"}), 400
-        
-        # Get the folder
-        folder = PhotoFolder.query.filter_by(folder_key=folder_id).first()
-        if not folder:
-            logger.warning(f"Folder not found: {folder_id}")
-            return jsonify({"success": False, "error": "Folder not found"}), 404
+            if not saved:
+                logger.warning("No file part in request")
+                raise UploadRejected("No file part")
             
-        # Check if QR code is active
-        if not folder.qr_code_active:
-            logger.warning(f"Attempt to upload to folder with deactivated QR code: {folder_id}")
-            return jsonify({"success": False, "error": "This QR code has been deactivated and can no longer be used for uploads"}), 403
-            
-        # Check if the QR code has exceeded its time limit
-        if folder.is_qr_code_expired():
-            logger.warning(f"Attempt to upload to folder with expired QR code: {folder_id}")
-            return jsonify({"success": False, "error": "This QR code has expired and can no longer be used for uploads"}), 403
-        
-        logger.info(f"Processing upload for folder {folder.folder_name} (ID: {folder.id}), is_local: {folder.is_local}")
-        
-        # Process the upload - respect the folder's storage setting
-        if folder.is_local:
-            logger.info("Using local storage for this upload")
-            result = save_local_file(file, file.filename)
-        else:
-            logger.info("Using catbox.moe cloud storage for this upload")
-            result = upload_to_catbox(file)
-        
-        if not result["success"]:
-            logger.error(f"Upload failed: {result.get('error', 'Unknown error')}")
-            return jsonify({"success": False, "error": result.get("error", "Upload failed")}), 500
+            # Older clients send the folder after the file
+            folder = checked.get("folder") or get_upload_folder(fields.get("folder_id") or request.args.get("folder_id"))
+        except UploadRejected as e:
+            discard_saved_files(saved)
+            logger.warning(f"Upload rejected: {e.message}")
+            return jsonify({"success": False, "error": e.message}), e.status
         
-        logger.info(f"File saved successfully: {result['file_url']}")
+        result = saved[0]
         
-        # Determine if this is actually stored in the cloud or locally
-        is_cloud = not folder.is_local and result.get('is_cloud', False)
-        is_local = folder.is_local or result.get('is_fallback', False)
+        try:
+            photo = save_photo(folder, result)
+        except Exception:
+            # The blob references taken for the upload go with the rollback
+            db.session.rollback()
+            discard_saved_files(saved)
+            raise
         
-        logger.info(f"Storage status - Cloud: {is_cloud}, Local: {is_local}")
+        return jsonify({
+            "success": True,
+            "message": "File uploaded successfully",
+            "file_url": photo.file_url,
+            "photo_id": photo.id,
+            "offload_queued": not folder.is_local
+        })
+    except UploadRejected as e:
+        logger.warning(f"Upload rejected: {e.message}")
+        return jsonify({"success": False, "error": e.message}), e.status
+    except Exception as e:
+        logger.error(f"Unexpected error in upload: {str(e)}")
+        return jsonify({"success": False, "error": f"Server error: {str(e)}"}), 500
+
+def resumable_status(session):
+    """JSON description of a resumable upload session."""
+    return {
+        "success": True,
+        "upload_id": session.id,
+        "chunk_size": session.chunk_size,
+        "chunk_count": resumable.chunk_count(session),
+        "total_size": session.total_size,
+        "offset": session.total_size if session.completed_at else resumable.get_offset(session),
+        "received_chunks": resumable.received_chunks(session),
+        "completed": session.completed_at is not None,
+        "photo_id": session.photo_id
+    }
+
+@app.route("/upload/resumable", methods=["POST"])
+def resumable_init():
+    """Start a resumable (chunked) upload.
+    
+    Expects JSON with folder_id, filename and size. The folder and QR code
+    checks happen here, so chunks are only accepted for valid folders.
+    """
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        folder = get_upload_folder(data.get("folder_id"))
+        session = resumable.start_session(folder, data.get("filename"), data.get("size"))
+    except UploadRejected as e:
+        logger.warning(f"Resumable upload rejected: {e.message}")
+        return jsonify({"success": False, "error": e.message}), e.status
+    
+    return jsonify(resumable_status(session)), 201
+
+@app.route("/upload/resumable/<upload_id>")
+def resumable_query(upload_id):
+    """Report how much of a resumable upload the server has."""
+    try:
+        session = resumable.get_session(upload_id)
+    except UploadRejected as e:
+        return jsonify({"success": False, "error": e.message}), e.status
+    
+    return jsonify(resumable_status(session))
+
+@app.route("/upload/resumable/<upload_id>/chunks/<int:index>", methods=["PUT"])
+def resumable_chunk(upload_id, index):
+    """Receive chunk `index` of a resumable upload as the raw request body."""
+    try:
+        session = resumable.get_session(upload_id)
+        resumable.write_chunk(session, index, request.stream)
+    except UploadRejected as e:
+        logger.warning(f"Chunk {index} of upload {upload_id} rejected: {e.message}")
+        return jsonify({"success": False, "error": e.message}), e.status
+    
+    return jsonify({"success": True, "index": index, "offset": resumable.get_offset(session)})
+
+@app.route("/upload/resumable/<upload_id>/finalize", methods=["POST"])
+def resumable_finalize(upload_id):
+    """Assemble the chunks of a resumable upload into a photo."""
+    try:
+        session = resumable.get_session(upload_id)
+        folder = db.session.get(PhotoFolder, session.folder_id)
+        offload_queued = not folder.is_local
         
-        # Get file size
-        file_size = 0
-        if hasattr(file, 'content_length') and file.content_length:
-            file_size = file.content_length
-        elif 'local_path' in result and os.path.exists(result['local_path']):
-            file_size = os.path.getsize(result['local_path'])
+        # Only the request that claims the session assembles it; a concurrent
+        # or retried finalize gets the photo created by the first one
+        if session.completed_at is None and resumable.claim_session(session):
+            try:
+                result = resumable.assemble(session)
+            except Exception:
+                resumable.release_session(session)
+                raise
+            try:
+                photo = save_photo(folder, result)
+            except Exception:
+                db.session.rollback()
+                discard_saved_files([result])
+                resumable.release_session(session)
+                raise
+            resumable.complete_session(session, photo)
+        else:
+            # claim_session committed, so this reads the current row
+            if session.completed_at is None:
+                raise UploadRejected("Upload is already being finalized", 409)
+            photo = db.session.get(Photo, session.photo_id) if session.photo_id else None
+            if photo is None:
+                raise UploadRejected("The uploaded photo no longer exists", 410)
+    except UploadRejected as e:
+        logger.warning(f"Finalizing upload {upload_id} failed: {e.message}")
+        return jsonify({"success": False, "error": e.message}), e.status
+    except Exception as e:
+        logger.error(f"Unexpected error finalizing upload {upload_id}: {str(e)}")
+        return jsonify({"success": False, "error": f"Server error: {str(e)}"}), 500
+    
+    return jsonify({
+        "success": True,
+        "message": "File uploaded successfully",
+        "file_url": photo.file_url,
+        "photo_id": photo.id,
+        "offload_queued": offload_queued
+    })
+
+@app.route("/upload/batch", methods=["POST"])
+def upload_batch():
+    """Handle many file uploads in one multipart request.
+    
+    Files are sent as repeated "files" fields after folder_id. The folder is
+    checked once, the files are streamed to disk as they arrive, and all
+    Photo rows are inserted in a single transaction. Files that can't be
+    accepted are skipped and reported per file.
+    """
+    request.max_content_length = app.config["BATCH_MAX_CONTENT_LENGTH"]
+    
+    try:
+        checked = {}
+        rejected = []
+        saved = []
         
-        # Create a photo record
-        photo = Photo(
-            file_name=result["file_name"],
-            original_name=result["original_name"],
-            file_url=result["file_url"],
-            file_size=file_size,
-            mime_type=file.content_type,
-            is_local=is_local,  # Set based on actual storage location
-            user_id=folder.user_id,
-            folder_id=folder.id
-        )
+        def check_folder(fields):
+            checked["folder"] = get_upload_folder(fields.get("folder_id") or request.args.get("folder_id"))
         
-        if "local_path" in result:
-            photo.local_path = result["local_path"]
+        def reject(filename, message):
+            rejected.append({"success": False, "original_name": filename, "error": message})
         
-        if "delete_hash" in result:
-            photo.delete_hash = result["delete_hash"]
+        try:
+            fields, saved = stream_multipart_upload(
+                request,
+                file_field="files",
+                max_files=app.config["BATCH_MAX_FILES"],
+                before_file=check_folder,
+                on_reject=reject
+            )
+            
+            if not saved and not rejected:
+                raise UploadRejected("No files in request")
+            
+            folder = checked.get("folder") or get_upload_folder(fields.get("folder_id") or request.args.get("folder_id"))
+        except UploadRejected as e:
+            discard_saved_files(saved)
+            logger.warning(f"Batch upload rejected: {e.message}")
+            return jsonify({"success": False, "error": e.message}), e.status
         
-        db.session.add(photo)
-        db.session.commit()
+        try:
+            photos = save_photos(folder, saved)
+        except Exception:
+            db.session.rollback()
+            discard_saved_files(saved)
+            raise
         
-        logger.info(f"Photo record created with ID: {photo.id}")
+        results = [
+            {
+                "success": True,
+                "original_name": photo.original_name,
+                "file_url": photo.file_url,
+                "photo_id": photo.id
+            }
+            for photo in photos
+        ] + rejected
         
         return jsonify({
-            "success": True,
-            "message": "File uploaded successfully",
-            "file_url": result["file_url"],
-            "photo_id": photo.id
-        })
+            "success": bool(photos),
+            "message": f"{len(photos)} of {len(results)} file(s) uploaded successfully",
+            "uploaded": len(photos),
+            "failed": len(rejected),
+            "offload_queued": not folder.is_local,
+            "results": results
+        }), 200 if photos else 400
+    except UploadRejected as e:
+        logger.warning(f"Batch upload rejected: {e.message}")
+        return jsonify({"success": False, "error": e.message}), e.status
     except Exception as e:
-        logger.error(f"Unexpected error in upload: {str(e)}")
+        logger.error(f"Unexpected error in batch upload: {str(e)}")
         return jsonify({"success": False, "error": f"Server error: {str(e)}"}), 500
 
 @app.route("/check_auth")
@@ -487,7 +841,7 @@ def check_auth():
 @login_required
 def download_photo(photo_id):
     """Download a photo."""
-    photo = Photo.query.get_or_404(photo_id)
+    photo = Photo.query.options(joinedload(Photo.blob)).get_or_404(photo_id)
     
     # Check permissions
     if photo.user_id != current_user.id and not current_user.is_admin:
@@ -495,21 +849,136 @@ def download_photo(photo_id):
         return redirect(url_for("index"))
     
     if photo.is_local and photo.local_path:
-        # Serve local file
-        return send_file(
+        # Serve local file; stored content is named by its hash, which makes a strong ETag
+        return send_media(
             photo.local_path,
-            as_attachment=True,
-            download_name=photo.original_name
+            mimetype=photo.mime_type,
+            etag=photo.blob.sha256 if photo.blob else None,
+            download_name=photo.download_name
         )
+    elif photo.storage_key:
+        # Private buckets need a presigned link
+        return redirect(get_backend(photo.storage_backend).presign(photo.storage_key))
     else:
         # Redirect to the external URL
         return redirect(photo.file_url)
 
+@app.route("/folder/download/<folder_key>.zip")
+@login_required
+def download_folder(folder_key):
+    """Download every photo in a folder as one ZIP file.
+    
+    The archive is built while it is sent (see zipexport.py), so nothing is
+    written to disk and memory use doesn't grow with the folder. Range
+    requests let an interrupted download resume where it stopped.
+    """
+    folder = PhotoFolder.query.filter_by(folder_key=folder_key).first_or_404()
+    
+    # Check permissions
+    if folder.user_id != current_user.id and not current_user.is_admin:
+        flash("You don't have permission to download this folder.", "danger")
+        return redirect(url_for("folders"))
+    
+    export = FolderZip(folder.id)
+    start, end, status = 0, export.size, 200
+    
+    # A Range only applies to the same archive; If-Range carries the ETag it was taken from
+    if request.range and ("If-Range" not in request.headers or request.if_range.etag == export.etag):
+        byte_range = request.range.range_for_length(export.size)
+        if byte_range is None:
+            response = app.response_class(status=416)
+            response.content_range = ContentRange("bytes", None, None, export.size)
+            return response
+        start, end = byte_range
+        status = 206
+    
+    response = app.response_class(
+        stream_with_context(export.stream(start, end)),
+        status=status,
+        mimetype="application/zip",
+        direct_passthrough=True
+    )
+    response.content_length = end - start
+    if status == 206:
+        response.content_range = ContentRange("bytes", start, end, export.size)
+    response.accept_ranges = "bytes"
+    response.set_etag(export.etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.headers.set(
+        "Content-Disposition", "attachment",
+        filename=f"{secure_filename(folder.folder_name) or 'photos'}.zip"
+    )
+    return response
+
+@app.route("/photo/file/<int:photo_id>/<key>")
+def photo_file(photo_id, key):
+    """Redirect to a short-lived link for a photo kept in private storage.
+    
+    Like thumbnails, the key is the photo's unguessable file name stem.
+    """
+    photo = db.session.get(Photo, photo_id)
+    if photo is None or os.path.splitext(photo.file_name)[0] != key or not photo.storage_key:
+        abort(404)
+    return redirect(get_backend(photo.storage_backend).presign(photo.storage_key))
+
+@app.route("/static/uploads/blobs/<prefix>/<name>")
+def blob_file(prefix, name):
+    """Serve a stored photo file (see blobstore.py).
+    
+    Blobs are named by the SHA-256 of their content, so a URL always means
+    the same bytes: the hash is the ETag and browsers may cache them for good.
+    This route takes precedence over /static for these files.
+    """
+    sha256 = name.split(".", 1)[0]
+    if name != secure_filename(name) or len(sha256) != 64 or prefix != sha256[:2]:
+        abort(404)
+    
+    file_path = os.path.join(app.config["UPLOAD_FOLDER"], "blobs", prefix, name)
+    if not os.path.isfile(file_path):
+        abort(404)
+    return send_media(file_path, etag=sha256, immutable=True)
+
+@app.route("/photo/thumbnail/<int:photo_id>/<key>/<int:width>.<fmt>")
+def photo_thumbnail(photo_id, key, width, fmt):
+    """Serve a photo thumbnail, generating it on first request.
+    
+    The key is the photo's unguessable file name stem, so thumbnails are no
+    easier to find than the original under /static.
+    """
+    if not is_valid_size(width, fmt) or key != secure_filename(key):
+        abort(404)
+    
+    mimetype = f"image/{fmt}"
+    max_age = app.config["THUMBNAIL_MAX_AGE"]
+    
+    # Thumbnails already on disk are served without touching the database
+    file_path = thumbnail_path(key, width, fmt)
+    if os.path.exists(file_path):
+        return send_media(file_path, mimetype=mimetype, max_age=max_age)
+    
+    photo = db.session.get(Photo, photo_id, options=[selectinload(Photo.thumbnails)])
+    if photo is None or os.path.splitext(photo.file_name)[0] != key:
+        abort(404)
+    
+    try:
+        file_path = get_thumbnail_path(photo, width, fmt)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error generating thumbnail for photo {photo.id}: {str(e)}")
+        file_path = None
+    
+    if file_path is None:
+        # No local copy to resize; fall back to the original
+        return redirect(photo.file_url)
+    
+    return send_media(file_path, mimetype=mimetype, max_age=max_age)
+
 @app.route("/photo/delete/<int:photo_id>")
 @login_required
 def delete_photo(photo_id):
     """Delete a photo."""
-    photo = Photo.query.get_or_404(photo_id)
+    photo = Photo.query.options(joinedload(Photo.folder)).get_or_404(photo_id)
     
     # Check permissions
     if photo.user_id != current_user.id and not current_user.is_admin:
@@ -519,17 +988,10 @@ def delete_photo(photo_id):
         return redirect(url_for("index"))
     
     # Get folder for redirecting after deletion
-    folder = photo.folder
+    folder_key = photo.folder.folder_key
     
-    # Delete local file if needed
-    if photo.is_local and photo.local_path and os.path.exists(photo.local_path):
-        try:
-            os.remove(photo.local_path)
-        except Exception as e:
-            logger.error(f"Error deleting file: {str(e)}")
-    
-    # Delete from database
-    db.session.delete(photo)
+    # Files are removed in the background (see deletion.py)
+    deletion.delete_photos(Photo.id == photo.id)
     db.session.commit()
     
     # Return JSON if requested
@@ -540,13 +1002,50 @@ def delete_photo(photo_id):
         })
     
     flash("Photo deleted successfully.", "success")
-    return redirect(url_for("view_folder", folder_key=folder.folder_key))
+    return redirect(url_for("view_folder", folder_key=folder_key))
+
+@app.route("/photos/delete", methods=["POST"])
+@login_required
+def delete_selected_photos():
+    """Delete several photos at once, e.g. those selected in the gallery.
+    
+    Expects JSON {"photo_ids": [...]}. Either every photo is deleted or,
+    if any of them is missing or not the user's, none are.
+    """
+    data = request.get_json(silent=True) or {}
+    photo_ids = data.get("photo_ids")
+    if (not isinstance(photo_ids, list) or not photo_ids
+            or not all(isinstance(photo_id, int) and not isinstance(photo_id, bool) for photo_id in photo_ids)):
+        return jsonify({"success": False, "message": "photo_ids must be a list of photo IDs."}), 400
+    
+    photo_ids = set(photo_ids)
+    if len(photo_ids) > app.config["BULK_DELETE_MAX_PHOTOS"]:
+        return jsonify({
+            "success": False,
+            "message": f"At most {app.config['BULK_DELETE_MAX_PHOTOS']} photos can be deleted at once."
+        }), 400
+    
+    # Check permissions
+    allowed = db.session.query(Photo.id).filter(Photo.id.in_(photo_ids))
+    if not current_user.is_admin:
+        allowed = allowed.filter(Photo.user_id == current_user.id)
+    if {photo_id for (photo_id,) in allowed} != photo_ids:
+        return jsonify({"success": False, "message": "Some of these photos don't exist or you don't have permission to delete them."}), 403
+    
+    deleted = deletion.delete_photos(Photo.id.in_(photo_ids))
+    db.session.commit()
+    
+    return jsonify({
+        "success": True,
+        "deleted": deleted,
+        "message": f"{deleted} photo(s) deleted successfully."
+    })
 
 @app.route("/photo/share/<int:photo_id>")
 @login_required
 def share_photo(photo_id):
     """Generate a shareable link for a photo."""
-    photo = Photo.query.get_or_404(photo_id)
+    photo = Photo.query.options(joinedload(Photo.folder)).get_or_404(photo_id)
     
     # Check permissions
     if photo.user_id != current_user.id and not current_user.is_admin:
@@ -555,8 +1054,9 @@ def share_photo(photo_id):
         flash("You don't have permission to share this photo.", "danger")
         return redirect(url_for("index"))
     
-    # Generate share token (simple token with photo ID and timestamp)
+    # Generate a signed share token; it expires after SHARE_TOKEN_TTL
     share_token = generate_share_token(photo_id)
+    expires_at = datetime.utcfromtimestamp(decode_share_token(share_token).expires_at)
     
     # Create the shareable URL
     share_url = url_for('view_shared_photo', share_token=share_token, _external=True)
@@ -565,31 +1065,79 @@ def share_photo(photo_id):
     if request.headers.get('Accept') == 'application/json':
         return jsonify({
             "success": True,
-            "share_url": share_url
+            "share_url": share_url,
+            "expires_at": expires_at.isoformat() + "Z"
         })
     
     # Otherwise return the share page with the URL
-    return render_template("share_photo.html", photo=photo, share_url=share_url)
+    return render_template("share_photo.html", photo=photo, share_url=share_url,
+                           share_token=share_token, expires_at=expires_at)
 
 @app.route("/shared/<share_token>")
 def view_shared_photo(share_token):
-    """View a shared photo using a share token."""
-    try:
-        # Decode the share token
-        photo_id = decode_share_token(share_token)
-        if not photo_id:
-            flash("Invalid or expired share link.", "danger")
-            return redirect(url_for("index"))
-        
-        # Get the photo
-        photo = Photo.query.get_or_404(photo_id)
-        
-        # Render the shared photo view
-        return render_template("shared_photo.html", photo=photo)
-    except Exception as e:
-        logger.error(f"Error viewing shared photo: {str(e)}")
-        flash("The shared link is invalid or has expired.", "danger")
+    """View a shared photo using a share token.
+    
+    The token is verified without a database lookup. Anonymous visitors get
+    a publicly cacheable page (SHARE_MAX_AGE) that is rendered once per
+    process every SHARE_PAGE_CACHE_TTL seconds; conditional requests are
+    answered with 304.
+    """
+    share = decode_share_token(share_token)
+    if share is None:
+        flash("Invalid or expired share link.", "danger")
+        return redirect(url_for("index"))
+    
+    # The page includes the navigation bar, so only anonymous visitors share a copy
+    anonymous = not current_user.is_authenticated
+    cached = get_shared_page(share) if anonymous else None
+    if cached is not None:
+        html, etag = cached
+    else:
+        photo = Photo.query.get_or_404(share.photo_id)
+        html = render_template("shared_photo.html", photo=photo,
+                               expires_at=datetime.utcfromtimestamp(share.expires_at))
+        etag = remember_shared_page(share, html) if anonymous else None
+    
+    response = app.make_response(html)
+    if etag:
+        response.set_etag(etag)
+    else:
+        response.add_etag()
+    if anonymous:
+        response.cache_control.public = True
+        response.cache_control.max_age = share_max_age(share)
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+@app.route("/shared/<share_token>/revoke", methods=["POST"])
+@login_required
+def revoke_shared_photo(share_token):
+    """Revoke a share link before it expires."""
+    share = decode_share_token(share_token)
+    if share is None:
+        if request.headers.get('Accept') == 'application/json':
+            return jsonify({"success": False, "message": "Invalid or expired share link."}), 400
+        flash("Invalid or expired share link.", "danger")
         return redirect(url_for("index"))
+    
+    photo = Photo.query.options(joinedload(Photo.folder)).get_or_404(share.photo_id)
+    if photo.user_id != current_user.id and not current_user.is_admin:
+        if request.headers.get('Accept') == 'application/json':
+            return jsonify({"success": False, "message": "You don't have permission to revoke this link."}), 403
+        flash("You don't have permission to revoke this link.", "danger")
+        return redirect(url_for("index"))
+    
+    folder_key = photo.folder.folder_key
+    revoke_share_token(share)
+    db.session.commit()
+    
+    if request.headers.get('Accept') == 'application/json':
+        return jsonify({"success": True, "message": "Share link revoked."})
+    flash("Share link revoked.", "success")
+    return redirect(url_for("view_folder", folder_key=folder_key))
 
 @app.route("/folder/deactivate_qr/<int:folder_id>")
 @login_required
@@ -630,18 +1178,11 @@ def delete_folder(folder_id):
         flash("You don't have permission to delete this folder.", "danger")
         return redirect(url_for("folders"))
     
-    # Delete all photos in the folder
-    for photo in folder.photos:
-        # Delete local file if needed
-        if photo.is_local and photo.local_path and os.path.exists(photo.local_path):
-            try:
-                os.remove(photo.local_path)
-            except Exception as e:
-                logger.error(f"Error deleting file: {str(e)}")
-    
-    # Delete the folder (cascade will delete photos)
-    db.session.delete(folder)
+    # One DELETE per table; files are removed in the background (see deletion.py)
+    folder_key = folder.folder_key
+    deletion.delete_folder(folder)
     db.session.commit()
+    invalidate_folder_snapshot(folder_key)
     
     # Return JSON if requested
     if request.headers.get('Accept') == 'application/json':
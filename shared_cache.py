@@ -0,0 +1,109 @@
+import time
+import socket
+import logging
+import threading
+from urllib.parse import urlparse, unquote
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class SharedCacheError(Exception):
+    """Raised when the shared cache server can't be reached or answers with an error."""
+
+class RedisCache:
+    """Minimal client for a Redis-compatible server (Redis, Valkey, KeyDB, ...).
+
+    Only what the caches in this app need: GET, SET with an expiry, and DEL,
+    spoken over RESP with one connection per thread. After a connection
+    failure the server is skipped for `retry_after` seconds, so an outage
+    costs one timeout rather than one per request.
+    """
+
+    def __init__(self, url, timeout=0.5, retry_after=10):
+        parsed = urlparse(url)
+        if parsed.scheme != 'redis':
+            raise ValueError(f"Unsupported cache URL: {url}")
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._local = threading.local()
+        self._down_until = 0
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        if self.password:
+            self._send('AUTH', self.password)
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            try:
+                self._local.reader.close()
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._local.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise OSError("Connection closed by cache server")
+        kind, value = line[:1], line[1:-2]
+        if kind == b'+':
+            return value
+        if kind == b'-':
+            raise SharedCacheError(value.decode(errors='replace'))
+        if kind == b':':
+            return int(value)
+        if kind == b'$':
+            length = int(value)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(value)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise OSError(f"Unexpected reply from cache server: {line[:20]!r}")
+
+    def command(self, *args):
+        """Run one command and return its reply.
+
+        Raises:
+            SharedCacheError: The server is unreachable or returned an error
+        """
+        if time.monotonic() < self._down_until:
+            raise SharedCacheError("Cache server unavailable")
+        try:
+            if getattr(self._local, 'sock', None) is None:
+                self._connect()
+            return self._send(*args)
+        except OSError as e:
+            self._close()
+            self._down_until = time.monotonic() + self.retry_after
+            logger.warning(f"Cache server {self.host}:{self.port} unavailable: {str(e)}")
+            raise SharedCacheError(str(e))
+
+    def get(self, key):
+        return self.command('GET', key)
+
+    def set(self, key, value, ttl):
+        self.command('SET', key, value, 'EX', int(ttl))
+
+    def delete(self, *keys):
+        return self.command('DEL', *keys)
@@ -0,0 +1,158 @@
+import hmac
+import time
+import base64
+import struct
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from collections import namedtuple, OrderedDict
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import RevokedShare
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Token payload: photo id and expiry (Unix seconds), followed by the truncated signature
+PAYLOAD_FORMAT = '>II'
+PAYLOAD_SIZE = struct.calcsize(PAYLOAD_FORMAT)
+SIGNATURE_SIZE = 12
+
+ShareToken = namedtuple('ShareToken', ['photo_id', 'expires_at', 'digest'])
+
+# Digests of revoked tokens, reloaded from the database every SHARE_DENYLIST_REFRESH seconds
+_denylist = set()
+_denylist_expires = 0
+_denylist_lock = threading.Lock()
+
+# Per-process LRU of rendered share pages for anonymous visitors: digest -> (expires_at, html, etag)
+_pages = OrderedDict()
+_pages_lock = threading.Lock()
+
+def _signing_key():
+    # Derived rather than used directly, so a share signature can't stand in for any other
+    secret = app.secret_key.encode() if isinstance(app.secret_key, str) else app.secret_key
+    return hmac.new(secret, b'share-token', hashlib.sha256).digest()
+
+def _sign(payload):
+    return hmac.new(_signing_key(), payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+def generate_share_token(photo_id, ttl=None):
+    """Generate a signed token for sharing a photo.
+
+    The token carries the photo id and its expiry, signed with the app's
+    secret key, so it can be checked without a database lookup. It is 27
+    URL-safe characters.
+
+    Args:
+        photo_id: The photo to share
+        ttl: Seconds the link stays valid; SHARE_TOKEN_TTL by default
+
+    Returns:
+        str: The token
+    """
+    expires_at = int(time.time()) + (ttl or app.config['SHARE_TOKEN_TTL'])
+    payload = struct.pack(PAYLOAD_FORMAT, photo_id, expires_at)
+    return base64.urlsafe_b64encode(payload + _sign(payload)).rstrip(b'=').decode()
+
+def decode_share_token(token):
+    """Verify a share token.
+
+    Returns:
+        ShareToken or None: None if the token is malformed, forged, expired
+        or revoked
+    """
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    if len(data) != PAYLOAD_SIZE + SIGNATURE_SIZE:
+        return None
+
+    payload, signature = data[:PAYLOAD_SIZE], data[PAYLOAD_SIZE:]
+    if not hmac.compare_digest(signature, _sign(payload)):
+        logger.debug("Share token with a bad signature")
+        return None
+
+    photo_id, expires_at = struct.unpack(PAYLOAD_FORMAT, payload)
+    if time.time() > expires_at:
+        logger.debug(f"Share token for photo {photo_id} expired")
+        return None
+
+    digest = signature.hex()
+    if digest in _revoked_digests():
+        logger.debug(f"Share token for photo {photo_id} was revoked")
+        return None
+    return ShareToken(photo_id, expires_at, digest)
+
+def _revoked_digests():
+    """Return the current denylist, reloading it when it is older than SHARE_DENYLIST_REFRESH."""
+    global _denylist, _denylist_expires
+    with _denylist_lock:
+        if time.monotonic() < _denylist_expires:
+            return _denylist
+        _denylist = {
+            digest for (digest,) in db.session.query(RevokedShare.token_digest).filter(
+                RevokedShare.expires_at > datetime.utcnow()
+            )
+        }
+        _denylist_expires = time.monotonic() + app.config['SHARE_DENYLIST_REFRESH']
+        return _denylist
+
+def revoke_share_token(share):
+    """Stop a share link from working before it expires.
+
+    Takes effect at once in this process and within SHARE_DENYLIST_REFRESH
+    seconds in the others; browsers and proxies may keep showing a copy of
+    the page for up to SHARE_MAX_AGE. Rows of tokens that have expired
+    since are pruned. The caller commits.
+
+    Args:
+        share: A ShareToken from decode_share_token
+    """
+    RevokedShare.query.filter(RevokedShare.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+    try:
+        with db.session.begin_nested():
+            db.session.add(RevokedShare(
+                token_digest=share.digest,
+                photo_id=share.photo_id,
+                expires_at=datetime.utcfromtimestamp(share.expires_at)
+            ))
+    except IntegrityError:
+        pass  # Revoked already
+
+    with _denylist_lock:
+        _denylist.add(share.digest)
+    with _pages_lock:
+        _pages.pop(share.digest, None)
+    logger.info(f"Revoked a share link for photo {share.photo_id}")
+
+def share_max_age(share):
+    """Seconds a share page may be cached: SHARE_MAX_AGE, but never past the token's expiry."""
+    return max(0, min(app.config['SHARE_MAX_AGE'], share.expires_at - int(time.time())))
+
+def get_shared_page(share):
+    """Return the cached (html, etag) of a share page, or None."""
+    with _pages_lock:
+        cached = _pages.get(share.digest)
+        if cached is None or time.monotonic() >= cached[0]:
+            return None
+        _pages.move_to_end(share.digest)
+        return cached[1], cached[2]
+
+def remember_shared_page(share, html):
+    """Cache a rendered share page for SHARE_PAGE_CACHE_TTL seconds.
+
+    Returns:
+        str: The page's ETag
+    """
+    etag = hashlib.sha256(html.encode()).hexdigest()[:32]
+    with _pages_lock:
+        _pages[share.digest] = (time.monotonic() + app.config['SHARE_PAGE_CACHE_TTL'], html, etag)
+        _pages.move_to_end(share.digest)
+        while len(_pages) > app.config['SHARE_PAGE_CACHE_SIZE']:
+            _pages.popitem(last=False)
+    return etag
@@ -110,8 +110,9 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Create FormData
         const formData = new FormData();
-        formData.append('file', file);
+        // The folder goes first so the server can reject it before reading the file
         formData.append('folder_id', folderIdValue);
+        formData.append('file', file);
         
         // Create and send request
         const xhr = new XMLHttpRequest();
@@ -213,13 +214,70 @@ document.addEventListener('DOMContentLoaded', function() {
     // Setup delete handlers
     setupPhotoDeleteHandlers();
     setupFolderDeleteHandlers();
+    setupBulkDelete();
+
+    // Load further gallery pages as the user scrolls
+    setupInfiniteScroll();
 });
 
+/**
+ * Load the next page of photos when the loader element scrolls into view
+ */
+function setupInfiniteScroll() {
+    const loader = document.getElementById('photo-page-loader');
+    const container = document.getElementById('photo-container');
+    if (!loader || !container || !('IntersectionObserver' in window)) return;
+
+    let loading = false;
+
+    const observer = new IntersectionObserver(entries => {
+        if (!entries.some(entry => entry.isIntersecting) || loading) return;
+
+        const nextUrl = loader.dataset.nextUrl;
+        if (!nextUrl) return;
+
+        loading = true;
+        fetch(nextUrl, {
+            headers: {
+                'Accept': 'application/json',
+            }
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.message || 'Error loading photos.');
+            }
+
+            // Bind delete handlers on the new cards only, then add them to the gallery
+            const page = document.createElement('div');
+            page.innerHTML = data.html;
+            setupPhotoDeleteHandlers(page);
+            container.append(...page.children);
+
+            if (data.next_url) {
+                loader.dataset.nextUrl = data.next_url;
+            } else {
+                observer.disconnect();
+                loader.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            showToast('Error loading more photos.', 'danger');
+        })
+        .finally(() => {
+            loading = false;
+        });
+    }, { rootMargin: '600px' });
+
+    observer.observe(loader);
+}
+
 /**
  * Set up event handlers for photo delete buttons
  */
-function setupPhotoDeleteHandlers() {
-    document.querySelectorAll('.delete-photo-btn').forEach(btn => {
+function setupPhotoDeleteHandlers(root = document) {
+    root.querySelectorAll('.delete-photo-btn').forEach(btn => {
         btn.addEventListener('click', function(e) {
             e.preventDefault();
             const photoId = this.dataset.photoId;
@@ -232,6 +290,61 @@ function setupPhotoDeleteHandlers() {
     });
 }
 
+/**
+ * Delete the photos ticked in the gallery with one request
+ */
+function setupBulkDelete() {
+    const button = document.getElementById('delete-selected-btn');
+    const container = document.getElementById('photo-container');
+    if (!button || !container) return;
+
+    const counter = document.getElementById('selected-count');
+    const selected = () => Array.from(container.querySelectorAll('.photo-select:checked'));
+
+    function updateButton() {
+        const count = selected().length;
+        counter.textContent = count;
+        button.classList.toggle('d-none', count === 0);
+    }
+
+    // Listening on the container also covers cards added by infinite scroll
+    container.addEventListener('change', function(e) {
+        if (e.target.classList.contains('photo-select')) {
+            updateButton();
+        }
+    });
+
+    button.addEventListener('click', function() {
+        const boxes = selected();
+        if (!boxes.length || !confirm(`Are you sure you want to delete ${boxes.length} photo(s)? This action cannot be undone.`)) {
+            return;
+        }
+
+        fetch('/photos/delete', {
+            method: 'POST',
+            headers: {
+                'Accept': 'application/json',
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({photo_ids: boxes.map(box => parseInt(box.value, 10))})
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                boxes.forEach(box => box.closest('.photo-item').remove());
+                updateButton();
+                showToast(data.message, 'success');
+            } else {
+                showToast(data.message || 'Error deleting photos.', 'danger');
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            showToast('Error deleting photos.', 'danger');
+        });
+    });
+}
+
 /**
  * Set up event handlers for folder delete buttons
  */
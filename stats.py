@@ -0,0 +1,79 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import app, db
+from models import User, PhotoFolder, Photo
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cached dashboard summary: (expires_at, summary)
+_summary_cache = (0, None)
+_summary_lock = threading.Lock()
+
+def _date_key(value):
+    """Normalize a SQL date() result (str on SQLite, date on PostgreSQL)."""
+    return value if isinstance(value, str) else value.isoformat()
+
+def compute_dashboard_summary():
+    """Compute the admin dashboard totals with SQL aggregates.
+
+    Returns:
+        dict: User/folder/photo counts, active folders, total bytes stored and uploads per day
+    """
+    days = app.config['ADMIN_STATS_DAYS']
+    since = (datetime.utcnow() - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    photo_count, total_bytes = db.session.query(
+        func.count(Photo.id), func.coalesce(func.sum(Photo.file_size), 0)
+    ).one()
+
+    day = func.date(Photo.uploaded_at)
+    per_day = dict(
+        (_date_key(date), count)
+        for date, count in db.session.query(day, func.count(Photo.id))
+        .filter(Photo.uploaded_at >= since)
+        .group_by(day)
+    )
+
+    uploads_per_day = []
+    for offset in range(days):
+        date = (since + timedelta(days=offset)).date().isoformat()
+        uploads_per_day.append({'date': date, 'count': per_day.get(date, 0)})
+
+    return {
+        'user_count': db.session.query(func.count(User.id)).scalar(),
+        'folder_count': db.session.query(func.count(PhotoFolder.id)).scalar(),
+        'active_folder_count': db.session.query(func.count(PhotoFolder.id)).filter_by(qr_code_active=True).scalar(),
+        'photo_count': photo_count,
+        'total_bytes': int(total_bytes),
+        'uploads_per_day': uploads_per_day,
+        'computed_at': datetime.utcnow()
+    }
+
+def get_dashboard_summary():
+    """Return the dashboard summary, recomputed at most every ADMIN_STATS_TTL seconds."""
+    global _summary_cache
+
+    expires_at, summary = _summary_cache
+    if summary is not None and time.monotonic() < expires_at:
+        return summary
+
+    with _summary_lock:
+        # Another thread may have refreshed it while we waited
+        expires_at, summary = _summary_cache
+        if summary is not None and time.monotonic() < expires_at:
+            return summary
+
+        summary = compute_dashboard_summary()
+        _summary_cache = (time.monotonic() + app.config['ADMIN_STATS_TTL'], summary)
+        return summary
+
+def invalidate_dashboard_summary():
+    """Drop the cached summary so the next request recomputes it."""
+    global _summary_cache
+    _summary_cache = (0, None)
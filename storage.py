@@ -0,0 +1,431 @@
+import os
+import hmac
+import shutil
+import hashlib
+import logging
+from datetime import datetime
+from urllib.parse import quote, urlparse
+
+import requests
+
+from app import app
+from utils import send_to_catbox
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class StorageError(Exception):
+    """Raised when a storage backend can't complete an operation."""
+
+class StorageBackend:
+    """Where photo files are kept.
+
+    Objects are addressed by a key (a relative path such as "photos/x.jpg").
+    Each backend stores them somewhere different; callers only deal in keys.
+    """
+
+    name = None
+    public = True  # Whether url() can be handed out without signing
+
+    def put(self, key, file_path, mime_type=None):
+        """Store a local file under `key`.
+
+        Returns:
+            dict: The stored object's 'key' (which the backend may change)
+                and 'url'
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the content of an object as bytes."""
+        return b''.join(self.stream(key))
+
+    def stream(self, key, chunk_size=None):
+        """Yield the content of an object in chunks."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Delete an object. Returns True if it is gone."""
+        raise NotImplementedError
+
+    def stat(self, key):
+        """Return the object's 'size', 'mime_type', 'etag' and 'modified_at', or None if missing."""
+        raise NotImplementedError
+
+    def url(self, key):
+        """Return the URL an object is served at."""
+        raise NotImplementedError
+
+    def presign(self, key, expires_in=None):
+        """Return a URL that grants temporary read access to an object.
+
+        Backends whose objects are public return the plain URL.
+        """
+        return self.url(key)
+
+class LocalStorage(StorageBackend):
+    """Files on the app server's disk, served from /static."""
+
+    name = 'local'
+
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    def path(self, key):
+        """Return the file path of a key, refusing keys that leave the root."""
+        path = os.path.normpath(os.path.join(self.root, key))
+        if os.path.commonpath([path, os.path.normpath(self.root)]) != os.path.normpath(self.root):
+            raise StorageError(f"Invalid key: {key}")
+        return path
+
+    def put(self, key, file_path, mime_type=None):
+        destination = self.path(key)
+        if os.path.abspath(file_path) != destination:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copyfile(file_path, destination)
+        return {'key': key, 'url': self.url(key)}
+
+    def stream(self, key, chunk_size=None):
+        chunk_size = chunk_size or app.config['UPLOAD_CHUNK_SIZE']
+        try:
+            with open(self.path(key), 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    yield chunk
+        except FileNotFoundError:
+            raise StorageError(f"Object not found: {key}")
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def stat(self, key):
+        try:
+            info = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        return {
+            'size': info.st_size,
+            'mime_type': None,
+            'etag': f"{int(info.st_mtime)}-{info.st_size}",
+            'modified_at': datetime.utcfromtimestamp(info.st_mtime)
+        }
+
+    def url(self, key):
+        return f"{self.base_url}/{key.replace(os.sep, '/')}"
+
+class CatboxStorage(StorageBackend):
+    """Anonymous uploads to catbox.moe.
+
+    catbox.moe names files itself, so put returns a different key. Anonymous
+    files can't be deleted; delete only logs them.
+    """
+
+    name = 'catbox'
+
+    def __init__(self, files_url):
+        self.files_url = files_url.rstrip('/')
+
+    def put(self, key, file_path, mime_type=None):
+        result = send_to_catbox(file_path, os.path.basename(key), mime_type)
+        if not result['success']:
+            raise StorageError(result.get('error', 'Unknown error'))
+        return {'key': result['file_name'], 'url': result['file_url']}
+
+    def stream(self, key, chunk_size=None):
+        chunk_size = chunk_size or app.config['UPLOAD_CHUNK_SIZE']
+        try:
+            response = requests.get(self.url(key), stream=True, timeout=app.config['CATBOX_TIMEOUT'])
+        except requests.RequestException as e:
+            raise StorageError(str(e))
+        with response:
+            if response.status_code != 200:
+                raise StorageError(f"catbox.moe returned {response.status_code} for {key}")
+            yield from response.iter_content(chunk_size)
+
+    def delete(self, key):
+        logger.info(f"catbox.moe file {key} is anonymous and can't be deleted")
+        return False
+
+    def stat(self, key):
+        try:
+            response = requests.head(self.url(key), timeout=app.config['CATBOX_TIMEOUT'])
+        except requests.RequestException as e:
+            raise StorageError(str(e))
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise StorageError(f"catbox.moe returned {response.status_code} for {key}")
+        return _stat_from_headers(response.headers)
+
+    def url(self, key):
+        return f"{self.files_url}/{key}"
+
+class S3Storage(StorageBackend):
+    """An S3-compatible bucket (AWS S3, MinIO, R2, ...).
+
+    Requests are signed with AWS Signature Version 4 and sent with
+    `requests`, using path-style URLs ({endpoint}/{bucket}/{key}) which every
+    S3-compatible server accepts.
+    """
+
+    name = 's3'
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region='us-east-1', public_url=None, timeout=30):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.timeout = timeout
+        self.host = urlparse(self.endpoint_url).netloc
+        self.public = self.public_url is not None
+
+    def _path(self, key):
+        return f"/{self.bucket}/{quote(key, safe='/~')}"
+
+    def _signing_key(self, date):
+        key = _hmac(f"AWS4{self.secret_key}".encode(), date)
+        for part in (self.region, 's3', 'aws4_request'):
+            key = _hmac(key, part)
+        return key
+
+    def _signature(self, method, path, query, headers, payload_hash, now):
+        """Return (credential scope, signed header names, signature) for a request."""
+        date = now.strftime('%Y%m%d')
+        scope = f"{date}/{self.region}/s3/aws4_request"
+
+        names = sorted(name.lower() for name in headers)
+        lowered = {name.lower(): str(value).strip() for name, value in headers.items()}
+        canonical_headers = ''.join(f"{name}:{lowered[name]}\n" for name in names)
+        signed_headers = ';'.join(names)
+        canonical_query = '&'.join(
+            f"{quote(name, safe='~')}={quote(str(value), safe='~')}" for name, value in sorted(query.items())
+        )
+        canonical_request = '\n'.join([method, path, canonical_query, canonical_headers, signed_headers, payload_hash])
+
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256',
+            now.strftime('%Y%m%dT%H%M%SZ'),
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+        signature = hmac.new(self._signing_key(date), string_to_sign.encode(), hashlib.sha256).hexdigest()
+        return scope, signed_headers, signature
+
+    def _request(self, method, key, headers=None, **kwargs):
+        now = datetime.utcnow()
+        path = self._path(key)
+        headers = dict(headers or {})
+        headers.update({
+            'Host': self.host,
+            'x-amz-date': now.strftime('%Y%m%dT%H%M%SZ'),
+            'x-amz-content-sha256': 'UNSIGNED-PAYLOAD'
+        })
+        scope, signed_headers, signature = self._signature(method, path, {}, headers, 'UNSIGNED-PAYLOAD', now)
+        headers['Authorization'] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        try:
+            return requests.request(method, f"{self.endpoint_url}{path}", headers=headers, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise StorageError(str(e))
+
+    def put(self, key, file_path, mime_type=None):
+        headers = {'Content-Length': str(os.path.getsize(file_path))}
+        if mime_type:
+            headers['Content-Type'] = mime_type
+        with open(file_path, 'rb') as f:
+            response = self._request('PUT', key, headers=headers, data=f)
+        if response.status_code != 200:
+            raise StorageError(f"S3 PUT {key} returned {response.status_code}: {response.text[:200]}")
+        return {'key': key, 'url': self.url(key)}
+
+    def stream(self, key, chunk_size=None):
+        chunk_size = chunk_size or app.config['UPLOAD_CHUNK_SIZE']
+        response = self._request('GET', key, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise StorageError(f"S3 GET {key} returned {response.status_code}")
+            yield from response.iter_content(chunk_size)
+
+    def delete(self, key):
+        response = self._request('DELETE', key)
+        if response.status_code not in (200, 204, 404):
+            raise StorageError(f"S3 DELETE {key} returned {response.status_code}")
+        return True
+
+    def stat(self, key):
+        response = self._request('HEAD', key)
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise StorageError(f"S3 HEAD {key} returned {response.status_code}")
+        return _stat_from_headers(response.headers)
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url}/{quote(key, safe='/~')}"
+        return f"{self.endpoint_url}{self._path(key)}"
+
+    def presign(self, key, expires_in=None):
+        if self.public_url:
+            return self.url(key)
+
+        now = datetime.utcnow()
+        path = self._path(key)
+        query = {
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f"{self.access_key}/{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request",
+            'X-Amz-Date': now.strftime('%Y%m%dT%H%M%SZ'),
+            'X-Amz-Expires': str(expires_in or app.config['S3_PRESIGN_SECONDS']),
+            'X-Amz-SignedHeaders': 'host'
+        }
+        _, _, signature = self._signature('GET', path, query, {'host': self.host}, 'UNSIGNED-PAYLOAD', now)
+        query['X-Amz-Signature'] = signature
+        query_string = '&'.join(f"{name}={quote(value, safe='~')}" for name, value in sorted(query.items()))
+        return f"{self.endpoint_url}{path}?{query_string}"
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+def _stat_from_headers(headers):
+    """Build a stat result from HTTP response headers."""
+    modified = headers.get('Last-Modified')
+    return {
+        'size': int(headers.get('Content-Length', 0)),
+        'mime_type': headers.get('Content-Type'),
+        'etag': headers.get('ETag', '').strip('"') or None,
+        'modified_at': datetime.strptime(modified, '%a, %d %b %Y %H:%M:%S GMT') if modified else None
+    }
+
+# Backends built so far, by name
+_backends = {}
+
+def get_backend(name):
+    """Return the storage backend with this name, building it on first use.
+
+    Raises:
+        StorageError: Unknown or unconfigured backend
+    """
+    backend = _backends.get(name)
+    if backend is not None:
+        return backend
+
+    if name == 'local':
+        backend = LocalStorage(app.config['UPLOAD_FOLDER'], '/static/uploads')
+    elif name == 'catbox':
+        backend = CatboxStorage(app.config['CATBOX_FILES_URL'])
+    elif name == 's3':
+        if not app.config['S3_BUCKET']:
+            raise StorageError("S3 storage is not configured")
+        backend = S3Storage(
+            app.config['S3_ENDPOINT_URL'],
+            app.config['S3_BUCKET'],
+            app.config['S3_ACCESS_KEY'],
+            app.config['S3_SECRET_KEY'],
+            region=app.config['S3_REGION'],
+            public_url=app.config['S3_PUBLIC_URL'],
+            timeout=app.config['S3_TIMEOUT']
+        )
+    else:
+        raise StorageError(f"Unknown storage backend: {name}")
+
+    _backends[name] = backend
+    return backend
+
+@app.template_global()
+def available_backends():
+    """Names of the backends folders can be created with."""
+    names = ['local', 'catbox']
+    if app.config['S3_BUCKET']:
+        names.append('s3')
+    return names
+
+def folder_backend_name(folder):
+    """Name of the backend a folder's photos are kept in.
+
+    Folders created before storage backends existed only have is_local.
+    """
+    return folder.storage_backend or ('local' if folder.is_local else 'catbox')
+
+def remote_object_key(photo):
+    """Key a photo is stored under in a remote backend."""
+    return f"photos/{photo.file_name}"
+
+def _skip(chunks, offset):
+    """Drop the first `offset` bytes of a chunk iterator."""
+    for chunk in chunks:
+        if offset >= len(chunk):
+            offset -= len(chunk)
+            continue
+        yield chunk[offset:] if offset else chunk
+        offset = 0
+
+def stream_photo(photo, offset=0, chunk_size=None):
+    """Yield a photo's content in chunks, from wherever it is kept.
+
+    The local copy is read if there is one, then the remote copy in the
+    photo's backend, then (for photos offloaded before storage backends
+    existed) its catbox.moe URL. Nothing is buffered beyond one chunk.
+
+    Args:
+        photo: Any object with the Photo file columns
+        offset: Byte to start at; local files seek, remote ones skip ahead
+
+    Raises:
+        StorageError: No copy of the photo can be read
+    """
+    chunk_size = chunk_size or app.config['UPLOAD_CHUNK_SIZE']
+
+    if photo.local_path and os.path.exists(photo.local_path):
+        with open(photo.local_path, 'rb') as f:
+            f.seek(offset)
+            yield from iter(lambda: f.read(chunk_size), b'')
+        return
+
+    if photo.storage_backend and photo.storage_key:
+        chunks = get_backend(photo.storage_backend).stream(photo.storage_key, chunk_size)
+    elif photo.file_url and urlparse(photo.file_url).scheme in ('http', 'https'):
+        chunks = _stream_url(photo.file_url, chunk_size)
+    else:
+        raise StorageError(f"No readable copy of photo {photo.id}")
+    yield from _skip(chunks, offset)
+
+def _stream_url(url, chunk_size):
+    try:
+        response = requests.get(url, stream=True, timeout=app.config['CATBOX_TIMEOUT'])
+    except requests.RequestException as e:
+        raise StorageError(str(e))
+    with response:
+        if response.status_code != 200:
+            raise StorageError(f"{url} returned {response.status_code}")
+        yield from response.iter_content(chunk_size)
+
+def photo_size(photo):
+    """Return the size of a photo's content, asking its storage if the row doesn't know.
+
+    Returns:
+        int or None: The size, or None if no copy can be found
+    """
+    if photo.file_size:
+        return photo.file_size
+    if photo.local_path and os.path.exists(photo.local_path):
+        return os.path.getsize(photo.local_path)
+    try:
+        if photo.storage_backend and photo.storage_key:
+            info = get_backend(photo.storage_backend).stat(photo.storage_key)
+            return info['size'] if info else None
+        if photo.file_url and urlparse(photo.file_url).scheme in ('http', 'https'):
+            response = requests.head(photo.file_url, allow_redirects=True, timeout=app.config['CATBOX_TIMEOUT'])
+            if response.status_code == 200 and response.headers.get('Content-Length'):
+                return int(response.headers['Content-Length'])
+    except (StorageError, requests.RequestException) as e:
+        logger.warning(f"Could not get the size of photo {photo.id}: {str(e)}")
+    return None
+
@@ -0,0 +1,137 @@
+import io
+import os
+import sys
+import uuid
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# The app reads its settings and picks its upload directories when it is
+# imported, so point it at a scratch directory and database first
+WORK_DIR = tempfile.mkdtemp(prefix="photobooth-tests-")
+os.chdir(WORK_DIR)
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORK_DIR, 'test.db')}",
+    "OFFLOAD_WORKERS": "0",
+    "IMAGE_WORKERS": "0",
+    "FILE_REMOVAL_INTERVAL": "0",
+    "FOLDER_EXPIRY_INTERVAL": "0",
+    "LOG_FORMAT": "text",
+    "LOG_LEVEL": "WARNING",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from app import app as flask_app, db  # noqa: E402
+from models import User, PhotoFolder, Photo  # noqa: E402
+import querystats  # noqa: E402
+
+@pytest.fixture
+def app():
+    """The app with empty tables, inside an app context."""
+    flask_app.config["TESTING"] = True
+    # The recorder thread would write thumbnails while the next test drops the tables
+    flask_app.config["THUMBNAIL_ON_UPLOAD"] = False
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def user(app):
+    user = User(email=f"{uuid.uuid4().hex[:8]}@example.com", name="Test User")
+    user.set_password("password")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def folder(user):
+    return make_folder(user)
+
+@pytest.fixture
+def logged_in(client, user):
+    """The test client, logged in as `user`."""
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user.id)
+        session["_fresh"] = True
+    return client
+
+@pytest.fixture
+def query_count(app):
+    """Return a response's X-DB-Query-Count, failing if it is over its endpoint's budget."""
+    def query_count(response):
+        count = int(response.headers["X-DB-Query-Count"])
+        endpoint, _ = app.url_map.bind("localhost").match(response.request.path, method=response.request.method)
+        budget = querystats.query_budget(endpoint)
+        assert count <= budget, f"{endpoint} ran {count} queries, over its budget of {budget}"
+        return count
+    return query_count
+
+@pytest.fixture
+def http_server():
+    """Start local HTTP servers standing in for remote services.
+
+    Call it with a BaseHTTPRequestHandler subclass; it returns the server's
+    base URL. The servers are shut down after the test.
+    """
+    servers = []
+    def start(handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def make_folder(user, **fields):
+    folder = PhotoFolder(
+        folder_name=fields.pop("folder_name", "Test Folder"),
+        folder_key=uuid.uuid4().hex,
+        user_id=user.id,
+        **fields
+    )
+    db.session.add(folder)
+    db.session.commit()
+    return folder
+
+def make_photos(folder, count):
+    """Insert `count` photo rows into a folder, without files."""
+    photos = [
+        Photo(
+            file_name=f"{uuid.uuid4().hex}.jpg",
+            original_name=f"photo-{index}.jpg",
+            file_url=f"/static/uploads/{index}.jpg",
+            file_size=1000 + index,
+            user_id=folder.user_id,
+            folder_id=folder.id
+        )
+        for index in range(count)
+    ]
+    db.session.add_all(photos)
+    db.session.commit()
+    return photos
+
+def make_jpeg(seed=0, size=(64, 48)):
+    """JPEG bytes whose content depends on `seed`."""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (seed * 37 % 256, seed * 91 % 256, seed * 53 % 256)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def upload(client, folder, data, filename="photo.jpg"):
+    """POST one file to /upload, sending folder_id first like the forms do."""
+    return client.post("/upload", data={
+        "folder_id": folder.folder_key,
+        "file": (io.BytesIO(data), filename),
+    }, content_type="multipart/form-data")
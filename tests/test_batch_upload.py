@@ -0,0 +1,37 @@
+import io
+
+from PIL import Image
+
+from app import db
+from models import Photo
+
+from conftest import make_jpeg
+
+def batch(client, folder, files):
+    return client.post("/upload/batch", data={
+        "folder_id": folder.folder_key,
+        "files": [(io.BytesIO(data), name) for name, data in files],
+    }, content_type="multipart/form-data")
+
+def test_batch_files_are_normalized(client, folder, app):
+    # Taller than NORMALIZE_MAX_EDGE, so each one has to be shrunk
+    size = (100, app.config["NORMALIZE_MAX_EDGE"] + 10)
+    response = batch(client, folder, [(f"{index}.jpg", make_jpeg(index, size)) for index in range(3)])
+
+    body = response.get_json()
+    assert body["uploaded"] == 3
+    for result in body["results"]:
+        photo = db.session.get(Photo, result["photo_id"])
+        with Image.open(photo.local_path) as img:
+            assert img.height == app.config["NORMALIZE_MAX_EDGE"]
+
+def test_batch_rejects_files_but_keeps_the_rest(client, folder):
+    response = batch(client, folder, [("good.jpg", make_jpeg(1)), ("bad.jpg", b"not an image")])
+
+    body = response.get_json()
+    assert body["uploaded"] == 1 and body["failed"] == 1
+
+def test_scan_page_uses_configured_batch_size(client, folder, app, monkeypatch):
+    monkeypatch.setitem(app.config, "BATCH_MAX_FILES", 7)
+    page = client.get(f"/scan/{folder.folder_key}").get_data(as_text=True)
+    assert "const BATCH_MAX_FILES = 7;" in page
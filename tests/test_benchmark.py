@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from benchmark import percentile, compare
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark.py")
+
+def result(endpoint="scan", p95=10.0, rps=100.0, queries=1.0, errors=0):
+    return {
+        "endpoint": endpoint, "concurrency": 1, "errors": errors, "throughput_rps": rps,
+        "latency_ms": {"p95": p95}, "queries": {"mean": queries},
+    }
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = tmp_path / "baseline.json"
+    path.write_text(json.dumps({"meta": {}, "results": [result()]}))
+    return str(path)
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 1) == 100
+    assert percentile([7], 0.99) == 7
+    assert percentile([], 0.5) is None
+
+@pytest.mark.parametrize("changed, passes", [
+    (result(p95=11.9, rps=81.0, queries=1.4), True),
+    (result(p95=12.1), False),
+    (result(rps=79.0), False),
+    (result(queries=1.5), False),
+    (result(errors=1), False),
+    # Nothing to compare with
+    (result(endpoint="upload", p95=1000.0), True),
+])
+def test_compare_flags_regressions(baseline, changed, passes):
+    assert compare([changed], baseline, 0.2) is passes
+
+def test_benchmark_runs_end_to_end(tmp_path):
+    # A separate process: the benchmark sets up the app's environment before importing it
+    env = {name: value for name, value in os.environ.items() if name not in ("DATABASE_URL", "IMAGE_WORKERS")}
+    command = [
+        sys.executable, BENCHMARK, "--requests", "3", "--concurrency", "1,2", "--warmup", "1",
+        "--users", "1", "--folders", "1", "--photos", "3", "--image-size", "64x48", "--image-workers", "0",
+    ]
+    output = tmp_path / "results.json"
+    run = subprocess.run(command + ["--output", str(output)], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert run.returncode == 0, run.stderr
+
+    results = json.loads(output.read_text())["results"]
+    assert {(entry["endpoint"], entry["concurrency"]) for entry in results} == {
+        (endpoint, level) for endpoint in ("scan", "upload", "gallery", "admin") for level in (1, 2)
+    }
+    assert all(entry["errors"] == 0 and entry["queries"]["max"] is not None for entry in results)
+
+    again = subprocess.run(
+        command + ["--endpoints", "scan", "--compare", str(output), "--tolerance", "100"],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert again.returncode == 0, again.stderr
+    assert "Compared with" in again.stdout
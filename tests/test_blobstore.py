@@ -0,0 +1,38 @@
+import os
+
+import routes
+from app import db
+from models import Photo, PhotoBlob
+
+from conftest import make_jpeg, upload
+
+def test_failed_duplicate_upload_keeps_existing_blob(client, folder, monkeypatch):
+    data = make_jpeg(1)
+    first = upload(client, folder, data)
+    assert first.status_code == 200
+    photo = db.session.get(Photo, first.get_json()["photo_id"])
+
+    def fail(photos):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(routes, "record_photos_added", fail)
+    second = upload(client, folder, data)
+    assert second.status_code == 500
+
+    db.session.expire_all()
+    assert PhotoBlob.query.one().ref_count == 1
+    assert os.path.exists(photo.local_path)
+    assert client.get(photo.file_url).status_code == 200
+
+def test_duplicate_upload_shares_blob(client, folder):
+    data = make_jpeg(2)
+    first = upload(client, folder, data).get_json()
+    second = upload(client, folder, data).get_json()
+
+    photos = Photo.query.filter(Photo.id.in_([first["photo_id"], second["photo_id"]])).all()
+    blob = PhotoBlob.query.one()
+    assert {photo.blob_id for photo in photos} == {blob.id}
+    assert blob.ref_count == 2
+    assert os.path.exists(blob.file_path)
+    # Nothing is left behind under the temporary upload names
+    assert sorted(os.listdir(os.path.dirname(os.path.dirname(os.path.dirname(blob.file_path))))) == ["blobs"]
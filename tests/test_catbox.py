@@ -0,0 +1,125 @@
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import offload
+import storage
+from app import db
+from models import Photo, OffloadJob
+from storage import CatboxStorage, StorageError
+
+from conftest import make_folder, make_jpeg, upload
+
+REMOTE_URL = "https://files.catbox.moe/abc123.jpg"
+
+@pytest.fixture
+def catbox(app, http_server, monkeypatch):
+    """A local stand-in for the catbox.moe API and file host.
+
+    Set `catbox.answer` to "ok", "error", "garbage" or "slow" to choose how
+    uploads are answered; the raw upload bodies are kept in `catbox.uploads`.
+    """
+    class Catbox(BaseHTTPRequestHandler):
+        answer = "ok"
+        uploads = []
+        files = {"abc123.jpg": b"remote bytes"}
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body=b"", headers=None, send_body=True):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+
+        def do_POST(self):
+            Catbox.uploads.append((self.path, self.rfile.read(int(self.headers["Content-Length"]))))
+            if Catbox.answer == "slow":
+                time.sleep(1)
+            if Catbox.answer == "error":
+                self.reply(500, b"Internal Server Error")
+            elif Catbox.answer == "garbage":
+                self.reply(200, b"No files given")
+            else:
+                self.reply(200, REMOTE_URL.encode())
+
+        def do_GET(self, send_body=True):
+            data = Catbox.files.get(self.path.lstrip("/"))
+            if data is None:
+                self.reply(404, send_body=send_body)
+                return
+            self.reply(200, data, {
+                "Content-Type": "image/jpeg",
+                "ETag": '"abc123"',
+                "Last-Modified": "Wed, 01 Jan 2025 00:00:00 GMT",
+            }, send_body=send_body)
+
+        def do_HEAD(self):
+            self.do_GET(send_body=False)
+
+    url = http_server(Catbox)
+    monkeypatch.setitem(app.config, "CATBOX_API_URL", f"{url}/user/api.php")
+    monkeypatch.setitem(app.config, "CATBOX_TIMEOUT", 0.3)
+    Catbox.backend = CatboxStorage(url)
+    return Catbox
+
+@pytest.fixture
+def photo_file(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(make_jpeg(1))
+    return str(path)
+
+def test_put_uploads_the_file(catbox, photo_file):
+    stored = catbox.backend.put("photos/party.jpg", photo_file, "image/jpeg")
+
+    assert stored == {"key": "abc123.jpg", "url": REMOTE_URL}
+    path, body = catbox.uploads[0]
+    assert path == "/user/api.php"
+    assert b'name="reqtype"\r\n\r\nfileupload' in body
+    assert b'filename="party.jpg"' in body
+    assert make_jpeg(1) in body
+
+@pytest.mark.parametrize("answer, message", [
+    ("error", "returned 500"),
+    ("garbage", "No files given"),
+    ("slow", "timed out"),
+])
+def test_failed_put_raises_storage_error(catbox, photo_file, answer, message):
+    catbox.answer = answer
+    with pytest.raises(StorageError, match=message):
+        catbox.backend.put("photos/party.jpg", photo_file, "image/jpeg")
+
+def test_stream_and_stat(catbox):
+    assert catbox.backend.get("abc123.jpg") == b"remote bytes"
+    assert catbox.backend.stat("abc123.jpg")["size"] == len(b"remote bytes")
+    assert catbox.backend.stat("missing.jpg") is None
+    with pytest.raises(StorageError):
+        catbox.backend.get("missing.jpg")
+
+def test_offload_through_catbox(client, user, catbox, monkeypatch):
+    monkeypatch.setitem(storage._backends, "catbox", catbox.backend)
+    folder = make_folder(user, is_local=False, storage_backend="catbox")
+    photo_id = upload(client, folder, make_jpeg(2)).get_json()["photo_id"]
+
+    catbox.answer = "error"
+    db.session.remove()
+    offload.run_pending()
+    job = OffloadJob.query.one()
+    assert job.status == OffloadJob.STATUS_PENDING
+    assert "returned 500" in job.last_error
+    assert db.session.get(Photo, photo_id).is_local
+
+    catbox.answer = "ok"
+    OffloadJob.query.update({"next_attempt_at": job.created_at})
+    db.session.commit()
+    db.session.remove()
+    offload.run_pending()
+    photo = db.session.get(Photo, photo_id)
+    assert not photo.is_local
+    assert photo.file_url == REMOTE_URL
+    assert photo.storage_key == "abc123.jpg"
@@ -0,0 +1,41 @@
+from counters import reconcile_counters
+from app import db
+from models import Photo, PhotoFolder, User
+
+from conftest import make_folder, make_jpeg, upload
+
+def counters(model, row_id):
+    db.session.expire_all()
+    row = db.session.get(model, row_id)
+    return row.photo_count, row.total_bytes
+
+def test_uploads_and_deletes_keep_counters(logged_in, user, folder):
+    other = make_folder(user)
+    ids = [
+        upload(logged_in, target, make_jpeg(seed)).get_json()["photo_id"]
+        for seed, target in ((1, folder), (2, folder), (3, other))
+    ]
+    first, second, third = (db.session.get(Photo, photo_id).file_size for photo_id in ids)
+
+    assert counters(PhotoFolder, folder.id) == (2, first + second)
+    assert counters(PhotoFolder, other.id) == (1, third)
+    assert counters(User, user.id) == (3, first + second + third)
+
+    logged_in.post("/photos/delete", json={"photo_ids": [ids[0]]})
+    assert counters(PhotoFolder, folder.id) == (1, second)
+    assert counters(User, user.id) == (2, second + third)
+
+    logged_in.get(f"/folder/delete/{other.id}", headers={"Accept": "application/json"})
+    assert counters(User, user.id) == (1, second)
+
+def test_reconcile_repairs_drift(client, user, folder):
+    upload(client, folder, make_jpeg(1))
+    size = Photo.query.one().file_size
+    PhotoFolder.query.update({"photo_count": 7, "total_bytes": 0})
+    db.session.commit()
+
+    # Only the folder had drifted
+    assert reconcile_counters() == 1
+    assert counters(PhotoFolder, folder.id) == (1, size)
+    assert counters(User, user.id) == (1, size)
+    assert reconcile_counters() == 0
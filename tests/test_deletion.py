@@ -0,0 +1,87 @@
+import os
+
+import deletion
+import resumable
+from app import db
+from models import Photo, PhotoBlob, FileTombstone
+
+from conftest import make_folder, make_jpeg, upload
+
+def test_released_blob_is_removed(logged_in, folder):
+    photo_id = upload(logged_in, folder, make_jpeg(1)).get_json()["photo_id"]
+    blob_path = db.session.get(Photo, photo_id).local_path
+
+    response = logged_in.post("/photos/delete", json={"photo_ids": [photo_id]})
+    assert response.get_json()["success"]
+    assert os.path.exists(blob_path)
+
+    deletion.remove_deleted_files()
+    assert not os.path.exists(blob_path)
+    assert FileTombstone.query.count() == 0
+
+def test_blob_stored_again_during_removal_is_kept(logged_in, folder, monkeypatch):
+    data = make_jpeg(2)
+    photo_id = upload(logged_in, folder, data).get_json()["photo_id"]
+    blob_path = db.session.get(Photo, photo_id).local_path
+    logged_in.post("/photos/delete", json={"photo_ids": [photo_id]})
+
+    # The same content is uploaded and committed between the removal's two checks
+    checks = []
+    def blob_exists(sha256):
+        checks.append(sha256)
+        if len(checks) == 2:
+            assert upload(logged_in, folder, data).status_code == 200
+        return PhotoBlob.query.filter_by(sha256=sha256).first() is not None
+
+    monkeypatch.setattr(deletion, "_blob_exists", blob_exists)
+    deletion.remove_deleted_files()
+
+    assert len(checks) == 2
+    assert os.path.exists(blob_path)
+    assert not os.path.exists(f"{blob_path}.removing")
+
+def test_folder_chunks_are_removed_after_commit(logged_in, folder):
+    response = logged_in.post("/upload/resumable", json={
+        "folder_id": folder.folder_key, "filename": "big.jpg", "size": 10
+    })
+    upload_id = response.get_json()["upload_id"]
+    logged_in.put(f"/upload/resumable/{upload_id}/chunks/0", data=b"0123456789")
+    assert os.path.isdir(resumable.chunk_dir(upload_id))
+
+    logged_in.get(f"/folder/delete/{folder.id}", headers={"Accept": "application/json"})
+    assert os.path.isdir(resumable.chunk_dir(upload_id))
+
+    deletion.remove_deleted_files()
+    assert not os.path.exists(resumable.chunk_dir(upload_id))
+
+def test_shared_blob_is_kept_until_its_last_photo_goes(logged_in, folder):
+    data = make_jpeg(3)
+    first = upload(logged_in, folder, data).get_json()["photo_id"]
+    second = upload(logged_in, folder, data).get_json()["photo_id"]
+    blob_path = PhotoBlob.query.one().file_path
+
+    logged_in.post("/photos/delete", json={"photo_ids": [first]})
+    deletion.remove_deleted_files()
+    assert PhotoBlob.query.one().ref_count == 1
+    assert os.path.exists(blob_path)
+
+    logged_in.post("/photos/delete", json={"photo_ids": [second]})
+    deletion.remove_deleted_files()
+    assert PhotoBlob.query.count() == 0
+    assert not os.path.exists(blob_path)
+
+def test_folder_deletion_releases_every_reference(logged_in, user, folder):
+    data = make_jpeg(4)
+    for _ in range(3):
+        upload(logged_in, folder, data)
+    upload(logged_in, make_folder(user), data)
+    upload(logged_in, folder, make_jpeg(5))
+    assert sorted(blob.ref_count for blob in PhotoBlob.query) == [1, 4]
+
+    logged_in.get(f"/folder/delete/{folder.id}", headers={"Accept": "application/json"})
+    deletion.remove_deleted_files()
+
+    shared = PhotoBlob.query.one()
+    assert shared.ref_count == 1
+    assert os.path.exists(shared.file_path)
+    assert FileTombstone.query.count() == 0
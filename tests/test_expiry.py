@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import expiry
+from app import db
+from models import PhotoFolder, OffloadJob
+from folder_cache import get_folder_snapshot
+
+from conftest import make_folder, make_jpeg, upload
+
+def test_scheduler_expired_folder_shows_expiry(client, user):
+    folder = make_folder(user, qr_code_expires_at=datetime.utcnow() - timedelta(minutes=1))
+    assert expiry.expire_folders() == 1
+
+    page = client.get(f"/scan/{folder.folder_key}").get_data(as_text=True)
+    assert "The QR code has expired. It expired on" in page
+    assert "manually deactivated" not in page
+
+    response = upload(client, folder, make_jpeg())
+    assert response.status_code == 403
+    assert "expired" in response.get_json()["error"]
+
+def test_manually_deactivated_folder_says_so(client, user):
+    folder = make_folder(user, qr_code_expires_at=datetime.utcnow() + timedelta(hours=1))
+    folder.deactivate_qr_code()
+
+    page = client.get(f"/scan/{folder.folder_key}").get_data(as_text=True)
+    assert "manually deactivated" in page
+
+    response = upload(client, folder, make_jpeg())
+    assert response.status_code == 403
+    assert "deactivated" in response.get_json()["error"]
+
+def test_scheduler_expires_only_due_active_folders(user):
+    past = datetime.utcnow() - timedelta(minutes=1)
+    due = [make_folder(user, qr_code_expires_at=past - timedelta(minutes=index)) for index in range(3)]
+    kept = [
+        make_folder(user, qr_code_expires_at=datetime.utcnow() + timedelta(hours=1)),
+        make_folder(user),
+        make_folder(user, qr_code_expires_at=past, qr_code_active=False),
+    ]
+    # Snapshot cached while the folder was still active
+    assert get_folder_snapshot(due[0].folder_key).qr_code_active
+
+    # Several batches
+    assert expiry.expire_folders(batch_size=2) == 3
+    assert expiry.expire_folders() == 0
+
+    db.session.expire_all()
+    assert [folder.qr_code_active for folder in due] == [False, False, False]
+    assert [folder.qr_code_active for folder in kept] == [True, True, False]
+    # The cached snapshot was dropped
+    assert not get_folder_snapshot(due[0].folder_key).qr_code_active
+
+def test_expired_local_folders_are_archived(app, client, user, monkeypatch):
+    monkeypatch.setitem(app.config, "FOLDER_EXPIRY_ARCHIVE_BACKEND", "catbox")
+    local = make_folder(user, qr_code_expires_at=datetime.utcnow() + timedelta(hours=1))
+    remote = make_folder(user, is_local=False, storage_backend="catbox", qr_code_expires_at=local.qr_code_expires_at)
+    photo_ids = [upload(client, local, make_jpeg(seed)).get_json()["photo_id"] for seed in range(2)]
+    upload(client, remote, make_jpeg(2))
+    OffloadJob.query.delete()
+    PhotoFolder.query.update({"qr_code_expires_at": datetime.utcnow() - timedelta(minutes=1)})
+    db.session.commit()
+
+    assert expiry.expire_folders() == 2
+
+    db.session.expire_all()
+    assert not local.is_local and local.storage_backend == "catbox"
+    jobs = OffloadJob.query.all()
+    assert sorted(job.photo_id for job in jobs) == sorted(photo_ids)
+    assert all(job.status == OffloadJob.STATUS_PENDING for job in jobs)
@@ -0,0 +1,184 @@
+import socketserver
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import folder_cache
+from app import db
+from models import Photo, PhotoFolder
+from shared_cache import RedisCache, SharedCacheError
+
+from conftest import make_jpeg, upload
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """A local stand-in for Redis: GET, SET ... EX, DEL, AUTH and SELECT over RESP.
+
+    With `down` set, connections are closed as soon as they are accepted.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        super().__init__(("127.0.0.1", 0), RespHandler)
+        self.password = password
+        self.data = {}
+        self.commands = []
+        self.connections = 0
+        self.down = False
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}"
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        if server.down:
+            return
+        authenticated = server.password is None
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            name = args[0].decode().upper()
+            server.commands.append([name] + args[1:])
+            if name == "AUTH":
+                authenticated = args[1].decode() == server.password
+                self.wfile.write(b"+OK\r\n" if authenticated else b"-WRONGPASS invalid password\r\n")
+            elif not authenticated:
+                self.wfile.write(b"-NOAUTH Authentication required.\r\n")
+            elif name == "SELECT":
+                self.wfile.write(b"+OK\r\n")
+            elif name == "GET":
+                value = server.data.get(args[1])
+                self.wfile.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+            elif name == "SET":
+                server.data[args[1]] = args[2]
+                self.wfile.write(b"+OK\r\n")
+            elif name == "DEL":
+                removed = sum(server.data.pop(key, None) is not None for key in args[1:])
+                self.wfile.write(b":%d\r\n" % removed)
+            else:
+                self.wfile.write(b"-ERR unknown command '%s'\r\n" % args[0])
+
+@pytest.fixture
+def resp_server():
+    servers = []
+    def start(password=None):
+        server = RespServer(password)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def shared(app, resp_server, monkeypatch):
+    """The folder cache with a shared tier on a local RESP server."""
+    server = resp_server()
+    monkeypatch.setitem(app.config, "FOLDER_CACHE_REDIS_URL", server.url)
+    monkeypatch.setattr(folder_cache, "_shared", None)
+    return server
+
+def forget_local_snapshots():
+    with folder_cache._snapshots_lock:
+        folder_cache._snapshots.clear()
+
+def test_get_set_delete(resp_server):
+    server = resp_server(password="s3cret")
+    cache = RedisCache(f"redis://:s3cret@127.0.0.1:{server.server_address[1]}/2")
+
+    assert cache.get("missing") is None
+    cache.set("key", "value", 30)
+    assert cache.get("key") == b"value"
+    assert cache.delete("key", "other") == 1
+    assert cache.get("key") is None
+
+    # One connection, authenticated and switched to database 2 first
+    assert server.connections == 1
+    assert server.commands[:3] == [["AUTH", b"s3cret"], ["SELECT", b"2"], ["GET", b"missing"]]
+    assert ["SET", b"key", b"value", b"EX", b"30"] in server.commands
+
+def test_error_reply_raises(resp_server):
+    server = resp_server(password="s3cret")
+    cache = RedisCache(server.url)
+    with pytest.raises(SharedCacheError, match="NOAUTH"):
+        cache.get("key")
+
+def test_outage_backs_off(resp_server, monkeypatch):
+    server = resp_server()
+    server.down = True
+    cache = RedisCache(server.url, retry_after=10)
+
+    with pytest.raises(SharedCacheError):
+        cache.get("key")
+    # Skipped without connecting until retry_after has passed
+    with pytest.raises(SharedCacheError, match="unavailable"):
+        cache.get("key")
+    assert server.connections == 1
+
+    server.down = False
+    monkeypatch.setattr(cache, "_down_until", 0)
+    assert cache.get("key") is None
+    assert server.connections == 2
+
+def test_snapshot_is_shared_between_processes(shared, folder):
+    key = folder.folder_key
+    snapshot = folder_cache.get_folder_snapshot(key)
+    assert shared.data[f"folder:v1:{key}".encode()]
+
+    # Another process, with nothing cached locally, reads the shared copy
+    forget_local_snapshots()
+    shared.data[f"folder:v1:{key}".encode()] = folder_cache._encode(snapshot._replace(folder_name="From the shared tier")).encode()
+    assert folder_cache.get_folder_snapshot(key).folder_name == "From the shared tier"
+
+    folder_cache.invalidate_folder_snapshot(key)
+    assert f"folder:v1:{key}".encode() not in shared.data
+    assert folder_cache.get_folder_snapshot(key).folder_name == folder.folder_name
+
+def test_unknown_folder_is_cached_as_missing(shared):
+    assert folder_cache.get_folder_snapshot("no-such-folder") is None
+    assert shared.data[b"folder:v1:no-such-folder"] == b"null"
+    forget_local_snapshots()
+    assert folder_cache.get_folder_snapshot("no-such-folder") is None
+
+def test_outage_falls_back_to_the_database_and_local_cache(shared, folder, client):
+    shared.down = True
+    url = f"/scan/{folder.folder_key}"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert int(first.headers["X-DB-Query-Count"]) == 1
+    # Served from the process-local LRU; the shared tier isn't tried again
+    second = client.get(url)
+    assert int(second.headers["X-DB-Query-Count"]) == 0
+    assert shared.connections == 1
+
+def test_upload_to_folder_deleted_elsewhere_is_rejected(client, folder):
+    key = folder.folder_key
+    assert upload(client, folder, make_jpeg(1)).status_code == 200
+
+    # Another process deletes the folder; this one still has its snapshot
+    with db.engine.begin() as connection:
+        connection.execute(db.delete(Photo))
+        connection.execute(db.delete(PhotoFolder).where(PhotoFolder.folder_key == key))
+    assert folder_cache.get_folder_snapshot(key) is not None
+
+    response = upload(client, SimpleNamespace(folder_key=key), make_jpeg(2))
+    assert response.status_code == 404
+    assert Photo.query.count() == 0
@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+import imagepool
+from imaging import render_thumbnails
+from imagepool import submit, run, ImageQueueFull
+
+from conftest import make_jpeg
+
+@pytest.fixture
+def pool(app, monkeypatch):
+    """A pool of one spawned image worker, shut down after the test."""
+    monkeypatch.setitem(app.config, "IMAGE_WORKERS", 1)
+    monkeypatch.setattr(imagepool, "_executor", None)
+    monkeypatch.setattr(imagepool, "_slots", None)
+    yield
+    imagepool.shutdown(wait=True)
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(make_jpeg(1, (400, 300)))
+    return str(path)
+
+def test_inline_without_workers(app, source, tmp_path):
+    target = str(tmp_path / "thumb.jpg")
+    future = submit(render_thumbnails, source, [(100, "jpeg", "JPEG", target)], 80)
+    assert future.done()
+    assert future.result()[0][:3] == (100, "jpeg", target)
+
+    with pytest.raises(FileNotFoundError):
+        run(render_thumbnails, str(tmp_path / "missing.jpg"), [], 80)
+
+def test_job_runs_in_a_worker_process(pool, source, tmp_path):
+    target = str(tmp_path / "thumb.webp")
+    written = run(render_thumbnails, source, [(200, "webp", "WEBP", target)], 80, timeout=30)
+    assert written == [(200, "webp", target, os.path.getsize(target))]
+    assert run(os.getpid, timeout=30) != os.getpid()
+
+def test_wait_times_out_and_full_queue_is_refused(pool, app, monkeypatch):
+    monkeypatch.setitem(app.config, "IMAGE_QUEUE_SIZE", 1)
+    monkeypatch.setitem(app.config, "IMAGE_QUEUE_WAIT", 0.1)
+    # Start the worker first so its start-up time doesn't count
+    run(os.getpid, timeout=30)
+
+    with pytest.raises(TimeoutError):
+        run(time.sleep, 1, timeout=0.1)
+    # The running job still holds the only slot
+    with pytest.raises(ImageQueueFull):
+        submit(os.getpid)
+
+    # It is given back when the job finishes
+    monkeypatch.setitem(app.config, "IMAGE_QUEUE_WAIT", 30)
+    assert run(os.getpid, timeout=30)
+
+def test_dead_worker_is_replaced(pool):
+    first = run(os.getpid, timeout=30)
+    with pytest.raises(Exception):
+        run(os._exit, 1, timeout=30)
+    assert run(os.getpid, timeout=30) != first
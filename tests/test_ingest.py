@@ -0,0 +1,91 @@
+import io
+import os
+import hashlib
+
+import pytest
+from flask import request
+
+from ingest import stream_multipart_upload, UploadRejected
+from models import Photo
+
+from conftest import make_jpeg, upload
+
+def multipart(parts, boundary="boundary"):
+    body = b""
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename is not None else "")
+        body += f"--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + value + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+def parse(app, body, stream=None):
+    """Run stream_multipart_upload on a request with `body`; `stream` shows how much was read."""
+    stream = stream or io.BytesIO(body)
+    with app.test_request_context("/upload", method="POST", input_stream=stream, headers={
+        "Content-Type": "multipart/form-data; boundary=boundary", "Content-Length": str(len(body))
+    }):
+        return stream_multipart_upload(request)
+
+def uploads_on_disk(app):
+    return sorted(name for name in os.listdir(app.config["UPLOAD_FOLDER"]) if not name.startswith("."))
+
+def test_file_is_streamed_to_disk_with_its_hash(app):
+    data = make_jpeg(1, (300, 200))
+    fields, saved = parse(app, multipart([("folder_id", b"abc", None), ("file", data, "party.jpg")]))
+
+    assert fields == {"folder_id": "abc"}
+    result = saved[0]
+    assert (result["original_name"], result["mime_type"], result["file_size"]) == ("party.jpg", "image/jpeg", len(data))
+    assert result["sha256"] == hashlib.sha256(data).hexdigest()
+    with open(result["temp_path"], "rb") as f:
+        assert f.read() == data
+    os.remove(result["temp_path"])
+
+def test_bad_content_is_rejected_without_reading_the_rest(app, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_CHUNK_SIZE", 1024)
+    before = uploads_on_disk(app)
+    body = multipart([("file", b"MZ" + b"\0" * 100000, "evil.jpg")])
+    stream = io.BytesIO(body)
+
+    with pytest.raises(UploadRejected, match="not a supported image type"):
+        parse(app, body, stream)
+    assert stream.tell() < len(body) // 10
+    assert uploads_on_disk(app) == before
+
+def test_oversize_file_is_rejected(app, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_CHUNK_SIZE", 1024)
+    monkeypatch.setitem(app.config, "MAX_FILE_SIZE", 4096)
+    before = uploads_on_disk(app)
+
+    with pytest.raises(UploadRejected) as rejected:
+        parse(app, multipart([("file", make_jpeg(1, (800, 600)), "big.jpg")]))
+    assert rejected.value.status == 413
+    assert uploads_on_disk(app) == before
+
+@pytest.mark.parametrize("parts, message", [
+    ([("file", b"GIF89a", "notes.txt")], "File type not allowed"),
+    ([("file", b"GIF89a", "")], "No file selected"),
+    ([("other", b"GIF89a", "a.gif")], "Unexpected file field"),
+    ([("file", b"GIF89a", "a.gif"), ("file", b"GIF89a", "b.gif")], "At most 1 file"),
+])
+def test_unacceptable_files_are_rejected(app, parts, message):
+    before = uploads_on_disk(app)
+    with pytest.raises(UploadRejected, match=message):
+        parse(app, multipart(parts))
+    assert uploads_on_disk(app) == before
+
+def test_large_form_field_and_truncated_body(app, monkeypatch):
+    monkeypatch.setitem(app.config, "MAX_FORM_MEMORY_SIZE", 100)
+    with pytest.raises(UploadRejected, match="too large"):
+        parse(app, multipart([("folder_id", b"x" * 1000, None)]))
+
+    body = multipart([("file", make_jpeg(1, (300, 200)), "cut.jpg")])
+    before = uploads_on_disk(app)
+    with pytest.raises(UploadRejected):
+        parse(app, body[:len(body) // 2])
+    assert uploads_on_disk(app) == before
+
+def test_upload_route_reports_rejections(client, folder):
+    response = upload(client, folder, b"not an image", "fake.jpg")
+    assert response.status_code == 400
+    assert response.get_json() == {"success": False, "error": "File is not a supported image type"}
+    assert Photo.query.count() == 0
@@ -0,0 +1,68 @@
+import sys
+import json
+import queue
+import logging
+
+from logconfig import (
+    JsonFormatter, SamplingFilter, BoundedQueueHandler, parse_levels, SAMPLED
+)
+
+def make_record(level=logging.INFO, msg="hello %s", args=("world",), request_id="req-1", **extra):
+    record = logging.LogRecord("photos", level, __file__, 1, msg, args, None)
+    record.request_id = request_id
+    record.__dict__.update(extra)
+    return record
+
+def test_parse_levels():
+    assert parse_levels("offload=DEBUG, routes = warning,,bad") == {"offload": "DEBUG", "routes": "WARNING"}
+    assert parse_levels(None) == {}
+
+def test_json_lines_carry_the_request_id_and_extra_fields():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record(logging.ERROR, db_queries=3, **SAMPLED)
+        record.exc_info = sys.exc_info()
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "hello world"
+    assert (entry["level"], entry["logger"], entry["request_id"]) == ("ERROR", "photos", "req-1")
+    assert entry["db_queries"] == 3
+    assert "sampled" not in entry
+    assert "ValueError: boom" in entry["exception"]
+
+def test_sampling_keeps_whole_requests():
+    none, every = SamplingFilter(0), SamplingFilter(1)
+    assert not none.filter(make_record(**SAMPLED))
+    assert every.filter(make_record(**SAMPLED))
+    # Only sampled info records are dropped
+    assert none.filter(make_record())
+    assert none.filter(make_record(logging.WARNING, **SAMPLED))
+
+    half = SamplingFilter(0.5)
+    for request_id in (f"req-{index}" for index in range(20)):
+        kept = {half.filter(make_record(request_id=request_id, **SAMPLED)) for _ in range(5)}
+        assert len(kept) == 1
+    kept = [half.filter(make_record(request_id=f"req-{index}", **SAMPLED)) for index in range(1000)]
+    assert 350 < sum(kept) < 650
+
+def test_full_queue_drops_records_and_says_so():
+    log_queue = queue.Queue(2)
+    handler = BoundedQueueHandler(log_queue)
+    for _ in range(4):
+        handler.handle(make_record())
+    assert handler.dropped == 2
+
+    first = log_queue.get_nowait()
+    assert (first.msg, first.args) == ("hello world", None)
+    log_queue.get_nowait()
+
+    handler.handle(make_record(msg="later", args=()))
+    assert log_queue.get_nowait().msg == "Dropped 2 log record(s): the log queue was full"
+    assert log_queue.get_nowait().msg == "later"
+    assert handler.dropped == 0
+
+def test_request_id_is_taken_from_the_proxy_or_made_up(client):
+    assert client.get("/", headers={"X-Request-ID": "abc-123"}).headers["X-Request-ID"] == "abc-123"
+    made_up = client.get("/", headers={"X-Request-ID": "bad id!"}).headers["X-Request-ID"]
+    assert made_up != "bad id!" and len(made_up) == 32
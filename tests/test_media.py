@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from app import db
+from media import send_media
+from models import Photo
+
+from conftest import make_jpeg, upload
+
+@pytest.fixture
+def photo(client, folder):
+    photo_id = upload(client, folder, make_jpeg(1, (300, 200))).get_json()["photo_id"]
+    return db.session.get(Photo, photo_id)
+
+def content_hash(photo):
+    return os.path.basename(photo.local_path).split(".", 1)[0]
+
+def test_blob_is_cached_for_good(client, photo):
+    response = client.get(photo.file_url)
+    with open(photo.local_path, "rb") as f:
+        assert response.get_data() == f.read()
+    assert response.headers["ETag"] == f'"{content_hash(photo)}"'
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+
+    revalidated = client.get(photo.file_url, headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b""
+
+def test_blob_ranges(client, photo):
+    data = client.get(photo.file_url).get_data()
+    response = client.get(photo.file_url, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.get_data() == data[10:20]
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(data)}"
+
+    stale = client.get(photo.file_url, headers={"Range": "bytes=10-19", "If-Range": '"other"'})
+    assert stale.status_code == 200
+
+@pytest.mark.parametrize("path", [
+    "/static/uploads/blobs/00/" + "0" * 64 + ".jpg",
+    "/static/uploads/blobs/ab/" + "0" * 64 + ".jpg",
+    "/static/uploads/blobs/ab/short.jpg",
+])
+def test_unknown_or_malformed_blob_is_404(client, path):
+    assert client.get(path).status_code == 404
+
+def test_proxy_sends_the_file(app, client, photo, monkeypatch):
+    monkeypatch.setitem(app.config, "MEDIA_SENDFILE", "x-accel-redirect")
+    response = client.get(photo.file_url)
+    relative = os.path.relpath(photo.local_path, app.config["MEDIA_ROOT"]).replace(os.sep, "/")
+    assert response.headers["X-Accel-Redirect"] == f"/_media/{relative}"
+    assert response.get_data() == b""
+    assert response.content_length == os.path.getsize(photo.local_path)
+    assert response.headers["ETag"] == f'"{content_hash(photo)}"'
+
+    # Conditional requests are still answered here
+    revalidated = client.get(photo.file_url, headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert "X-Accel-Redirect" not in revalidated.headers
+
+    monkeypatch.setitem(app.config, "MEDIA_SENDFILE", "x-sendfile")
+    assert client.get(photo.file_url).headers["X-Sendfile"] == os.path.abspath(photo.local_path)
+
+def test_file_outside_media_root_is_sent_by_the_app(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "MEDIA_SENDFILE", "x-accel-redirect")
+    path = tmp_path / "outside.jpg"
+    path.write_bytes(make_jpeg(2))
+    with app.test_request_context():
+        response = send_media(str(path), download_name="party.jpg")
+        response.direct_passthrough = False
+        assert "X-Accel-Redirect" not in response.headers
+        assert response.get_data() == make_jpeg(2)
+        assert "party.jpg" in response.headers["Content-Disposition"]
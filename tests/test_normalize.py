@@ -0,0 +1,88 @@
+import io
+import os
+import zipfile
+from concurrent.futures import Future
+
+from PIL import Image
+
+import normalize
+from app import db
+from models import Photo, photo_download_name
+
+from conftest import upload
+
+def noisy_png():
+    # Noise compresses badly as PNG, so the JPEG re-encode is smaller and kept
+    buffer = io.BytesIO()
+    Image.effect_noise((200, 150), 64).convert("RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+def gif(size, frames=1):
+    buffer = io.BytesIO()
+    images = [Image.new("RGB", size, (index * 80, 0, 255 - index * 80)) for index in range(frames)]
+    images[0].save(buffer, "GIF", save_all=frames > 1, append_images=images[1:])
+    return buffer.getvalue()
+
+def test_static_gif_is_normalized(client, folder, app):
+    # Wider than NORMALIZE_MAX_EDGE, so it has to be shrunk
+    width = app.config["NORMALIZE_MAX_EDGE"] + 100
+    photo_id = upload(client, folder, gif((width, 20)), "wide.gif").get_json()["photo_id"]
+
+    photo = db.session.get(Photo, photo_id)
+    assert photo.mime_type != "image/gif"
+    with Image.open(photo.local_path) as img:
+        assert img.width == app.config["NORMALIZE_MAX_EDGE"]
+
+def test_animated_gif_is_kept(client, folder, app):
+    data = gif((app.config["NORMALIZE_MAX_EDGE"] + 100, 20), frames=3)
+    photo_id = upload(client, folder, data, "animated.gif").get_json()["photo_id"]
+
+    photo = db.session.get(Photo, photo_id)
+    assert photo.mime_type == "image/gif"
+    with open(photo.local_path, "rb") as f:
+        assert f.read() == data
+
+def test_reencoded_photo_downloads_with_its_stored_type(logged_in, folder):
+    photo_id = upload(logged_in, folder, noisy_png(), "party.png").get_json()["photo_id"]
+    assert db.session.get(Photo, photo_id).mime_type == "image/jpeg"
+
+    response = logged_in.get(f"/photo/download/{photo_id}")
+    assert response.mimetype == "image/jpeg"
+    assert "party.jpg" in response.headers["Content-Disposition"]
+    assert response.get_data().startswith(b"\xff\xd8\xff")
+
+    archive = zipfile.ZipFile(io.BytesIO(logged_in.get(f"/folder/download/{folder.folder_key}.zip").get_data()))
+    assert archive.namelist() == ["party.jpg"]
+
+    share_url = logged_in.get(f"/photo/share/{photo_id}", headers={"Accept": "application/json"}).get_json()["share_url"]
+    assert 'download="party.jpg"' in logged_in.get(share_url).get_data(as_text=True)
+
+def test_download_name_keeps_matching_extensions():
+    assert photo_download_name("party.jpeg", "abc.jpg") == "party.jpeg"
+    assert photo_download_name("party.PNG", "abc.png") == "party.PNG"
+    assert photo_download_name("party.png", "abc.webp") == "party.webp"
+    assert photo_download_name("party", "abc.jpg") == "party.jpg"
+    assert photo_download_name(None, "abc.jpg") == "abc.jpg"
+
+def test_output_of_an_abandoned_job_is_removed(client, folder, app, monkeypatch):
+    # The job writes its file but is still running when the request stops waiting for it
+    late_jobs = []
+    def submit(fn, *args):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        late_jobs.append((future, fn(*args)))
+        return future
+    monkeypatch.setattr(normalize, "submit", submit)
+    monkeypatch.setitem(app.config, "IMAGE_JOB_TIMEOUT", 0.01)
+
+    data = noisy_png()
+    photo_id = upload(client, folder, data, "party.png").get_json()["photo_id"]
+    photo = db.session.get(Photo, photo_id)
+    assert photo.mime_type == "image/png"
+
+    future, normalized = late_jobs[0]
+    assert os.path.exists(normalized["local_path"])
+    future.set_result(normalized)
+    assert not os.path.exists(normalized["local_path"])
+    with open(photo.local_path, "rb") as f:
+        assert f.read() == data
@@ -0,0 +1,165 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import offload
+import storage
+import deletion
+from app import db
+from models import Photo, PhotoBlob, OffloadJob, FileTombstone
+
+from conftest import make_folder, make_jpeg, upload
+
+class FakeBackend(storage.StorageBackend):
+    """Records puts instead of talking to a remote service."""
+
+    public = True
+
+    def __init__(self, on_put=None):
+        self.objects = {}
+        self.deleted = []
+        self.on_put = on_put
+        self.fail = False
+
+    def put(self, key, file_path, mime_type=None):
+        if self.on_put is not None:
+            self.on_put()
+        if self.fail:
+            raise storage.StorageError("Service unavailable")
+        with open(file_path, "rb") as f:
+            self.objects[key] = f.read()
+        return {"key": key, "url": f"https://files.example.com/{key}"}
+
+    def delete(self, key):
+        self.deleted.append(key)
+
+def run_offload():
+    """Drain the queue in a fresh session, as the worker threads do."""
+    db.session.remove()
+    return offload.run_pending()
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setitem(storage._backends, "catbox", backend)
+    return backend
+
+@pytest.fixture
+def cloud_folder(user):
+    return make_folder(user, is_local=False, storage_backend="catbox")
+
+def test_offloaded_photo_releases_local_blob(client, cloud_folder, backend):
+    response = upload(client, cloud_folder, make_jpeg(1))
+    assert response.get_json()["offload_queued"]
+    photo = db.session.get(Photo, response.get_json()["photo_id"])
+    blob_path = photo.local_path
+
+    assert run_offload() == 1
+    photo = db.session.get(Photo, photo.id)
+    assert not photo.is_local
+    assert photo.local_path is None and photo.blob_id is None
+    assert photo.file_url.startswith("https://files.example.com/")
+    assert PhotoBlob.query.count() == 0
+    assert OffloadJob.query.one().status == OffloadJob.STATUS_DONE
+
+    deletion.remove_deleted_files()
+    assert not os.path.exists(blob_path)
+
+def test_shared_blob_survives_offload(client, user, cloud_folder, backend):
+    data = make_jpeg(2)
+    local_id = upload(client, make_folder(user), data).get_json()["photo_id"]
+    upload(client, cloud_folder, data)
+
+    run_offload()
+    deletion.remove_deleted_files()
+
+    local_photo = db.session.get(Photo, local_id)
+    assert PhotoBlob.query.one().ref_count == 1
+    assert os.path.exists(local_photo.local_path)
+
+def test_photo_deleted_during_offload_is_done(client, cloud_folder, backend):
+    photo_id = upload(client, cloud_folder, make_jpeg(3)).get_json()["photo_id"]
+
+    def delete_photo():
+        # Another request deletes the photo while the file is uploading
+        with db.engine.begin() as connection:
+            connection.execute(db.delete(OffloadJob).where(OffloadJob.photo_id == photo_id))
+            connection.execute(db.delete(Photo).where(Photo.id == photo_id))
+
+    backend.on_put = delete_photo
+    assert run_offload() == 1
+
+    assert OffloadJob.query.count() == 0
+    remote_key = FileTombstone.query.filter_by(kind=FileTombstone.KIND_REMOTE).one().path
+    assert remote_key in backend.objects
+    deletion.remove_deleted_files()
+    assert backend.deleted == [remote_key]
+
+def test_backoff_doubles_up_to_the_cap(app, monkeypatch):
+    monkeypatch.setitem(app.config, "OFFLOAD_BACKOFF_SECONDS", 30)
+    monkeypatch.setitem(app.config, "OFFLOAD_BACKOFF_MAX_SECONDS", 100)
+    delays = [offload.get_backoff(attempts).total_seconds() for attempts in range(1, 5)]
+    assert delays == [30, 60, 100, 100]
+
+def test_failed_job_is_retried_then_given_up(app, client, cloud_folder, backend, monkeypatch):
+    monkeypatch.setitem(app.config, "OFFLOAD_MAX_ATTEMPTS", 2)
+    upload(client, cloud_folder, make_jpeg(4))
+    backend.fail = True
+
+    assert run_offload() == 1
+    job = OffloadJob.query.one()
+    assert job.status == OffloadJob.STATUS_PENDING and job.attempts == 1
+    assert job.next_attempt_at > datetime.utcnow()
+    # Not due again until the backoff has passed
+    assert run_offload() == 0
+
+    OffloadJob.query.update({"next_attempt_at": datetime.utcnow()})
+    db.session.commit()
+    assert run_offload() == 1
+    job = OffloadJob.query.one()
+    assert job.status == OffloadJob.STATUS_FAILED and job.attempts == 2
+    assert job.last_error == "Service unavailable"
+
+    backend.fail = False
+    assert offload.retry_failed_jobs() == 1
+    assert run_offload() == 1
+    assert OffloadJob.query.one().status == OffloadJob.STATUS_DONE
+
+def test_running_job_is_reclaimed_after_its_lease(app, client, cloud_folder, backend):
+    upload(client, cloud_folder, make_jpeg(5))
+    db.session.remove()
+
+    job = offload.claim_next_job()
+    assert job.status == OffloadJob.STATUS_RUNNING and job.attempts == 1
+    # Its worker still holds the lease
+    assert offload.claim_next_job() is None
+
+    # The worker died; once the lease runs out another one takes the job
+    stale = datetime.utcnow() - timedelta(seconds=app.config["OFFLOAD_LEASE_SECONDS"] + 1)
+    OffloadJob.query.update({"locked_at": stale})
+    db.session.commit()
+    job = offload.claim_next_job()
+    assert job is not None and job.attempts == 2
+
+def test_claim_is_lost_to_a_faster_worker(app, client, cloud_folder, backend):
+    upload(client, cloud_folder, make_jpeg(6))
+    db.session.remove()
+
+    # Another worker claims the job between this one's SELECT and UPDATE
+    def claim_first(conn, cursor, statement, *args):
+        if statement.startswith("UPDATE offload_jobs") and not raced:
+            raced.append(statement)
+            with db.engine.begin() as connection:
+                connection.execute(db.update(OffloadJob).values(
+                    status=OffloadJob.STATUS_RUNNING, attempts=1, locked_at=datetime.utcnow()
+                ))
+    raced = []
+    event.listen(db.engine, "before_cursor_execute", claim_first)
+    try:
+        assert offload.claim_next_job() is None
+    finally:
+        event.remove(db.engine, "before_cursor_execute", claim_first)
+    assert raced
+    assert OffloadJob.query.one().attempts == 1
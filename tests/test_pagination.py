@@ -0,0 +1,95 @@
+import json
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from models import Photo
+from pagination import SORT_ORDERS, InvalidCursor, encode_cursor, decode_cursor, get_photo_page
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+@pytest.fixture
+def photos(folder):
+    start = datetime(2026, 1, 1)
+    photos = [
+        Photo(
+            file_name=f"{index}.jpg",
+            original_name=f"photo-{index % 3}.jpg",
+            file_url=f"/static/uploads/{index}.jpg",
+            file_size=1000 + index % 4,
+            uploaded_at=start + timedelta(minutes=index // 2),
+            user_id=folder.user_id,
+            folder_id=folder.id
+        )
+        for index in range(11)
+    ]
+    db.session.add_all(photos)
+    db.session.commit()
+    return photos
+
+@pytest.mark.parametrize("sort", sorted(SORT_ORDERS))
+def test_cursor_round_trip(photos, sort):
+    column, _ = SORT_ORDERS[sort]
+    photo = photos[5]
+    assert decode_cursor(encode_cursor(photo, sort), sort) == (getattr(photo, column.key), photo.id)
+
+@pytest.mark.parametrize("sort, value", [
+    ("size", "1000"),
+    ("size", 1000.5),
+    ("size", True),
+    ("name", 42),
+    ("newest", 1767225600),
+    ("newest", "not a date"),
+])
+def test_cursor_value_must_match_column(app, sort, value):
+    assert decode_cursor(raw_cursor([sort, value, 1]), sort) is None
+
+@pytest.mark.parametrize("cursor", [
+    raw_cursor(["size", 1000, "1"]),
+    raw_cursor(["name", "a.jpg", 1]),  # Made for another sort order
+    raw_cursor(["size", 1000]),
+    "not base64 at all!",
+])
+def test_malformed_cursor_is_ignored(app, cursor):
+    assert decode_cursor(cursor, "size") is None
+
+@pytest.mark.parametrize("sort", sorted(SORT_ORDERS))
+def test_pages_cover_folder_once(photos, folder, sort):
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = get_photo_page(folder.id, sort, cursor, limit=4)
+        seen.extend(photo.id for photo in page)
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(photo.id for photo in photos)
+    assert len(seen) == len(set(seen))
+
+@pytest.mark.parametrize("cursor", [
+    raw_cursor(["size", "big", 1]),
+    raw_cursor(["name", "a.jpg", 1]),
+    "not base64 at all!",
+])
+def test_gallery_rejects_bad_cursor(logged_in, folder, photos, cursor):
+    # Starting over at page 1 would show the client photos it already has
+    response = logged_in.get(f"/folder/view/{folder.folder_key}/photos", query_string={"sort": "size", "cursor": cursor})
+    assert response.status_code == 400
+    assert not response.get_json()["success"]
+
+def test_invalid_cursor_raises(photos, folder):
+    with pytest.raises(InvalidCursor):
+        get_photo_page(folder.id, "size", raw_cursor(["size", "big", 1]))
+
+@pytest.mark.parametrize("limit", [0, -1, -2])
+def test_gallery_rejects_limit_below_one(logged_in, folder, photos, limit):
+    response = logged_in.get(f"/folder/view/{folder.folder_key}/photos?limit={limit}")
+    assert response.status_code == 400
+
+@pytest.mark.parametrize("limit, size", [(-2, 1), (0, 11), (1000, 11)])
+def test_page_size_is_clamped(app, photos, folder, monkeypatch, limit, size):
+    monkeypatch.setitem(app.config, "PHOTOS_PER_PAGE", 20)
+    page, _ = get_photo_page(folder.id, limit=limit)
+    assert len(page) == size
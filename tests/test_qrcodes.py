@@ -0,0 +1,58 @@
+import os
+import time
+
+import deletion
+from qrcodes import sweep_qr_codes
+
+from conftest import make_folder
+
+def test_folder_qr_is_served_without_queries(client, folder, query_count):
+    url = f"/folder/qr/{folder.folder_key}.png"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.mimetype == "image/png"
+    # One lookup fills the folder's snapshot; repeats are served from it
+    assert query_count(first) <= 1
+    assert query_count(client.get(url)) == 0
+
+    revalidated = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert query_count(revalidated) == 0
+
+def test_unknown_folder_qr_is_404(client, app):
+    assert client.get("/folder/qr/no-such-folder.svg").status_code == 404
+
+def test_sweep_removes_only_unused_files(app, user, folder, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "QR_CODE_FOLDER", str(tmp_path))
+    legacy = make_folder(user, qr_code_url="/static/qr_codes/1b4e28ba-2fa1-11d2-883f-0016d3cca427.png")
+    kept = [
+        f"{folder.folder_key}-0123abcd.png",
+        f"{folder.folder_key}-4567cdef.svg",
+        f"{legacy.folder_key}.png",
+        "1b4e28ba-2fa1-11d2-883f-0016d3cca427.png",
+    ]
+    orphans = ["0f1e2d3c4b5a69788796a5b4c3d2e1f0-0123abcd.png", "deleted-folder.png", "9a8b7c6d.png"]
+    for name in kept + orphans:
+        (tmp_path / name).write_bytes(b"x" * 10)
+
+    # Too new to judge: its folder may still be being created
+    young = tmp_path / "being-created-0123abcd.png"
+    young.write_bytes(b"x")
+    old = time.time() - 3600
+    for name in kept + orphans:
+        os.utime(tmp_path / name, (old, old))
+
+    stats = sweep_qr_codes(batch_size=2, min_age=60)
+    assert stats == {"scanned": 7, "removed": 3, "bytes_reclaimed": 30}
+    assert sorted(os.listdir(tmp_path)) == sorted(kept + [young.name])
+
+def test_deleted_folder_loses_its_qr_files(app, logged_in, folder, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "QR_CODE_FOLDER", str(tmp_path))
+    assert logged_in.get(f"/folder/qr/{folder.folder_key}.png").status_code == 200
+    assert logged_in.get(f"/folder/qr/{folder.folder_key}.svg").status_code == 200
+    assert len(os.listdir(tmp_path)) == 2
+
+    logged_in.get(f"/folder/delete/{folder.id}", headers={"Accept": "application/json"})
+    deletion.remove_deleted_files()
+    assert os.listdir(tmp_path) == []
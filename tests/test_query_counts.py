@@ -0,0 +1,81 @@
+import io
+
+import pytest
+
+from app import db
+from models import User, PhotoFolder
+
+from conftest import make_folder, make_photos, make_jpeg, upload
+
+# The pages below must run a fixed number of queries however many rows they
+# show; each one is requested for a small and a large data set and both
+# counts have to match (and stay within the endpoint's QUERY_BUDGETS entry)
+
+@pytest.fixture
+def admin(user):
+    user.is_admin = True
+    db.session.commit()
+    return user
+
+def measure(client, url, query_count):
+    # Requests share the test's session here; start from an empty one as a real request does
+    db.session.remove()
+    return query_count(client.get(url))
+
+def counts_for(client, url, query_count, grow):
+    """Query counts of `url` before and after `grow()` adds rows."""
+    client.get(url)  # Fill per-process caches first
+    before = measure(client, url, query_count)
+    grow()
+    return before, measure(client, url, query_count)
+
+def test_scan_page(client, folder, query_count):
+    url = f"/scan/{folder.folder_key}"
+    assert client.get(url).status_code == 200
+    # Served from the folder snapshot
+    assert query_count(client.get(url)) == 0
+
+@pytest.mark.parametrize("path", ["", "/photos", "/photos?sort=name", "/photos?sort=size"])
+def test_gallery(logged_in, folder, query_count, path):
+    make_photos(folder, 2)
+    url = f"/folder/view/{folder.folder_key}{path}"
+    before, after = counts_for(logged_in, url, query_count, lambda: make_photos(folder, 30))
+    assert before == after
+
+def test_gallery_next_page(logged_in, folder, query_count):
+    make_photos(folder, 60)
+    url = f"/folder/view/{folder.folder_key}/photos?limit=10"
+    next_url = logged_in.get(url).get_json()["next_url"]
+    assert measure(logged_in, next_url, query_count) == measure(logged_in, url, query_count)
+
+def test_admin_dashboard(logged_in, admin, folder, query_count):
+    make_photos(folder, 2)
+
+    def grow():
+        for index in range(5):
+            other = User(email=f"other-{index}@example.com", name=f"Other {index}")
+            other.set_password("password")
+            db.session.add(other)
+            db.session.commit()
+            make_photos(make_folder(other), 3)
+
+    before, after = counts_for(logged_in, "/admin", query_count, grow)
+    assert before == after
+
+def test_upload(client, folder, query_count):
+    folder_id = folder.id
+    upload(client, folder, make_jpeg(0))  # Fills the folder snapshot
+    db.session.remove()
+    first = query_count(upload(client, db.session.get(PhotoFolder, folder_id), make_jpeg(1)))
+
+    make_photos(db.session.get(PhotoFolder, folder_id), 30)
+    db.session.remove()
+    assert query_count(upload(client, db.session.get(PhotoFolder, folder_id), make_jpeg(2))) == first
+
+def test_batch_upload(client, folder, query_count):
+    response = client.post("/upload/batch", data={
+        "folder_id": folder.folder_key,
+        "files": [(io.BytesIO(make_jpeg(index)), f"{index}.jpg") for index in range(5)],
+    }, content_type="multipart/form-data")
+    assert response.get_json()["uploaded"] == 5
+    query_count(response)
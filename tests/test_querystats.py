@@ -0,0 +1,66 @@
+import logging
+
+import pytest
+
+import querystats
+from app import db
+
+@pytest.fixture
+def admin(user):
+    user.is_admin = True
+    db.session.commit()
+    return user
+
+def test_metrics_are_private_by_default(client, logged_in):
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 401
+    # Logged in, but not an admin
+    assert logged_in.get("/metrics").status_code == 401
+
+def test_admin_can_read_metrics(logged_in, admin, folder):
+    logged_in.get(f"/scan/{folder.folder_key}")
+    response = logged_in.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert 'photobooth_requests_total{endpoint="scan"}' in response.get_data(as_text=True)
+
+def test_scraper_needs_the_configured_token(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "s3cret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+def totals(endpoint):
+    return dict(querystats._totals.get(endpoint, querystats._new_totals()))
+
+def test_responses_report_their_queries(client, folder, app, monkeypatch):
+    response = client.get(f"/scan/{folder.folder_key}")
+    assert int(response.headers["X-DB-Query-Count"]) >= 0
+    assert float(response.headers["X-DB-Time-Ms"]) >= 0
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+
+    monkeypatch.setitem(app.config, "QUERY_STATS_HEADERS", False)
+    response = client.get(f"/scan/{folder.folder_key}")
+    assert "X-DB-Query-Count" not in response.headers
+    assert "Server-Timing" not in response.headers
+
+def test_request_over_budget_is_logged(logged_in, folder, app, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, "QUERY_BUDGETS", {"view_folder": 0})
+    before = totals("view_folder")
+
+    with caplog.at_level(logging.WARNING, logger="querystats"):
+        response = logged_in.get(f"/folder/view/{folder.folder_key}")
+    assert int(response.headers["X-DB-Query-Count"]) > 0
+
+    record = next(record for record in caplog.records if record.name == "querystats")
+    assert "over its budget of 0" in record.getMessage()
+    assert record.slowest_statement.lstrip().upper().startswith("SELECT")
+    after = totals("view_folder")
+    assert after["requests"] == before["requests"] + 1
+    assert after["over_budget"] == before["over_budget"] + 1
+
+def test_streamed_body_is_recorded_once_sent(logged_in, folder):
+    before = totals("download_folder")
+    response = logged_in.get(f"/folder/download/{folder.folder_key}.zip")
+    response.get_data()
+    response.close()
+    assert totals("download_folder")["requests"] == before["requests"] + 1
@@ -0,0 +1,120 @@
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import deletion
+import expiry
+import resumable
+from app import db
+from models import Photo, UploadSession, FileTombstone
+
+from conftest import make_jpeg
+
+@pytest.fixture
+def data():
+    return make_jpeg(1)
+
+@pytest.fixture
+def upload_id(client, folder, data, app, monkeypatch):
+    """A session with every chunk of `data` received."""
+    monkeypatch.setitem(app.config, "RESUMABLE_CHUNK_SIZE", 256)
+    response = client.post("/upload/resumable", json={
+        "folder_id": folder.folder_key, "filename": "big.jpg", "size": len(data)
+    })
+    upload_id = response.get_json()["upload_id"]
+    for index in range(response.get_json()["chunk_count"]):
+        client.put(f"/upload/resumable/{upload_id}/chunks/{index}", data=data[index * 256:(index + 1) * 256])
+    return upload_id
+
+def finalize(client, upload_id):
+    return client.post(f"/upload/resumable/{upload_id}/finalize")
+
+def test_retried_finalize_returns_the_same_photo(client, upload_id):
+    first = finalize(client, upload_id).get_json()
+    second = finalize(client, upload_id).get_json()
+
+    assert first["success"] and second["success"]
+    assert first["photo_id"] == second["photo_id"]
+    assert Photo.query.count() == 1
+
+def test_concurrent_finalizes_create_one_photo(app, upload_id, monkeypatch):
+    # Both requests pass the completed_at check before either claims the session
+    barrier = threading.Barrier(2, timeout=10)
+    claim_session = resumable.claim_session
+    def claim_together(session):
+        barrier.wait()
+        return claim_session(session)
+    monkeypatch.setattr(resumable, "claim_session", claim_together)
+    db.session.remove()
+
+    responses = []
+    def run():
+        responses.append(finalize(app.test_client(), upload_id))
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses in ([200, 200], [200, 409])
+    assert Photo.query.count() == 1
+
+def test_claimed_session_rejects_finalize_and_chunks(client, upload_id):
+    UploadSession.query.filter_by(id=upload_id).update({"state": UploadSession.STATE_FINALIZING})
+    db.session.commit()
+
+    assert finalize(client, upload_id).status_code == 409
+    assert client.put(f"/upload/resumable/{upload_id}/chunks/0", data=b"x").status_code == 409
+    assert Photo.query.count() == 0
+
+def test_failed_finalize_releases_the_claim(client, upload_id, data):
+    shutil.rmtree(resumable.chunk_dir(upload_id))
+    response = finalize(client, upload_id)
+    assert response.status_code == 409
+    assert "Missing chunks" in response.get_json()["error"]
+    assert db.session.get(UploadSession, upload_id).state == UploadSession.STATE_OPEN
+
+    for index in range(0, len(data), 256):
+        client.put(f"/upload/resumable/{upload_id}/chunks/{index // 256}", data=data[index:index + 256])
+    assert finalize(client, upload_id).get_json()["success"]
+    assert db.session.get(UploadSession, upload_id).state == UploadSession.STATE_COMPLETE
+
+def test_expired_sessions_are_purged_and_their_chunks_removed(client, upload_id):
+    UploadSession.query.filter_by(id=upload_id).update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    chunks = resumable.chunk_dir(upload_id)
+    assert os.path.isdir(chunks)
+
+    assert resumable.purge_expired_sessions(batch_size=1) == 1
+    assert db.session.get(UploadSession, upload_id) is None
+    assert FileTombstone.query.filter_by(path=chunks).count() == 1
+
+    deletion.remove_deleted_files()
+    assert not os.path.exists(chunks)
+    assert resumable.purge_expired_sessions() == 0
+
+def test_completed_session_queues_its_chunks(client, upload_id):
+    assert finalize(client, upload_id).get_json()["success"]
+    chunks = resumable.chunk_dir(upload_id)
+    assert FileTombstone.query.filter_by(path=chunks).count() == 1
+
+    deletion.remove_deleted_files()
+    assert not os.path.exists(chunks)
+
+def test_expiry_scheduler_purges_upload_sessions(app, monkeypatch):
+    purges = []
+    monkeypatch.setitem(app.config, "FOLDER_EXPIRY_INTERVAL", 0.01)
+    def purge():
+        purges.append(True)
+        expiry._stop_event.set()
+    monkeypatch.setattr(expiry, "purge_expired_sessions", purge)
+    expiry._stop_event.clear()
+    try:
+        expiry._scheduler_loop()
+    finally:
+        expiry._stop_event.clear()
+    assert purges
@@ -0,0 +1,53 @@
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import folder_cache
+from app import db
+
+from conftest import make_folder
+
+@pytest.fixture
+def writes(app):
+    """Statements other than SELECT run while the test is going."""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", record)
+
+def scan_token(page):
+    return re.search(r'id="token" value="([^"]+)"', page).group(1)
+
+def test_scan_page_never_writes(client, folder, writes):
+    for _ in range(3):
+        response = client.get(f"/scan/{folder.folder_key}")
+        assert response.status_code == 200
+        assert folder.folder_name in response.get_data(as_text=True)
+    assert writes == []
+
+@pytest.mark.parametrize("fields, reason", [
+    ({"qr_code_expires_at": datetime.utcnow() - timedelta(minutes=1)}, "The QR code has expired."),
+    ({"qr_code_active": False}, "manually deactivated"),
+])
+def test_closed_folder_is_shown_without_writing(client, user, writes, fields, reason):
+    folder = make_folder(user, **fields)
+    writes.clear()
+    page = client.get(f"/scan/{folder.folder_key}").get_data(as_text=True)
+    assert reason in page
+    assert writes == []
+
+def test_scan_token_rotates_with_the_session_window(client, folder, monkeypatch):
+    now = 1_700_000_000 - 1_700_000_000 % 60
+    monkeypatch.setattr(folder_cache.time, "time", lambda: now)
+    url = f"/scan/{folder.folder_key}"
+    first = scan_token(client.get(url).get_data(as_text=True))
+
+    monkeypatch.setattr(folder_cache.time, "time", lambda: now + 59)
+    assert scan_token(client.get(url).get_data(as_text=True)) == first
+    monkeypatch.setattr(folder_cache.time, "time", lambda: now + 60)
+    assert scan_token(client.get(url).get_data(as_text=True)) != first
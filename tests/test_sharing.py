@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+import sharing
+from app import db
+from models import Photo, RevokedShare, User
+from sharing import generate_share_token, decode_share_token, share_max_age
+
+from conftest import make_photos
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    """Each test starts with no cached pages and a denylist due for reloading."""
+    monkeypatch.setattr(sharing, "_pages", type(sharing._pages)())
+    monkeypatch.setattr(sharing, "_denylist", set())
+    monkeypatch.setattr(sharing, "_denylist_expires", 0)
+
+@pytest.fixture
+def photo(folder):
+    return make_photos(folder, 1)[0]
+
+def share_url(photo, **kwargs):
+    return f"/shared/{generate_share_token(photo.id, **kwargs)}"
+
+def test_token_round_trip(app, photo):
+    token = generate_share_token(photo.id, ttl=60)
+    assert len(token) == 27
+    share = decode_share_token(token)
+    assert share.photo_id == photo.id
+    assert share.expires_at - time.time() == pytest.approx(60, abs=2)
+
+def test_forged_and_malformed_tokens_are_refused(app, photo):
+    token = generate_share_token(photo.id)
+    # Another photo id under the same signature
+    forged = token[:4] + ("A" if token[4] != "A" else "B") + token[5:]
+    assert decode_share_token(forged) is None
+    assert decode_share_token(token[:-2]) is None
+    assert decode_share_token("not a token!") is None
+
+    app.secret_key, secret = "another-secret", app.secret_key
+    try:
+        assert decode_share_token(token) is None
+    finally:
+        app.secret_key = secret
+
+def test_expired_token_is_refused(app, photo, monkeypatch):
+    token = generate_share_token(photo.id, ttl=60)
+    now = time.time()
+    monkeypatch.setattr(sharing.time, "time", lambda: now + 61)
+    assert decode_share_token(token) is None
+
+def test_anonymous_page_is_rendered_once_and_cached(client, photo):
+    url = share_url(photo)
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.cache_control.public
+    assert first.cache_control.max_age == 300
+
+    again = client.get(url)
+    assert again.get_data() == first.get_data()
+    assert int(again.headers["X-DB-Query-Count"]) == 0
+    assert client.get(url, headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+def test_logged_in_page_is_private(logged_in, photo):
+    response = logged_in.get(share_url(photo))
+    assert response.cache_control.private and response.cache_control.no_cache
+
+def test_cache_lifetime_never_outlasts_the_token(app, photo):
+    share = decode_share_token(generate_share_token(photo.id, ttl=100))
+    assert share_max_age(share) == pytest.approx(100, abs=2)
+
+def test_revoked_link_stops_working(logged_in, client, photo, monkeypatch):
+    url = share_url(photo)
+    assert client.get(url).status_code == 200
+
+    # Requests share the test's session; start from an empty one as a real request does
+    db.session.remove()
+    response = logged_in.post(f"{url}/revoke", headers={"Accept": "application/json"})
+    assert response.get_json()["success"]
+    assert RevokedShare.query.count() == 1
+    assert client.get(url).status_code == 302
+
+    # Another process learns of it when its denylist is reloaded
+    monkeypatch.setattr(sharing, "_denylist", set())
+    monkeypatch.setattr(sharing, "_denylist_expires", 0)
+    assert decode_share_token(url.rsplit("/", 1)[1]) is None
+
+    # Revoking again is harmless
+    assert logged_in.post(f"{url}/revoke", headers={"Accept": "application/json"}).status_code == 400
+
+def test_only_the_owner_can_revoke(client, photo):
+    other = User(email="other@example.com", name="Other")
+    other.set_password("password")
+    db.session.add(other)
+    db.session.commit()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(other.id)
+
+    url = share_url(photo)
+    assert client.post(f"{url}/revoke", headers={"Accept": "application/json"}).status_code == 403
+    assert RevokedShare.query.count() == 0
+    assert db.session.get(Photo, photo.id) is not None
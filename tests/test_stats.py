@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import stats
+from app import db
+from models import Photo, User
+
+from conftest import make_folder, make_photos
+
+@pytest.fixture
+def admin(user):
+    user.is_admin = True
+    db.session.commit()
+    stats.invalidate_dashboard_summary()
+    yield user
+    stats.invalidate_dashboard_summary()
+
+def test_summary_totals(app, user, folder):
+    make_folder(user, qr_code_active=False)
+    photos = make_photos(folder, 3)
+    photos[0].uploaded_at = datetime.utcnow() - timedelta(days=1)
+    # Older than the chart, but still counted in the totals
+    photos[1].uploaded_at = datetime.utcnow() - timedelta(days=app.config["ADMIN_STATS_DAYS"] + 1)
+    db.session.commit()
+
+    summary = stats.compute_dashboard_summary()
+    assert summary["user_count"] == 1
+    assert (summary["folder_count"], summary["active_folder_count"]) == (2, 1)
+    assert summary["photo_count"] == 3
+    assert summary["total_bytes"] == sum(photo.file_size for photo in photos)
+
+    per_day = summary["uploads_per_day"]
+    assert len(per_day) == app.config["ADMIN_STATS_DAYS"]
+    assert [day["count"] for day in per_day[-2:]] == [1, 1]
+    assert sum(day["count"] for day in per_day) == 2
+
+def test_summary_is_cached_until_invalidated(admin, folder):
+    first = stats.get_dashboard_summary()
+    make_photos(folder, 2)
+    assert stats.get_dashboard_summary() is first
+
+    stats.invalidate_dashboard_summary()
+    assert stats.get_dashboard_summary()["photo_count"] == 2
+
+def test_dashboard_pages_its_tables(logged_in, admin, app, monkeypatch):
+    monkeypatch.setitem(app.config, "ADMIN_PAGE_SIZE", 2)
+    for index in range(4):
+        db.session.add(User(email=f"other-{index}@example.com", name=f"Other {index}", password_hash="x"))
+    db.session.commit()
+
+    page = logged_in.get("/admin").get_data(as_text=True)
+    assert page.count("@example.com</td>") == 2
+    last = logged_in.get("/admin?users_page=3").get_data(as_text=True)
+    assert last.count("@example.com</td>") == 1
+
+def test_dashboard_requires_an_admin(logged_in):
+    response = logged_in.get("/admin")
+    assert response.status_code == 302
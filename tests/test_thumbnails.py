@@ -0,0 +1,68 @@
+import io
+import os
+
+from PIL import Image
+
+import thumbnails
+from app import db
+from models import Photo, PhotoThumbnail
+
+from conftest import make_jpeg, make_photos, upload
+
+def thumbnail_url(app, photo, width, fmt):
+    with app.test_request_context():
+        return thumbnails.thumbnail_url(photo, width, fmt)
+
+def test_thumbnail_is_made_on_first_request(app, client, folder):
+    photo_id = upload(client, folder, make_jpeg(1, (800, 600))).get_json()["photo_id"]
+    photo = db.session.get(Photo, photo_id)
+    url = thumbnail_url(app, photo, 320, "webp")
+
+    # Requests share the test's session; start from an empty one as a real request does
+    db.session.remove()
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.mimetype == "image/webp"
+    with Image.open(io.BytesIO(first.get_data())) as img:
+        assert img.size == (320, 240)
+    thumb = PhotoThumbnail.query.filter_by(photo_id=photo_id).one()
+    assert (thumb.width, thumb.format) == (320, "webp")
+
+    # Later requests are served from disk without touching the database
+    second = client.get(url)
+    assert second.get_data() == first.get_data()
+    assert int(second.headers["X-DB-Query-Count"]) == 0
+
+def test_removed_thumbnail_is_made_again(app, client, folder):
+    photo_id = upload(client, folder, make_jpeg(1, (800, 600))).get_json()["photo_id"]
+    url = thumbnail_url(app, db.session.get(Photo, photo_id), 640, "jpeg")
+    db.session.remove()
+    assert client.get(url).status_code == 200
+
+    os.remove(PhotoThumbnail.query.one().file_path)
+    db.session.remove()
+    assert client.get(url).status_code == 200
+    assert PhotoThumbnail.query.count() == 1
+
+def test_unknown_sizes_and_keys_are_not_found(app, client, folder):
+    photo_id = upload(client, folder, make_jpeg(1)).get_json()["photo_id"]
+    photo = db.session.get(Photo, photo_id)
+    key = thumbnails.thumbnail_key(photo)
+
+    assert client.get(f"/photo/thumbnail/{photo_id}/{key}/321.webp").status_code == 404
+    assert client.get(f"/photo/thumbnail/{photo_id}/{key}/320.gif").status_code == 404
+    assert client.get(f"/photo/thumbnail/{photo_id}/guessed/320.webp").status_code == 404
+    assert PhotoThumbnail.query.count() == 0
+
+def test_photo_without_local_copy_falls_back_to_the_original(app, client, folder):
+    photo = make_photos(folder, 1)[0]
+    response = client.get(thumbnail_url(app, photo, 320, "jpeg"))
+    assert response.status_code == 302
+    assert response.location == photo.file_url
+
+def test_srcset_lists_every_width(app, folder):
+    photo = make_photos(folder, 1)[0]
+    with app.test_request_context():
+        srcset = thumbnails.thumbnail_srcset(photo, "webp", max_width=640)
+    assert srcset.count(".webp") == 2
+    assert srcset.endswith("640.webp 640w")
@@ -0,0 +1,97 @@
+import io
+import zipfile
+
+import pytest
+
+import zipexport
+from app import db
+from models import Photo, User
+
+from conftest import make_folder, make_jpeg, upload
+
+@pytest.fixture
+def archive_url(logged_in, folder):
+    for seed in (1, 2, 3):
+        upload(logged_in, folder, make_jpeg(seed, (200 + seed, 100)), "party.jpg")
+    return f"/folder/download/{folder.folder_key}.zip"
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Ids of the photos read by exports."""
+    photo_ids = []
+    stream_photo = zipexport.stream_photo
+    def counting_stream(photo, offset=0):
+        photo_ids.append(photo.id)
+        return stream_photo(photo, offset)
+    monkeypatch.setattr(zipexport, "stream_photo", counting_stream)
+    return photo_ids
+
+def test_archive_holds_every_photo(logged_in, archive_url):
+    response = logged_in.get(archive_url)
+    data = response.get_data()
+    assert response.content_length == len(data)
+    assert 'filename=' in response.headers["Content-Disposition"]
+
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.testzip() is None
+    assert archive.namelist() == ["party.jpg", "party (2).jpg", "party (3).jpg"]
+    for info, photo in zip(archive.infolist(), Photo.query.order_by(Photo.id)):
+        with open(photo.local_path, "rb") as f:
+            assert archive.read(info) == f.read()
+
+def test_ranges_match_the_full_archive(logged_in, archive_url):
+    full = logged_in.get(archive_url)
+    data = full.get_data()
+    etag = full.headers["ETag"]
+
+    for header, expected in (
+        ("bytes=100-199", data[100:200]),
+        ("bytes=-50", data[-50:]),
+        (f"bytes={len(data) // 2}-", data[len(data) // 2:]),
+    ):
+        response = logged_in.get(archive_url, headers={"Range": header, "If-Range": etag})
+        assert response.status_code == 206
+        assert response.get_data() == expected
+
+    # A range taken from another version of the archive gets the whole thing
+    stale = logged_in.get(archive_url, headers={"Range": "bytes=100-199", "If-Range": '"other"'})
+    assert stale.status_code == 200
+    assert stale.get_data() == data
+
+    assert logged_in.get(archive_url, headers={"Range": f"bytes={len(data)}-"}).status_code == 416
+
+def test_known_crcs_let_ranges_skip_photos(logged_in, archive_url, reads):
+    data = logged_in.get(archive_url).get_data()
+    assert len(reads) == 3
+    assert all(photo.crc32 is not None for photo in Photo.query)
+
+    # Resuming in the central directory reads no photo at all
+    reads.clear()
+    response = logged_in.get(archive_url, headers={"Range": f"bytes={len(data) - 100}-"})
+    assert response.get_data() == data[-100:]
+    assert reads == []
+
+def test_range_before_crcs_are_known(logged_in, archive_url, reads):
+    # The tail needs every CRC, so each photo is read once to compute them
+    response = logged_in.get(archive_url, headers={"Range": "bytes=-200"})
+    assert response.status_code == 206
+    tail = response.get_data()
+    assert len(reads) == 3
+
+    # They were saved when the response was closed
+    assert logged_in.get(archive_url, headers={"Range": "bytes=-200"}).get_data() == tail
+    assert len(reads) == 3
+
+def test_other_users_cannot_download(client, archive_url):
+    other = User(email="other@example.com", name="Other")
+    other.set_password("password")
+    db.session.add(other)
+    db.session.commit()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(other.id)
+    assert client.get(archive_url).status_code == 302
+
+def test_empty_folder(logged_in, user):
+    folder = make_folder(user)
+    archive = zipfile.ZipFile(io.BytesIO(logged_in.get(f"/folder/download/{folder.folder_key}.zip").get_data()))
+    assert archive.namelist() == []
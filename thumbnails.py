@@ -0,0 +1,220 @@
+import os
+import queue
+import logging
+import threading
+
+from flask import url_for
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import Photo, PhotoThumbnail
+from imaging import render_thumbnails
+from imagepool import run, submit, ImageQueueFull
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Pillow format name and file extension for each supported thumbnail format
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+def thumbnail_key(photo):
+    """Return the unguessable directory name holding a photo's thumbnails."""
+    return os.path.splitext(photo.file_name)[0]
+
+def thumbnail_dir(key):
+    """Return the directory holding the thumbnails for a key."""
+    return os.path.join(app.config['THUMBNAIL_FOLDER'], key)
+
+def thumbnail_path(key, width, fmt):
+    """Return the file path of a thumbnail."""
+    return os.path.join(thumbnail_dir(key), f"{width}.{FORMATS[fmt][1]}")
+
+# Finished background thumbnail jobs, (photo id, future), waiting for their rows
+# to be written by the recorder thread started on first use
+_finished = queue.Queue()
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def is_valid_size(width, fmt):
+    """Check that a requested width and format are ones we generate."""
+    return width in app.config['THUMBNAIL_WIDTHS'] and fmt in FORMATS
+
+def _source_path(photo):
+    """Return the local file to resize, or None if only a remote copy exists."""
+    if photo.local_path and os.path.exists(photo.local_path):
+        return photo.local_path
+    return None
+
+def _targets(photo, widths, formats, existing=()):
+    """List the (width, format, Pillow format, path) of the thumbnails a photo is missing.
+
+    `existing` holds the (width, format) pairs the photo already has.
+    """
+    key = thumbnail_key(photo)
+    return [
+        (width, fmt, FORMATS[fmt][0], thumbnail_path(key, width, fmt))
+        for width in widths for fmt in formats
+        if (width, fmt) not in existing
+    ]
+
+def _add_rows(photo_id, written):
+    """Add the PhotoThumbnail rows for files written by render_thumbnails."""
+    created = []
+    for width, fmt, file_path, file_size in written:
+        thumb = PhotoThumbnail(
+            photo_id=photo_id,
+            width=width,
+            format=fmt,
+            file_path=file_path,
+            file_size=file_size
+        )
+        db.session.add(thumb)
+        created.append(thumb)
+    return created
+
+def generate_thumbnails(photo, widths=None, formats=None):
+    """Create the missing thumbnails for a photo and wait for them.
+
+    The resizing runs in the image worker processes (see imagepool.py); the
+    source image is decoded once and resized for every width and format.
+    New rows are added to the session; the caller commits. The photo must
+    be loaded with selectinload(Photo.thumbnails).
+
+    Returns:
+        list: The PhotoThumbnail rows created
+    """
+    widths = widths or app.config['THUMBNAIL_WIDTHS']
+    formats = formats or app.config['THUMBNAIL_FORMATS']
+
+    source = _source_path(photo)
+    if source is None:
+        logger.warning(f"No local source for thumbnails of photo {photo.id}")
+        return []
+
+    existing = {(thumb.width, thumb.format) for thumb in photo.thumbnails}
+    targets = _targets(photo, widths, formats, existing)
+    if not targets:
+        return []
+
+    os.makedirs(thumbnail_dir(thumbnail_key(photo)), exist_ok=True)
+    written = run(render_thumbnails, source, targets, app.config['THUMBNAIL_QUALITY'])
+    created = _add_rows(photo.id, written)
+    photo.thumbnails.extend(created)
+
+    logger.debug(f"Created {len(created)} thumbnails for photo {photo.id}")
+    return created
+
+def _record_thumbnails(photo_id, future):
+    """Store the rows of a background thumbnail job once the workers are done."""
+    try:
+        written = future.result()
+    except Exception as e:
+        logger.error(f"Error generating thumbnails for photo {photo_id}: {str(e)}")
+        return
+
+    if db.session.get(Photo, photo_id) is None:
+        # The photo was deleted while its thumbnails were being made
+        for _, _, file_path, _ in written:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        return
+
+    try:
+        _add_rows(photo_id, written)
+        db.session.commit()
+        logger.debug(f"Created {len(written)} thumbnails for photo {photo_id}")
+    except IntegrityError:
+        # A gallery request generated them first
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error saving thumbnails for photo {photo_id}: {str(e)}")
+
+def _recorder_loop():
+    """Body of the recorder thread: write the rows of finished thumbnail jobs."""
+    while True:
+        photo_id, future = _finished.get()
+        with app.app_context():
+            try:
+                _record_thumbnails(photo_id, future)
+            finally:
+                db.session.remove()
+
+def _job_finished(photo_id, future):
+    """Done-callback of a thumbnail job.
+
+    It runs on the pool's internal thread, so it only hands the result over;
+    the database is written from the recorder thread.
+    """
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = threading.Thread(target=_recorder_loop, name="thumbnail-recorder", daemon=True)
+            _recorder.start()
+    _finished.put((photo_id, future))
+
+def queue_thumbnails(photos):
+    """Start making the thumbnails of new photos without waiting for them.
+
+    The rows are written when the image workers finish. Photos that can't be
+    queued (no local copy, or the queue is full) get their thumbnails on
+    first request instead.
+    """
+    widths = app.config['THUMBNAIL_WIDTHS']
+    formats = app.config['THUMBNAIL_FORMATS']
+
+    for photo in photos:
+        source = _source_path(photo)
+        # New photos have no thumbnail rows yet
+        targets = _targets(photo, widths, formats) if source else []
+        if not targets:
+            continue
+
+        os.makedirs(thumbnail_dir(thumbnail_key(photo)), exist_ok=True)
+        try:
+            future = submit(render_thumbnails, source, targets, app.config['THUMBNAIL_QUALITY'])
+        except ImageQueueFull:
+            logger.warning(f"Image queue full, thumbnails of photo {photo.id} will be made on request")
+            continue
+
+        future.add_done_callback(lambda future, photo_id=photo.id: _job_finished(photo_id, future))
+
+def get_thumbnail_path(photo, width, fmt):
+    """Return the path of a thumbnail, generating it on first request.
+
+    The photo must be loaded with selectinload(Photo.thumbnails).
+
+    Returns:
+        str or None: The file path, or None if the photo has no local source
+    """
+    file_path = thumbnail_path(thumbnail_key(photo), width, fmt)
+    if os.path.exists(file_path):
+        return file_path
+
+    # A row may exist for a file that was removed from disk
+    for thumb in list(photo.thumbnails):
+        if thumb.width == width and thumb.format == fmt:
+            photo.thumbnails.remove(thumb)
+    db.session.flush()
+
+    if not generate_thumbnails(photo, widths=[width], formats=[fmt]):
+        return None
+    db.session.commit()
+    return file_path
+
+@app.template_global()
+def thumbnail_url(photo, width, fmt='jpeg'):
+    """URL of one thumbnail of a photo, for use in templates."""
+    return url_for('photo_thumbnail', photo_id=photo.id, key=thumbnail_key(photo), width=width, fmt=fmt)
+
+@app.template_global()
+def thumbnail_srcset(photo, fmt='jpeg', max_width=None):
+    """`srcset` attribute value listing every thumbnail width of a photo."""
+    return ", ".join(
+        f"{thumbnail_url(photo, width, fmt)} {width}w"
+        for width in app.config['THUMBNAIL_WIDTHS']
+        if max_width is None or width <= max_width
+    )
@@ -0,0 +1,271 @@
+import os
+import zlib
+import struct
+import hashlib
+import logging
+from datetime import datetime
+from contextlib import closing
+from collections import namedtuple
+
+from app import db
+from models import Photo, photo_download_name
+from storage import stream_photo, photo_size, StorageError
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# General purpose flags: CRC and sizes follow the data (bit 3), names are UTF-8 (bit 11)
+ENTRY_FLAGS = 0x0008 | 0x0800
+
+# Field value meaning "see the ZIP64 extra field"
+ZIP64_MARKER = 0xFFFFFFFF
+
+# Unix regular file, rw-r--r--
+EXTERNAL_ATTRIBUTES = 0o100644 << 16
+
+ZipEntry = namedtuple('ZipEntry', ['photo', 'name', 'size', 'dos_date', 'dos_time', 'offset'])
+
+# Photo columns an export needs; loaded as plain rows rather than ORM objects
+EXPORT_COLUMNS = (
+    Photo.id, Photo.file_name, Photo.original_name, Photo.file_url, Photo.file_size,
+    Photo.local_path, Photo.storage_backend, Photo.storage_key, Photo.uploaded_at, Photo.crc32
+)
+
+def _dos_datetime(value):
+    """Return the (date, time) pair ZIP headers store timestamps as."""
+    if value is None or value.year < 1980:
+        value = datetime(1980, 1, 1)
+    return (
+        (value.year - 1980) << 9 | value.month << 5 | value.day,
+        value.hour << 11 | value.minute << 5 | value.second // 2
+    )
+
+def _entry_name(photo, used):
+    """Name a photo inside the archive, numbering duplicates like "a (2).jpg".
+
+    The extension is that of the stored format (see photo_download_name).
+    """
+    name = (photo.original_name or photo.file_name).replace('\\', '/').rsplit('/', 1)[-1].strip() or photo.file_name
+    name = photo_download_name(name, photo.file_name)
+    stem, extension = os.path.splitext(name)
+    candidate, number = name, 1
+    while candidate.lower() in used:
+        number += 1
+        candidate = f"{stem} ({number}){extension}"
+    used.add(candidate.lower())
+    return candidate
+
+def _overlap(data, position, start, end):
+    """Return the part of `data`, which sits at `position` in the archive, inside [start, end)."""
+    if position >= end or position + len(data) <= start:
+        return b''
+    return data[max(start - position, 0):end - position]
+
+class FolderZip:
+    """A folder's photos as an uncompressed ("stored") ZIP archive.
+
+    Photos are already compressed, so storing them costs a few percent at
+    most and lets every header be computed up front from the photo sizes:
+    the archive's length and layout are known before anything is read,
+    which is what makes Content-Length and Range requests possible.
+
+    CRCs are written after each file's data (general purpose flag bit 3),
+    so streaming can start before they are known. CRCs computed while
+    streaming are saved on the photos, and later requests for a byte range
+    only read the photos the range actually covers.
+    """
+
+    def __init__(self, folder_id):
+        photos = db.session.query(*EXPORT_COLUMNS).filter(Photo.folder_id == folder_id).order_by(Photo.id).all()
+
+        rows = []
+        resolved_sizes = {}
+        for photo in photos:
+            size = photo_size(photo)
+            if size is None:
+                logger.warning(f"Leaving photo {photo.id} out of the ZIP of folder {folder_id}: no readable copy")
+                continue
+            if size != photo.file_size:
+                resolved_sizes[photo.id] = size
+            rows.append((photo, size))
+
+        if resolved_sizes:
+            db.session.execute(db.update(Photo), [{'id': photo_id, 'file_size': size} for photo_id, size in resolved_sizes.items()])
+            db.session.commit()
+
+        self.crcs = {photo.id: photo.crc32 for photo, _ in rows if photo.crc32 is not None}
+        self.computed_crcs = {}
+
+        self.zip64 = False
+        self._layout(rows)
+        if len(self.entries) >= 0xFFFF or self.size >= ZIP64_MARKER:
+            self.zip64 = True
+            self._layout(rows)
+
+        # Same photos, names and sizes give the same bytes, so this identifies the archive
+        layout = [(entry.photo.id, entry.name, entry.size, entry.dos_date, entry.dos_time) for entry in self.entries]
+        self.etag = hashlib.sha256(repr((self.zip64, layout)).encode()).hexdigest()[:32]
+
+    def _layout(self, rows):
+        """Place every entry and compute the archive's size."""
+        used = set()
+        self.entries = []
+        offset = 0
+        for photo, size in rows:
+            name = _entry_name(photo, used)
+            dos_date, dos_time = _dos_datetime(photo.uploaded_at)
+            entry = ZipEntry(photo, name, size, dos_date, dos_time, offset)
+            self.entries.append(entry)
+            offset += self._local_header_size(entry) + size + self._descriptor_size()
+
+        self.central_directory_offset = offset
+        self.central_directory_size = sum(self._central_header_size(entry) for entry in self.entries)
+        self.size = offset + self.central_directory_size + self._end_size()
+
+    def _version(self):
+        return 45 if self.zip64 else 20
+
+    def _local_header_size(self, entry):
+        return 30 + len(entry.name.encode()) + (20 if self.zip64 else 0)
+
+    def _descriptor_size(self):
+        return 24 if self.zip64 else 16
+
+    def _central_header_size(self, entry):
+        return 46 + len(entry.name.encode()) + (28 if self.zip64 else 0)
+
+    def _end_size(self):
+        return 22 + (56 + 20 if self.zip64 else 0)
+
+    def _local_header(self, entry):
+        name = entry.name.encode()
+        size_field = ZIP64_MARKER if self.zip64 else 0
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0) if self.zip64 else b''
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, self._version(), ENTRY_FLAGS, 0,
+            entry.dos_time, entry.dos_date, 0, size_field, size_field, len(name), len(extra)
+        ) + name + extra
+
+    def _descriptor(self, entry):
+        crc = self.crcs[entry.photo.id]
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, crc, entry.size, entry.size)
+        return struct.pack('<IIII', 0x08074b50, crc, entry.size, entry.size)
+
+    def _central_header(self, entry):
+        name = entry.name.encode()
+        if self.zip64:
+            size_field = offset_field = ZIP64_MARKER
+            extra = struct.pack('<HHQQQ', 0x0001, 24, entry.size, entry.size, entry.offset)
+        else:
+            size_field, offset_field, extra = entry.size, entry.offset, b''
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, 0x0300 | self._version(), self._version(), ENTRY_FLAGS, 0,
+            entry.dos_time, entry.dos_date, self.crcs[entry.photo.id], size_field, size_field,
+            len(name), len(extra), 0, 0, 0, EXTERNAL_ATTRIBUTES, offset_field
+        ) + name + extra
+
+    def _end(self):
+        count = len(self.entries)
+        if not self.zip64:
+            return struct.pack(
+                '<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                self.central_directory_size, self.central_directory_offset, 0
+            )
+
+        zip64_end_offset = self.central_directory_offset + self.central_directory_size
+        return struct.pack(
+            '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count,
+            self.central_directory_size, self.central_directory_offset
+        ) + struct.pack(
+            '<IIQI', 0x07064b50, 0, zip64_end_offset, 1
+        ) + struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, ZIP64_MARKER, ZIP64_MARKER, 0
+        )
+
+    def _read(self, entry, offset, need_crc, position, start, end):
+        """Yield the part of an entry's data inside [start, end), computing its CRC if needed."""
+        crc = 0
+        read = offset
+        with closing(stream_photo(entry.photo, offset)) as chunks:
+            for chunk in chunks:
+                if read + len(chunk) > entry.size:
+                    raise StorageError(f"Photo {entry.photo.id} is larger than its recorded size")
+                if need_crc:
+                    crc = zlib.crc32(chunk, crc)
+                data = _overlap(chunk, position + read, start, end)
+                if data:
+                    yield data
+                read += len(chunk)
+                if not need_crc and position + read >= end:
+                    return
+
+        if read != entry.size:
+            raise StorageError(f"Photo {entry.photo.id} is smaller than its recorded size")
+        if need_crc:
+            self.crcs[entry.photo.id] = crc
+            self.computed_crcs[entry.photo.id] = crc
+
+    def stream(self, start=0, end=None):
+        """Yield the bytes of the archive in [start, end), in chunks.
+
+        Photos are read one chunk at a time from wherever they are stored,
+        so memory use doesn't depend on the folder's size. Photos wholly
+        outside the range are skipped unless their CRC is still unknown and
+        a later part of the range needs it.
+
+        Raises:
+            StorageError: A photo can't be read or doesn't match its size;
+                the response is cut short rather than sent corrupted
+        """
+        end = self.size if end is None else end
+        position = 0
+        try:
+            for entry in self.entries:
+                if position >= end:
+                    return
+
+                data = _overlap(self._local_header(entry), position, start, end)
+                if data:
+                    yield data
+                position += self._local_header_size(entry)
+
+                data_end = position + entry.size
+                need_crc = entry.photo.id not in self.crcs and data_end < end
+                if need_crc or (position < end and data_end > start):
+                    offset = 0 if need_crc else max(start - position, 0)
+                    yield from self._read(entry, offset, need_crc, position, start, end)
+                position = data_end
+
+                if position < end and position + self._descriptor_size() > start:
+                    yield _overlap(self._descriptor(entry), position, start, end)
+                position += self._descriptor_size()
+
+            for entry in self.entries:
+                if position >= end:
+                    return
+                header_size = self._central_header_size(entry)
+                if position + header_size > start:
+                    yield _overlap(self._central_header(entry), position, start, end)
+                position += header_size
+
+            data = _overlap(self._end(), position, start, end)
+            if data:
+                yield data
+        except StorageError as e:
+            logger.error(f"Folder ZIP export stopped: {str(e)}")
+            raise
+        finally:
+            self.save_crcs()
+
+    def save_crcs(self):
+        """Store the CRCs computed while streaming, so range requests can skip those photos."""
+        if not self.computed_crcs:
+            return
+        try:
+            db.session.execute(db.update(Photo), [{'id': photo_id, 'crc32': crc} for photo_id, crc in self.computed_crcs.items()])
+            db.session.commit()
+            self.computed_crcs = {}
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving photo CRCs: {str(e)}")